@@ -0,0 +1,195 @@
+'''
+
+Copyright (C) 2019 Vanessa Sochat.
+
+This Source Code Form is subject to the terms of the
+Mozilla Public License, v. 2.0. If a copy of the MPL was not distributed
+with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+'''
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import (
+    BaseCommand,
+    CommandError
+)
+from django.db import transaction
+from rest_framework.test import (
+    APIRequestFactory,
+    force_authenticate
+)
+from fg.apps.api.urls.routers import router
+from fg.apps.factory.management.commands.benchmark_imports import generate_plates_json
+from fg.apps.factory.views.factory import import_plates_task
+from fg.apps.main.models import (
+    Author,
+    Collection,
+    CompositePart,
+    Container,
+    Distribution,
+    Institution,
+    Module,
+    Operation,
+    Organism,
+    Part,
+    Plan,
+    Plate,
+    Protocol,
+    Robot,
+    Schema,
+    Tag
+)
+from fg.apps.main.utils import capture_queries
+from fg.apps.orders.models import Order
+
+from contextlib import redirect_stdout
+from io import StringIO
+import uuid
+
+
+class Command(BaseCommand):
+    '''Check that every API endpoint (list and detail) stays within the
+       query_budget declared by its viewset, and that the number of queries
+       for a list doesn't grow with the page size (e.g., a serializer field
+       that looks up related objects for each instance). Synthetic data is
+       added in a transaction that is rolled back, so the database is not
+       changed.
+
+       usage: python manage.py check_query_budgets
+              python manage.py check_query_budgets --count 10
+
+       The command exits with an error if any endpoint is over budget.
+    '''
+    help = "Check the number of queries for each API endpoint"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', dest='count', type=int, default=5,
+                            help="number of instances to add (and list) for each model")
+
+    def handle(self, *args, **options):
+        count = options['count']
+        if count < 2:
+            raise CommandError("The count must be at least 2 to compare page sizes.")
+
+        with transaction.atomic():
+            self.seed(count)
+            user = get_user_model().objects.create(username="budget-%s" % uuid.uuid4(),
+                                                   is_staff=True, is_superuser=True)
+            results = [self.check_endpoint(prefix, viewset, user, count)
+                       for prefix, viewset, _ in router.registry]
+            transaction.set_rollback(True)
+
+        print("%-20s %8s %8s %8s %8s" %("endpoint", "budget", "list:1", "list:%s" % count, "detail"))
+        errors = []
+        for result in results:
+            print("%-20s %8s %8s %8s %8s" %(result['endpoint'], result['budget'], result['first'],
+                                            result['page'], result['detail']))
+            errors += result['errors']
+
+        if errors:
+            raise CommandError("Query budget errors found:\n%s" % "\n".join(errors))
+        print("All endpoints are within their query budgets.")
+
+    def seed(self, count):
+        '''add count instances of each model with related objects, so that a
+           query per instance would be found. Plates (and their wells, samples,
+           parts, authors, and tags) are added with the plate importer.
+        '''
+        container = Container.objects.create(name="budget", container_type="lab",
+                                             description="Budget container")
+        plates = generate_plates_json(96 * count)
+        for plate in plates:
+            plate.update({'plateset': {'uuid': str(uuid.uuid4()), 'name': plate['name'], 'description': 'budget'},
+                          'distribution': {'uuid': str(uuid.uuid4()), 'name': plate['name'], 'description': 'budget'}})
+        with redirect_stdout(StringIO()):
+            result = import_plates_task(plates, container)
+        if result.startswith("Invalid"):
+            raise CommandError(result)
+
+        parts = list(Part.objects.order_by('-time_created')[:2])
+        distributions = list(Distribution.objects.order_by('-time_created')[:2])
+
+        for index in range(count):
+            name = "budget-%s-%s" %(index, uuid.uuid4())
+            tags = [Tag.objects.create(tag="%s-%s" %(name, x)) for x in range(2)]
+
+            child = Container.objects.create(name=name, container_type="room", description="budget",
+                                             parent=container)
+            for x in range(2):
+                Plate.objects.create(name="%s-%s" %(name, x), plate_type="glycerol_stock",
+                                     plate_form="standard96", status="Stocked", container=child)
+
+            author = Author.objects.create(name=name, email="%s@example.com" % name)
+            author.tags.add(*tags)
+
+            collection = Collection.objects.create(name=name)
+            collection.tags.add(*tags)
+            for part in parts:
+                part.collections.add(collection)
+                part.tags.add(*tags)
+
+            composite = CompositePart.objects.create(name=name, direction_string=">>", sequence="ATGC")
+            composite.parts.add(*parts)
+
+            Institution.objects.create(name=name)
+            Organism.objects.create(name=name, description="budget", genotype="budget")
+
+            schema = Schema.objects.create(name=name, description="budget", schema={"title": name})
+            Protocol.objects.create(description=name, schema=schema)
+
+            modules = [Module.objects.create(name="%s-%s" %(name, x), container=container,
+                                             model_id="budget", module_type="tempdeck") for x in range(2)]
+            Robot.objects.create(name=name, container=container, robot_id="budget",
+                                 server_version="1.0", left_mount=modules[0], right_mount=modules[1])
+
+            operation = Operation.objects.create(name=name, description="budget")
+            operation.plans.add(*[Plan.objects.create(name="%s-%s" %(name, x), description="budget",
+                                                      operation=operation, status="Planned") for x in range(2)])
+
+            order = Order.objects.create(name=name, notes="budget")
+            order.distributions.add(*distributions)
+
+    def count_queries(self, view, request, **kwargs):
+        '''return the number of queries to return (and render) a response
+        '''
+        with capture_queries() as queries:
+            response = view(request, **kwargs)
+            response.render()
+        if response.status_code != 200:
+            raise CommandError("%s returned %s" %(request.path, response.status_code))
+
+        # Every endpoint reads the database, so no queries means they weren't counted
+        if not queries:
+            raise CommandError("No queries were counted for %s." % request.path)
+        return len(queries)
+
+    def check_endpoint(self, prefix, viewset, user, count):
+        '''check the queries for the first list page with one instance, and with
+           count instances, and the detail for an instance.
+        '''
+        endpoint = prefix.strip('^')
+        factory = APIRequestFactory()
+        budget = getattr(viewset, 'query_budget', None)
+        result = {"endpoint": endpoint, "budget": budget, "errors": []}
+
+        queries = []
+        for limit in [1, count]:
+            request = factory.get('/api/%s/' % endpoint, {'limit': limit})
+            force_authenticate(request, user=user)
+            queries.append(self.count_queries(viewset.as_view({'get': 'list'}), request))
+        result['first'], result['page'] = queries
+
+        instance = viewset.serializer_class.Meta.model.objects.first()
+        request = factory.get('/api/%s/%s/' %(endpoint, instance.pk))
+        force_authenticate(request, user=user)
+        result['detail'] = self.count_queries(viewset.as_view({'get': 'retrieve'}), request,
+                                              pk=str(instance.pk))
+
+        if budget is None:
+            result['errors'].append("%s does not declare a query_budget" % endpoint)
+        elif max(queries + [result['detail']]) > budget:
+            result['errors'].append("%s is over its query budget of %s" %(endpoint, budget))
+        if result['first'] != result['page']:
+            result['errors'].append("%s queries grow with page size (%s for 1, %s for %s)" %(
+                                    endpoint, result['first'], result['page'], count))
+        return result
@@ -0,0 +1,301 @@
+'''
+
+Copyright (C) 2019 Vanessa Sochat.
+
+This Source Code Form is subject to the terms of the
+Mozilla Public License, v. 2.0. If a copy of the MPL was not distributed
+with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+Bulk endpoints (e.g., /api/parts/bulk/) create (POST) or update (PATCH) a
+list of instances in one request. Related instances are looked up with one
+query per related field, unique fields are checked with one query each,
+and the instances are written with bulk inserts (or bulk_update) in a
+single transaction. If any item is invalid, nothing is written and the
+errors are returned by index.
+
+'''
+
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import (
+    IntegrityError,
+    transaction
+)
+from django.utils import timezone
+from rest_framework import (
+    serializers,
+    status
+)
+from rest_framework.decorators import action
+from rest_framework.response import Response
+from rest_framework.validators import UniqueValidator
+
+from fg.apps.main.bulk import (
+    BATCH_SIZE,
+    bulk_insert,
+    bulk_link
+)
+from fg.apps.main.statistics import reset_statistics
+from fg.apps.main.versions import bump_versions
+from fg.settings import API_BULK_MAX
+
+import uuid
+
+
+class RelatedLookup(object):
+    '''a stand in for the queryset of a related field, with the instances
+       for all items in a bulk request already looked up by primary key.
+       A related field calls get(pk=...) for each value.
+    '''
+    def __init__(self, Model, instances):
+        self.model = Model
+        self.instances = instances
+
+    def get_key(self, pk):
+        try:
+            return str(self.model._meta.pk.to_python(pk))
+        except DjangoValidationError:
+            raise ValueError(pk)
+
+    def get(self, pk=None):
+        instance = self.instances.get(self.get_key(pk))
+        if instance is None:
+            raise self.model.DoesNotExist
+        return instance
+
+
+def get_related_fields(serializer):
+    '''return a list of (name, field) for the writable primary key related
+       fields of a serializer. For a many related field, we return the
+       field for each value.
+    '''
+    fields = []
+    for name, field in serializer.fields.items():
+        if field.read_only:
+            continue
+        if isinstance(field, serializers.ManyRelatedField):
+            fields.append((name, field.child_relation))
+        elif isinstance(field, serializers.PrimaryKeyRelatedField):
+            fields.append((name, field))
+    return fields
+
+
+def prefetch_related_fields(serializer, items):
+    '''look up the related instances for all items with one query per related
+       field, and replace the queryset of each field with the lookup.
+    '''
+    for name, field in get_related_fields(serializer):
+        values = []
+        for item in items:
+            value = item.get(name) if isinstance(item, dict) else None
+            values += value if isinstance(value, list) else [value]
+
+        Model = field.queryset.model
+        lookup = RelatedLookup(Model, {})
+        keys = set()
+        for value in values:
+            if value is None or isinstance(value, (dict, list, bool)):
+                continue
+            try:
+                keys.add(lookup.get_key(value))
+            except (TypeError, ValueError):
+                continue
+
+        if keys:
+            instances = Model.objects.in_bulk(list(keys))
+            lookup.instances = {str(pk): instance for pk, instance in instances.items()}
+        field.queryset = lookup
+
+
+def pop_unique_fields(serializer):
+    '''remove the unique validators (a query for each item) from the fields
+       of a serializer, and return the names of the fields to check together.
+    '''
+    names = []
+    for name, field in serializer.fields.items():
+        validators = [v for v in field.validators if not isinstance(v, UniqueValidator)]
+        if len(validators) != len(field.validators):
+            field.validators = validators
+            names.append(name)
+    return names
+
+
+class BulkMixin(object):
+    '''a viewset mixin to create (POST) or update (PATCH) a list of instances
+       with /bulk/. For an update, each item must include the uuid of the
+       instance, and only the fields provided are changed. Fields in
+       bulk_exclude can't be changed in bulk (use the instance endpoint).
+
+       The writes skip save and signals, so a viewset can redo what they
+       would do with bulk_saving (before the instances are written) and
+       bulk_saved (after), given the instances, if they were created, and
+       the names of the fields provided.
+    '''
+    bulk_exclude = ()
+
+    @action(detail=False, methods=['post', 'patch'])
+    def bulk(self, request):
+        items = request.data
+        if not isinstance(items, list) or not items:
+            return Response({"detail": "A list of items is required."},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        if len(items) > API_BULK_MAX:
+            return Response({"detail": "A maximum of %s items can be provided." % API_BULK_MAX},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        created = request.method == "POST"
+        errors = {}
+        instances = [None] * len(items)
+        if not created:
+            instances = self.get_bulk_instances(items, errors)
+
+        serializer = self.get_serializer(partial=not created)
+        validated = self.validate_bulk(serializer, items, instances, errors)
+        if errors:
+            return self.get_bulk_errors(items, errors)
+
+        try:
+            with transaction.atomic():
+                instances = self.perform_bulk(validated, instances, created)
+
+        # Another request wrote a conflicting row since the items were validated,
+        # so we validate them again to report it by index
+        except IntegrityError:
+            errors = {}
+            instances = [None] * len(items)
+            if not created:
+                instances = self.get_bulk_instances(items, errors)
+            self.validate_bulk(self.get_serializer(partial=not created), items, instances, errors)
+            if errors:
+                return self.get_bulk_errors(items, errors)
+            return Response({"detail": "The items conflict with existing data, nothing was written."},
+                            status=status.HTTP_409_CONFLICT)
+
+        return Response({"total": len(instances),
+                         "uuids": [str(instance.pk) for instance in instances]},
+                        status=status.HTTP_201_CREATED if created else status.HTTP_200_OK)
+
+    def get_bulk_errors(self, items, errors):
+        '''return a response with the errors for invalid items, by index
+        '''
+        return Response({"total": len(items),
+                         "invalid": len(errors),
+                         "errors": dict(sorted(errors.items()))}, status=status.HTTP_400_BAD_REQUEST)
+
+    def get_bulk_instances(self, items, errors):
+        '''look up the instances to update (by uuid) in one query. Items
+           without a valid (or with a repeated) uuid are added to errors.
+        '''
+        Model = self.get_serializer_class().Meta.model
+        uuids = {}
+        seen = set()
+        for index, item in enumerate(items):
+            try:
+                pk = str(uuid.UUID(str(item['uuid'])))
+            except (KeyError, TypeError, ValueError):
+                errors[index] = {"uuid": ["A valid uuid is required to update an instance."]}
+                continue
+            if pk in seen:
+                errors[index] = {"uuid": ["%s is repeated in this request." % pk]}
+                continue
+            uuids[index] = pk
+            seen.add(pk)
+
+        found = {str(pk): instance for pk, instance in Model.objects.in_bulk(list(uuids.values())).items()}
+        instances = [None] * len(items)
+        for index, pk in uuids.items():
+            instances[index] = found.get(pk)
+            if instances[index] is None:
+                errors[index] = {"uuid": ["%s %s does not exist." %(Model._meta.verbose_name, pk)]}
+        return instances
+
+    def validate_bulk(self, serializer, items, instances, errors):
+        '''validate each item with the same serializer, with related instances
+           and unique fields looked up together. Errors are added by index,
+           and we return the validated data (None for an invalid item).
+        '''
+        prefetch_related_fields(serializer, items)
+        unique = pop_unique_fields(serializer)
+
+        validated = [None] * len(items)
+        for index, item in enumerate(items):
+            if index in errors:
+                continue
+            excluded = [name for name in self.bulk_exclude if instances[index] and name in item]
+            if excluded:
+                errors[index] = {name: ["%s can't be changed in bulk." % name] for name in excluded}
+                continue
+            try:
+                validated[index] = serializer.run_validation(item)
+            except serializers.ValidationError as error:
+                errors[index] = error.detail
+
+        Model = serializer.Meta.model
+        for name in unique:
+            source = serializer.fields[name].source
+            values = {index: data[source] for index, data in enumerate(validated)
+                      if data is not None and data.get(source) is not None}
+            existing = dict(Model.objects.filter(**{"%s__in" % source: set(values.values())})
+                                         .values_list(source, 'pk'))
+            seen = set()
+            for index, value in values.items():
+                pk = getattr(instances[index], 'pk', None)
+                if value in seen or existing.get(value, pk) != pk:
+                    errors.setdefault(index, {})[name] = ["%s with this %s already exists." %(
+                        Model._meta.verbose_name, name.replace('_', ' '))]
+                seen.add(value)
+        return validated
+
+    def perform_bulk(self, validated, instances, created):
+        '''create (or update) the instances for the validated data, and set
+           many to many fields. Returns the instances.
+        '''
+        Model = self.get_serializer_class().Meta.model
+        many = set(field.name for field in Model._meta.many_to_many)
+        fields = set()
+        links = {}
+
+        for index, data in enumerate(validated):
+            values = {name: value for name, value in data.items() if name not in many}
+            if created:
+                instances[index] = Model(**values)
+            else:
+                for name, value in values.items():
+                    setattr(instances[index], name, value)
+            for name in many.intersection(data):
+                links.setdefault(name, []).extend((instances[index].pk, related.pk) for related in data[name])
+            fields.update(data)
+
+        self.bulk_saving(instances, created, fields)
+
+        if created:
+            bulk_insert(Model, instances, ignore_conflicts=False)
+            reset_statistics([Model])
+        else:
+            updated = [name for name in fields if name not in many]
+            if updated:
+                if hasattr(Model, 'time_updated'):
+                    now = timezone.now()
+                    for instance in instances:
+                        instance.time_updated = now
+                    updated.append('time_updated')
+                Model.objects.bulk_update(instances, updated, batch_size=BATCH_SIZE)
+
+        # Many to many fields provided for an update replace the current links
+        for name, pairs in links.items():
+            relation = getattr(Model, name)
+            if not created:
+                source = "%s_id__in" % relation.field.m2m_field_name()
+                pks = [instance.pk for instance, data in zip(instances, validated) if name in data]
+                relation.through.objects.filter(**{source: pks}).delete()
+            bulk_link(relation, pairs)
+
+        bump_versions([Model] + [getattr(Model, name).field.related_model for name in links])
+        self.bulk_saved(instances, created, fields)
+        return instances
+
+    def bulk_saving(self, instances, created, fields):
+        pass
+
+    def bulk_saved(self, instances, created, fields):
+        pass
@@ -0,0 +1,74 @@
+'''
+
+Copyright (C) 2019 Vanessa Sochat.
+
+This Source Code Form is subject to the terms of the
+Mozilla Public License, v. 2.0. If a copy of the MPL was not distributed
+with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+Public endpoints (lists and details) are polled often by mirrors and
+scripts, so responses are cached, keyed on the url (with the query) and
+the versions of the models they show (see fg.apps.main.versions). Each
+response includes an ETag and Last-Modified, and a conditional request
+(If-None-Match or If-Modified-Since) for a response that hasn't changed
+is answered with a 304 without a database query for the response.
+
+'''
+
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.cache import get_conditional_response
+from django.utils.http import (
+    http_date,
+    quote_etag
+)
+from rest_framework.response import Response
+
+from fg.apps.main.versions import get_stamp
+from fg.settings import API_RESPONSE_CACHE_TIMEOUT
+
+import hashlib
+
+
+class CachedResponseMixin(object):
+    '''a viewset mixin to cache list and detail responses (json only). The
+       viewset declares cache_models, the models for the data it returns
+       (including related and expandable fields). Responses made in a
+       transaction (e.g., a check that is rolled back) are not cached.
+    '''
+    cache_models = ()
+
+    def list(self, request, *args, **kwargs):
+        return self.get_cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.get_cached_response(super().retrieve, request, *args, **kwargs)
+
+    def get_cached_response(self, handler, request, *args, **kwargs):
+        '''return the cached response for a request (or a 304 if the client
+           has it), or call the handler and cache a successful response.
+        '''
+        if getattr(request.accepted_renderer, 'format', None) != 'json' or \
+           transaction.get_connection().in_atomic_block:
+            return handler(request, *args, **kwargs)
+
+        stamp, last_modified = get_stamp(self.cache_models)
+        key = hashlib.md5(("%s|%s" %(request.build_absolute_uri(), stamp)).encode('utf-8')).hexdigest()
+        headers = {"ETag": quote_etag(key), "Last-Modified": http_date(last_modified)}
+
+        response = get_conditional_response(request._request, etag=headers["ETag"],
+                                            last_modified=int(last_modified))
+        if response is not None:
+            for header, value in headers.items():
+                response[header] = value
+            return response
+
+        data = cache.get("api-response:%s" % key)
+        if data is None:
+            response = handler(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+            data = response.data
+            cache.set("api-response:%s" % key, data, API_RESPONSE_CACHE_TIMEOUT)
+
+        return Response(data, headers=headers)
@@ -0,0 +1,68 @@
+'''
+
+Copyright (C) 2019 Vanessa Sochat.
+
+This Source Code Form is subject to the terms of the
+Mozilla Public License, v. 2.0. If a copy of the MPL was not distributed
+with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+A dump (e.g., /api/parts/dump/) streams an entire table as newline
+delimited json (one instance per line) in one response, instead of a
+client crawling it page by page. Instances are read with a server side
+cursor in chunks, and related objects are loaded for each chunk, so the
+memory used doesn't grow with the size of the table.
+
+'''
+
+from django.db.models import prefetch_related_objects
+from django.http import StreamingHttpResponse
+from django.utils.text import compress_sequence
+from rest_framework.decorators import action
+from rest_framework.utils.encoders import JSONEncoder
+
+from fg.settings import API_DUMP_CHUNK_SIZE
+
+from itertools import islice
+
+
+def get_chunks(queryset, chunk_size=API_DUMP_CHUNK_SIZE):
+    '''yield lists of (up to chunk_size) instances for a queryset, read with
+       a server side cursor. Prefetches (ignored by iterator) are done for
+       each chunk.
+    '''
+    lookups = queryset._prefetch_related_lookups
+    instances = queryset.prefetch_related(None).iterator(chunk_size=chunk_size)
+    while True:
+        chunk = list(islice(instances, chunk_size))
+        if not chunk:
+            break
+        prefetch_related_objects(chunk, *lookups)
+        yield chunk
+
+
+class DumpMixin(object):
+    '''a viewset mixin to stream all instances (as filtered, with ?fields=
+       and ?expand= applied) as newline delimited json, compressed with
+       gzip if the client asks for it (?gzip=true).
+    '''
+    @action(detail=False, methods=['get'])
+    def dump(self, request):
+        queryset = self.filter_queryset(self.get_queryset())
+        serializer = self.get_serializer()
+        encoder = JSONEncoder()
+
+        def generate():
+            for chunk in get_chunks(queryset):
+                yield "".join(encoder.encode(serializer.to_representation(instance)) + "\n"
+                              for instance in chunk).encode('utf-8')
+
+        content = generate()
+        compress = request.query_params.get('gzip', '').lower() in ['true', '1', 'yes']
+        if compress:
+            content = compress_sequence(content)
+
+        response = StreamingHttpResponse(content, content_type="application/x-ndjson")
+        response['Content-Disposition'] = 'attachment; filename="%s.ndjson"' %(self.basename or queryset.model._meta.model_name)
+        if compress:
+            response['Content-Encoding'] = 'gzip'
+        return response
@@ -0,0 +1,173 @@
+'''
+
+Copyright (C) 2019 Vanessa Sochat.
+
+This Source Code Form is subject to the terms of the
+Mozilla Public License, v. 2.0. If a copy of the MPL was not distributed
+with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+Sparse fieldsets (?fields=gene_id,name) limit the fields that a serializer
+returns, and the columns loaded by the viewset queryset. Expansion
+(?expand=author,tags) replaces related primary keys with the serialized
+objects, looked up with select_related or prefetch_related instead of a
+query per instance. A few related fields were always returned nested, and
+these stay nested unless they are collapsed (?collapse=organism) to return
+the primary key. All three only apply to GET requests.
+
+'''
+
+from django.core.exceptions import FieldDoesNotExist
+from rest_framework import serializers
+from rest_framework.permissions import SAFE_METHODS
+
+import sys
+
+
+def get_query_list(request, name):
+    '''return a set of comma separated values for a query parameter, or None
+    '''
+    if request is None or request.method not in SAFE_METHODS:
+        return None
+    value = request.query_params.get(name)
+    if value is None:
+        return None
+    return set(x.strip() for x in value.split(',') if x.strip())
+
+
+class NestedRelatedField(serializers.PrimaryKeyRelatedField):
+    '''a related field that is written as a primary key, but returned as the
+       nested object (serialized with serializer, the name of a serializer
+       in the same module as the parent) unless it is collapsed.
+    '''
+    def __init__(self, serializer, **kwargs):
+        self.serializer = serializer
+        super().__init__(**kwargs)
+
+    def use_pk_only_optimization(self):
+        return False
+
+    def to_representation(self, value):
+        serializer = getattr(sys.modules[self.parent.__class__.__module__], self.serializer)
+        return serializer(value).data
+
+
+def get_nested_lookups(serializer):
+    '''return the prefetch lookups needed by a nested (expanded) serializer,
+       for its many related fields, nested related fields and serializers.
+    '''
+    lookups = []
+    for field in serializer.fields.values():
+        if isinstance(field, (serializers.ManyRelatedField, serializers.BaseSerializer,
+                              NestedRelatedField)):
+            lookups.append(field.source)
+    return lookups
+
+
+class SparseFieldsMixin(object):
+    '''a serializer mixin to return only the fields in ?fields=, and replace
+       fields in ?expand= with a nested serializer. A serializer declares
+       what can be expanded as expandable_fields, a lookup of the field name
+       to the name of a serializer (in the same module) to use. Nested
+       related fields (NestedRelatedField) in ?collapse= return the primary
+       key instead.
+    '''
+    expandable_fields = {}
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get('request')
+
+        for name in self.get_expand(request):
+            serializer = self.get_expand_serializer(name)
+            self.fields[name] = serializer(many=isinstance(self.fields[name], serializers.ManyRelatedField),
+                                           read_only=True)
+
+        for name in self.get_collapse(request):
+            self.fields[name] = serializers.PrimaryKeyRelatedField(read_only=True)
+
+        fields = get_query_list(request, 'fields')
+        if fields is not None:
+            fields = fields.union(self.get_expand(request))
+            for name in set(self.fields).difference(fields):
+                self.fields.pop(name)
+
+    def get_expand(self, request):
+        expand = get_query_list(request, 'expand') or set()
+        return expand.intersection(self.expandable_fields)
+
+    def get_collapse(self, request):
+        collapse = get_query_list(request, 'collapse') or set()
+        return set(name for name in collapse
+                   if isinstance(self.fields.get(name), NestedRelatedField))
+
+    def get_expand_serializer(self, name):
+        return getattr(sys.modules[self.__class__.__module__], self.expandable_fields[name])
+
+
+class SparseQuerysetMixin(object):
+    '''a viewset mixin to push ?fields= down to the queryset (with only) and
+       to load related objects for ?expand= in a fixed number of queries.
+       Prefetches for related fields that aren't returned are removed.
+       A serializer method field (other than the label) may use any field,
+       so we only restrict columns when the requested method fields are
+       known not to need them (see method_fields).
+    '''
+    method_fields = {'label': []}
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        request = self.request
+        fields = get_query_list(request, 'fields')
+        expand = get_query_list(request, 'expand')
+        if fields is None and expand is None:
+            return queryset
+
+        serializer = self.get_serializer()
+        Model = queryset.model
+        names = set(serializer.fields)
+
+        # Related lookups for expanded fields (the serializer has them nested)
+        for name in expand or []:
+            field = serializer.fields.get(name)
+            if not isinstance(field, serializers.BaseSerializer):
+                continue
+            nested = field.child if isinstance(field, serializers.ListSerializer) else field
+            model_field = Model._meta.get_field(field.source)
+            if model_field.many_to_many or model_field.one_to_many:
+                queryset = queryset.prefetch_related(field.source)
+            else:
+                queryset = queryset.select_related(field.source)
+            queryset = queryset.prefetch_related(*["%s__%s" %(field.source, lookup)
+                                                   for lookup in get_nested_lookups(nested)])
+
+        if fields is None:
+            return queryset
+
+        # Remove prefetches for serializer fields that aren't returned
+        serializer_fields = set(self.get_serializer_class()().fields)
+        lookups = [lookup for lookup in queryset._prefetch_related_lookups
+                   if getattr(lookup, 'prefetch_through', lookup).split('__')[0] in names or
+                   getattr(lookup, 'prefetch_through', lookup).split('__')[0] not in serializer_fields]
+        queryset = queryset.prefetch_related(None).prefetch_related(*lookups)
+
+        # Only load the columns for returned fields (and the pagination ordering)
+        only = set([Model._meta.pk.name])
+        only.update(x.lstrip('-') for x in getattr(self.paginator, 'ordering', None) or [])
+        for name, field in serializer.fields.items():
+            if isinstance(field, serializers.SerializerMethodField):
+                if name not in self.method_fields:
+                    return queryset
+                only.update(self.method_fields[name])
+                continue
+            try:
+                model_field = Model._meta.get_field(field.source)
+            except FieldDoesNotExist:
+                return queryset
+            if model_field.concrete and not model_field.many_to_many:
+                only.add(model_field.name)
+
+        # Columns for select_related (expanded) fields must be loaded too
+        related = queryset.query.select_related
+        if isinstance(related, dict):
+            only.update(related)
+        return queryset.only(*only)
@@ -0,0 +1,148 @@
+'''
+
+Copyright (C) 2019 Vanessa Sochat.
+
+This Source Code Form is subject to the terms of the
+Mozilla Public License, v. 2.0. If a copy of the MPL was not distributed
+with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+'''
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework import pagination
+from rest_framework.exceptions import NotFound
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+from base64 import (
+    urlsafe_b64decode,
+    urlsafe_b64encode
+)
+from collections import OrderedDict
+import uuid
+
+
+def include_count(request, default=True):
+    '''determine if the client wants the total count (?count=false skips it)
+    '''
+    value = request.query_params.get('count')
+    if value is None:
+        return default
+    return value.lower() not in ['false', '0', 'no']
+
+
+class LimitOffsetPagination(pagination.LimitOffsetPagination):
+    '''limit and offset pagination (the default for the API) where a client
+       can skip the count with ?count=false. Without a count, we look up one
+       extra instance to know if there is a next page.
+    '''
+    def paginate_queryset(self, queryset, request, view=None):
+        if include_count(request):
+            return super().paginate_queryset(queryset, request, view)
+
+        self.limit = self.get_limit(request)
+        if self.limit is None:
+            return None
+
+        self.offset = self.get_offset(request)
+        self.request = request
+        self.count = None
+        results = list(queryset[self.offset:self.offset + self.limit + 1])
+        self.has_next = len(results) > self.limit
+        return results[:self.limit]
+
+    def get_next_link(self):
+        if self.count is not None:
+            return super().get_next_link()
+        if not self.has_next:
+            return None
+        url = replace_query_param(self.request.build_absolute_uri(), self.limit_query_param, self.limit)
+        return replace_query_param(url, self.offset_query_param, self.offset + self.limit)
+
+
+class KeysetPagination(pagination.BasePagination):
+    '''keyset (cursor) pagination for large collections, ordered by most
+       recently updated (with the uuid to break ties). Each page is looked
+       up from the last instance of the previous page (the cursor), so a
+       deep page costs the same as the first, and the count is only done
+       if the client asks for it (?count=true). Links only go forward.
+       If a client provides an offset, we fall back to limit and offset.
+    '''
+    ordering = ('-time_updated', '-uuid')
+    page_size = api_settings.PAGE_SIZE
+    page_size_query_param = 'limit'
+    max_page_size = 1000
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.fallback = None
+        if LimitOffsetPagination.offset_query_param in request.query_params:
+            self.fallback = LimitOffsetPagination()
+            return self.fallback.paginate_queryset(queryset, request, view)
+
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.count = queryset.count() if include_count(request, default=False) else None
+
+        queryset = queryset.order_by(*self.ordering)
+        position = self.decode_cursor(request)
+        if position is not None:
+            time_updated, pk = position
+            queryset = queryset.filter(Q(time_updated__lt=time_updated) |
+                                       Q(time_updated=time_updated, uuid__lt=pk))
+
+        results = list(queryset[:self.page_size + 1])
+        self.has_next = len(results) > self.page_size
+        self.page = results[:self.page_size]
+        return self.page
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if page_size <= 0:
+            return self.page_size
+        return min(page_size, self.max_page_size)
+
+    def decode_cursor(self, request):
+        '''return the (time updated, uuid) position for the cursor, if provided
+        '''
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+
+        try:
+            time_updated, pk = urlsafe_b64decode(encoded.encode('ascii')).decode('ascii').split('|')
+            time_updated = parse_datetime(time_updated)
+            pk = uuid.UUID(pk)
+        except (TypeError, ValueError, UnicodeError):
+            raise NotFound(self.invalid_cursor_message)
+
+        if time_updated is None:
+            raise NotFound(self.invalid_cursor_message)
+        return time_updated, pk
+
+    def encode_cursor(self, instance):
+        position = "%s|%s" %(instance.time_updated.isoformat(), instance.uuid)
+        return urlsafe_b64encode(position.encode('ascii')).decode('ascii')
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = replace_query_param(self.request.build_absolute_uri(), self.page_size_query_param, self.page_size)
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.page[-1]))
+
+    def get_paginated_response(self, data):
+        if self.fallback is not None:
+            return self.fallback.get_paginated_response(data)
+
+        return Response(OrderedDict([
+            ('count', self.count),
+            ('next', self.get_next_link()),
+            ('previous', None),
+            ('results', data)
+        ]))
@@ -36,3 +36,11 @@ class AllowAnyGet(BasePermission):
             return True
 
         return request.method in SAFE_METHODS
+
+
+class AllowAnyRead(BasePermission):
+    '''Allows anyone access, for actions that only read (including a POST
+       that sends a query too large for a GET).
+    '''
+    def has_permission(self, request, view):
+        return True
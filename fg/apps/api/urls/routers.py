@@ -33,7 +33,8 @@ from fg.apps.api.urls.serializers import (
     RobotViewSet,
     SampleViewSet,
     SchemaViewSet,
-    TagViewSet
+    TagViewSet,
+    WellViewSet
 )
 
 
@@ -58,6 +59,7 @@ router.register(r'^robots', RobotViewSet, base_name="robots")
 router.register(r'^schemas', SchemaViewSet, base_name="schemas")
 router.register(r'^samples', SampleViewSet, base_name="samples")
 router.register(r'^tags', TagViewSet, base_name="tag")
+router.register(r'^wells', WellViewSet, base_name="well")
 
 urlpatterns = [
 
@@ -10,7 +10,10 @@ with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
 from django.contrib.postgres.fields import JSONField
 from django.conf import settings
+from django.core.exceptions import ValidationError as DjangoValidationError
 from django.urls import reverse
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
 
 from fg.apps.main.models import (
     Author,
@@ -31,13 +34,32 @@ from fg.apps.main.models import (
     Sample,
     Schema,
     Tag,
-    Well
+    Well,
+    WellContent
 )
+from fg.apps.main.versions import get_instance_version
+from fg.apps.main.models.validators import (
+    format_json_errors,
+    get_json_validator,
+    validate_json_many
+)
+from jsonschema.exceptions import SchemaError
 
+from fg.apps.factory.models import FactoryOrder
 from fg.apps.orders.models import Order
+from .bulk import BulkMixin
+from .cache import CachedResponseMixin
+from .dump import DumpMixin
+from .fields import (
+    NestedRelatedField,
+    SparseFieldsMixin,
+    SparseQuerysetMixin
+)
+from .pagination import KeysetPagination
 from .permissions import (
     IsStaffOrSuperUser,
-    AllowAnyGet
+    AllowAnyGet,
+    AllowAnyRead
 )
 from rest_framework import (
     generics,
@@ -52,19 +74,29 @@ from rest_framework.exceptions import (
     NotFound
 )
 
+from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.views import APIView
+from fg.settings import SAMPLE_LINEAGE_MAX
+
+import uuid
 
 
 ################################################################################
 # Serializers paired with Viewsets
 ################################################################################
 
+# Each viewset queryset loads the related objects its serializer needs
+# (select_related or prefetch_related), and the query_budget is the most
+# queries a list page or detail should take, regardless of the page size
+# (see python manage.py check_query_budgets)
+
 # Authors
 
-class AuthorSerializer(serializers.ModelSerializer):
+class AuthorSerializer(SparseFieldsMixin, serializers.ModelSerializer):
 
     tags = serializers.PrimaryKeyRelatedField(queryset=Tag.objects.all(), required=False, many=True)
+    expandable_fields = {'tags': 'TagSerializer'}
     label = serializers.SerializerMethodField('get_label')
 
     def get_label(self, instance):
@@ -75,18 +107,19 @@ class AuthorSerializer(serializers.ModelSerializer):
         fields = ('uuid', 'name', 'email', 'affiliation', 'orcid', 
                   'tags', 'label')
 
-class AuthorViewSet(viewsets.ModelViewSet):
+class AuthorViewSet(DumpMixin, SparseQuerysetMixin, viewsets.ModelViewSet):
 
     def get_queryset(self):
-        return Author.objects.all()
+        return Author.objects.prefetch_related('tags')
 
     serializer_class = AuthorSerializer
+    query_budget = 3
     permission_classes = (IsStaffOrSuperUser,)
 
 
 # Containers
 
-class ContainerSerializer(serializers.ModelSerializer):
+class ContainerSerializer(SparseFieldsMixin, serializers.ModelSerializer):
 
     plates = serializers.SerializerMethodField('plates_list')
     parent = serializers.PrimaryKeyRelatedField(queryset=Container.objects.all())
@@ -103,22 +136,24 @@ class ContainerSerializer(serializers.ModelSerializer):
         fields = ('uuid', 'time_created', 'time_updated', 'name', 'container_type', 'description',
                   'estimated_temperature', 'x', 'y', 'z', 'parent', 'plates', 'label')
 
-class ContainerViewSet(viewsets.ModelViewSet):
+class ContainerViewSet(DumpMixin, SparseQuerysetMixin, viewsets.ModelViewSet):
 
     def get_queryset(self):
-        return Container.objects.all()
+        return Container.objects.prefetch_related('plate_set')
 
     serializer_class = ContainerSerializer
+    query_budget = 3
     permission_classes = (IsStaffOrSuperUser,)
 
 
 # Collections
 
-class CollectionSerializer(serializers.ModelSerializer):
+class CollectionSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     '''provide all fields, including notes
     '''
     tags = serializers.PrimaryKeyRelatedField(queryset=Tag.objects.all(), required=False, many=True)
     parent = serializers.PrimaryKeyRelatedField(queryset=Collection.objects.all(), required=False)
+    expandable_fields = {'tags': 'TagSerializer'}
     label = serializers.SerializerMethodField('get_label')
 
     def get_label(self, instance):
@@ -130,19 +165,21 @@ class CollectionSerializer(serializers.ModelSerializer):
                   'description', 'parent', 'tags', 'label')
 
 
-class CollectionViewSet(viewsets.ModelViewSet):
+class CollectionViewSet(CachedResponseMixin, DumpMixin, SparseQuerysetMixin, viewsets.ModelViewSet):
 
     def get_queryset(self):
-        return Collection.objects.all()
+        return Collection.objects.prefetch_related('tags')
 
     serializer_class = CollectionSerializer
+    query_budget = 3
+    cache_models = (Collection, Tag)
     permission_classes = (AllowAnyGet,)
 
 
 
 # Composite Part
 
-class CompositePartSerializer(serializers.ModelSerializer):
+class CompositePartSerializer(SparseFieldsMixin, serializers.ModelSerializer):
 
     label = serializers.SerializerMethodField('get_label')
     parts = serializers.PrimaryKeyRelatedField(many=True, queryset=Part.objects.all())
@@ -159,11 +196,11 @@ class CompositePartSerializer(serializers.ModelSerializer):
                   'direction_string', 'sequence', 'parts', 'label')
 
 
-class CompositePartViewSet(viewsets.ModelViewSet):
+class CompositePartViewSet(CachedResponseMixin, DumpMixin, SparseQuerysetMixin, viewsets.ModelViewSet):
     permission_classes = (AllowAnyGet,)
 
     def get_queryset(self):
-        return CompositePart.objects.all()
+        return CompositePart.objects.prefetch_related('parts')
 
     def create(self, request, *args, **kwargs):
         '''create a new composite part! We require existing part ids, along
@@ -205,13 +242,16 @@ class CompositePartViewSet(viewsets.ModelViewSet):
         serializer.save(sequence=sequence)
 
     serializer_class = CompositePartSerializer
+    query_budget = 3
+    cache_models = (CompositePart,)
 
 
 # Distributions
 
-class DistributionSerializer(serializers.ModelSerializer):
+class DistributionSerializer(SparseFieldsMixin, serializers.ModelSerializer):
 
     platesets = serializers.PrimaryKeyRelatedField(many=True, queryset=PlateSet.objects.all())
+    expandable_fields = {'platesets': 'PlateSetSerializer'}
     label = serializers.SerializerMethodField('get_label')
  
     def get_label(self, instance):
@@ -223,18 +263,19 @@ class DistributionSerializer(serializers.ModelSerializer):
                   'description', 'platesets', 'label')
 
 
-class DistributionViewSet(viewsets.ModelViewSet):
+class DistributionViewSet(DumpMixin, SparseQuerysetMixin, viewsets.ModelViewSet):
 
     def get_queryset(self):
-        return Distribution.objects.all()
+        return Distribution.objects.prefetch_related('platesets')
 
     serializer_class = DistributionSerializer
+    query_budget = 3
     permission_classes = (IsStaffOrSuperUser,)
 
 
 # Modules
 
-class ModuleSerializer(serializers.ModelSerializer):
+class ModuleSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     '''a Module serializer provides all fields except for data and notes. The
        user is required to use the SingleModuleSerializer to get the extra data
     '''
@@ -251,18 +292,19 @@ class ModuleSerializer(serializers.ModelSerializer):
                   'module_type', 'data', 'label')
 
 
-class ModuleViewSet(viewsets.ModelViewSet):
+class ModuleViewSet(DumpMixin, SparseQuerysetMixin, viewsets.ModelViewSet):
 
     def get_queryset(self):
         return Module.objects.all()
 
     serializer_class = ModuleSerializer
+    query_budget = 2
     permission_classes = (IsStaffOrSuperUser,)
 
 
 # Institutions
 
-class InstitutionSerializer(serializers.ModelSerializer):
+class InstitutionSerializer(SparseFieldsMixin, serializers.ModelSerializer):
 
     label = serializers.SerializerMethodField('get_label')
 
@@ -274,18 +316,19 @@ class InstitutionSerializer(serializers.ModelSerializer):
         fields = ('uuid', 'name', 'signed_master', 'label')
 
 
-class InstitutionViewSet(viewsets.ModelViewSet):
+class InstitutionViewSet(DumpMixin, SparseQuerysetMixin, viewsets.ModelViewSet):
 
     def get_queryset(self):
         return Institution.objects.all()
 
     serializer_class = InstitutionSerializer
+    query_budget = 2
     permission_classes = (IsStaffOrSuperUser,)
 
 
 # Operations
 
-class OperationSerializer(serializers.ModelSerializer):
+class OperationSerializer(SparseFieldsMixin, serializers.ModelSerializer):
 
     plans = serializers.PrimaryKeyRelatedField(queryset=Plan.objects.all(), required=False, many=True)
     label = serializers.SerializerMethodField('get_label')
@@ -306,19 +349,30 @@ class OperationSerializer(serializers.ModelSerializer):
                   'description', 'plans', 'label')
 
 
-class OperationViewSet(viewsets.ModelViewSet):
+class OperationViewSet(DumpMixin, SparseQuerysetMixin, viewsets.ModelViewSet):
 
     def get_queryset(self):
-        return Operation.objects.all()
+        return Operation.objects.prefetch_related('plans')
 
     serializer_class = OperationSerializer
+    query_budget = 3
     permission_classes = (IsStaffOrSuperUser,)
 
+    @action(detail=True, methods=['get'])
+    def tree(self, request, pk=None):
+        '''return the plan tree for an operation, with the items (plan data)
+           for each plan. The tree is loaded in a fixed number of queries.
+        '''
+        operation = self.get_object()
+        return Response({"uuid": str(operation.uuid),
+                         "name": operation.name,
+                         "plans": [plan.tree() for plan in operation.get_plan_tree()]})
+
 
 # Orders
 
 
-class OrderSerializer(serializers.ModelSerializer):
+class OrderSerializer(SparseFieldsMixin, serializers.ModelSerializer):
 
     distributions = serializers.PrimaryKeyRelatedField(queryset=Distribution.objects.all(), required=False, many=True)
     label = serializers.SerializerMethodField('get_label')
@@ -332,19 +386,20 @@ class OrderSerializer(serializers.ModelSerializer):
                   'notes', 'distributions', 'label')
 
 
-class OrderViewSet(viewsets.ModelViewSet):
+class OrderViewSet(DumpMixin, SparseQuerysetMixin, viewsets.ModelViewSet):
 
     def get_queryset(self):
-        return Order.objects.all()
+        return Order.objects.prefetch_related('distributions')
 
     serializer_class = OrderSerializer
+    query_budget = 3
     permission_classes = (IsStaffOrSuperUser,)
 
 
 
 # Organisms
 
-class OrganismSerializer(serializers.ModelSerializer):
+class OrganismSerializer(SparseFieldsMixin, serializers.ModelSerializer):
 
     label = serializers.SerializerMethodField('get_label')
 
@@ -357,24 +412,28 @@ class OrganismSerializer(serializers.ModelSerializer):
                   'description', 'genotype', 'label')
 
 
-class OrganismViewSet(viewsets.ModelViewSet):
+class OrganismViewSet(DumpMixin, SparseQuerysetMixin, viewsets.ModelViewSet):
 
     def get_queryset(self):
         return Organism.objects.all()
 
     serializer_class = OrganismSerializer
+    query_budget = 2
     permission_classes = (IsStaffOrSuperUser,)
 
 
 # Part
 
-class PartSerializer(serializers.ModelSerializer):
+class PartSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     '''a part serializer exposes all fields, meaning the user has
        looked up a part based on a uuid.
     '''
     tags = serializers.PrimaryKeyRelatedField(queryset=Tag.objects.all(), required=False, many=True)
     collections = serializers.PrimaryKeyRelatedField(queryset=Collection.objects.all(), required=False, many=True)
     author = serializers.PrimaryKeyRelatedField(queryset=Author.objects.all())
+    expandable_fields = {'author': 'AuthorSerializer',
+                         'tags': 'TagSerializer',
+                         'collections': 'CollectionSerializer'}
     label = serializers.SerializerMethodField('get_label')
 
     def get_label(self, instance):
@@ -391,19 +450,34 @@ class PartSerializer(serializers.ModelSerializer):
                   'author')
 
 
-class PartViewSet(viewsets.ModelViewSet):
+class PartViewSet(CachedResponseMixin, BulkMixin, DumpMixin, SparseQuerysetMixin, viewsets.ModelViewSet):
 
     def get_queryset(self):
-        return Part.objects.all()
+        return Part.objects.prefetch_related('tags', 'collections')
 
     serializer_class = PartSerializer
+    query_budget = 4
+    cache_models = (Part, Author, Tag, Collection)
+    pagination_class = KeysetPagination
     permission_classes = (AllowAnyGet,)
 
+    def bulk_saved(self, parts, created, fields):
+        '''clear the tag statistics and collection rollups, and keep the gene
+           ids for well contents (see the part signals).
+        '''
+        if 'tags' in fields:
+            Tag.clear_statistics()
+        if 'collections' in fields:
+            Collection.clear_rollups()
+        if not created and 'gene_id' in fields:
+            WellContent.refresh(WellContent.objects.filter(part__in=parts)
+                                           .values_list('plate_id', flat=True).distinct())
+
 
 # Plans
 
 
-class PlanSerializer(serializers.ModelSerializer):
+class PlanSerializer(SparseFieldsMixin, serializers.ModelSerializer):
 
     parent = serializers.PrimaryKeyRelatedField(queryset=Plan.objects.all(), required=False)
     operation = serializers.PrimaryKeyRelatedField(queryset=Operation.objects.all())
@@ -418,22 +492,32 @@ class PlanSerializer(serializers.ModelSerializer):
                   'description', 'parent', 'operation', 'status', 'label')
 
 
-class PlanViewSet(viewsets.ModelViewSet):
+class PlanViewSet(DumpMixin, SparseQuerysetMixin, viewsets.ModelViewSet):
 
     def get_queryset(self):
         return Plan.objects.all()
 
     serializer_class = PlanSerializer
+    query_budget = 2
     permission_classes = (IsStaffOrSuperUser,)
 
+    @action(detail=True, methods=['get'])
+    def tree(self, request, pk=None):
+        '''return a plan with its items (plan data) and child plans, at any
+           depth. The tree is loaded in a fixed number of queries.
+        '''
+        return Response(self.get_object().get_tree().tree())
+
 
 # Plates
 
-class PlateSerializer(serializers.ModelSerializer):
+class PlateSerializer(SparseFieldsMixin, serializers.ModelSerializer):
 
     container = serializers.PrimaryKeyRelatedField(queryset=Container.objects.all())
     protocol = serializers.PrimaryKeyRelatedField(queryset=Protocol.objects.all(), required=False)
     wells = serializers.PrimaryKeyRelatedField(queryset=Well.objects.all(), many=True, required=False)
+    expandable_fields = {'protocol': 'ProtocolSerializer',
+                         'wells': 'WellSerializer'}
     label = serializers.SerializerMethodField('get_label')
 
     def get_label(self, instance):
@@ -447,23 +531,49 @@ class PlateSerializer(serializers.ModelSerializer):
                   'wells', 'label', 'plate_vendor_id')
 
 
-class PlateViewSet(viewsets.ModelViewSet):
+class PlateViewSet(CachedResponseMixin, DumpMixin, SparseQuerysetMixin, viewsets.ModelViewSet):
 
     def get_queryset(self):
-        return Plate.objects.all()
+        return Plate.objects.prefetch_related('wells')
 
     serializer_class = PlateSerializer
+    query_budget = 3
+    cache_models = (Plate, Protocol, Well)
+    pagination_class = KeysetPagination
     permission_classes = (AllowAnyGet,)
 
+    @action(detail=True, methods=['get'], url_path='map')
+    def plate_map(self, request, pk=None):
+        '''return the map for a plate, the contents of each well in the grid
+           as parallel lists (see Plate.build_map). The map is cached for
+           each version of the plate, and includes an ETag so a client can
+           ask if it has changed (If-None-Match).
+        '''
+        try:
+            pk = uuid.UUID(str(pk))
+        except ValueError:
+            raise NotFound("Plate %s does not exist." % pk)
+
+        etag = quote_etag(get_instance_version(Plate, pk)[1])
+        response = get_conditional_response(request._request, etag=etag)
+        if response is None:
+            plate_map = Plate.get_map(pk)
+            if plate_map is None:
+                raise NotFound("Plate %s does not exist." % pk)
+            response = Response(plate_map)
+        response['ETag'] = etag
+        return response
+
 
 
 # PlateSet
 
-class PlateSetSerializer(serializers.ModelSerializer):
+class PlateSetSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     '''platesets serializers
     '''
 
     plates = serializers.PrimaryKeyRelatedField(queryset=Plate.objects.all(), many=True)
+    expandable_fields = {'plates': 'PlateSerializer'}
     label = serializers.SerializerMethodField('get_label')
 
     def get_label(self, instance):
@@ -475,18 +585,19 @@ class PlateSetSerializer(serializers.ModelSerializer):
                   'time_updated', 'plates', 'label')
 
 
-class PlateSetViewSet(viewsets.ModelViewSet):
+class PlateSetViewSet(DumpMixin, SparseQuerysetMixin, viewsets.ModelViewSet):
 
     def get_queryset(self):
-        return PlateSet.objects.all()
+        return PlateSet.objects.prefetch_related('plates')
 
     serializer_class = PlateSetSerializer
+    query_budget = 3
     permission_classes = (IsStaffOrSuperUser,)
 
 
 # Protocol
 
-class ProtocolSerializer(serializers.ModelSerializer):
+class ProtocolSerializer(SparseFieldsMixin, serializers.ModelSerializer):
 
     schema = serializers.PrimaryKeyRelatedField(queryset=Schema.objects.all(), required=False)
     label = serializers.SerializerMethodField('get_label')
@@ -500,18 +611,73 @@ class ProtocolSerializer(serializers.ModelSerializer):
                   'description', 'label', 'schema')
 
 
-class ProtocolViewSet(viewsets.ModelViewSet):
+class ProtocolViewSet(DumpMixin, SparseQuerysetMixin, viewsets.ModelViewSet):
 
     def get_queryset(self):
         return Protocol.objects.all()
 
     serializer_class = ProtocolSerializer
+    query_budget = 2
     permission_classes = (IsStaffOrSuperUser,)
 
+    @action(detail=False, methods=['post'])
+    def validate(self, request):
+        '''validate protocols in bulk. If "data" (a list of protocol documents)
+           is provided, each is validated against the "schema" (a schema uuid
+           or json schema) and errors are returned by index. Otherwise, saved
+           protocols (optionally limited to a schema uuid) are validated 
+           against their schemas, and errors are returned by protocol uuid.
+        '''
+        schema = request.data.get('schema')
+        documents = request.data.get('data')
+
+        # A schema can be provided directly, or as a schema uuid
+        schema_id = None
+        if schema is not None and not isinstance(schema, dict):
+            schema_id = schema
+            try:
+                schema = Schema.objects.get(uuid=schema).schema
+            except (Schema.DoesNotExist, ValueError, DjangoValidationError):
+                raise NotFound("Schema %s does not exist." % schema)
+
+        try:
+            if documents is not None:
+                if schema is None or not isinstance(documents, list):
+                    return Response({"detail": "data must be a list, and a schema is required."},
+                                    status=status.HTTP_400_BAD_REQUEST)
+                errors = validate_json_many(documents, schema)
+                total = len(documents)
+
+            # Validate saved protocols, one compiled validator per schema
+            else:
+                protocols = Protocol.objects.filter(schema__isnull=False)
+                if schema_id is not None:
+                    protocols = protocols.filter(schema=schema_id)
+
+                schemas = dict(Schema.objects.values_list('uuid', 'schema'))
+                validators = {}
+                errors = {}
+                total = 0
+                for protocol_id, data, schema_id in protocols.values_list('uuid', 'data', 'schema').iterator():
+                    total += 1
+                    if schema_id not in validators:
+                        validators[schema_id] = get_json_validator(schemas[schema_id])
+                    invalid = list(validators[schema_id].iter_errors(data))
+                    if invalid:
+                        errors[str(protocol_id)] = format_json_errors(invalid)
+
+        except SchemaError as error:
+            return Response({"detail": "Invalid schema: %s" % error.message},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        return Response({"total": total, 
+                         "invalid": len(errors),
+                         "errors": errors})
+
 
 # Robot
 
-class RobotSerializer(serializers.ModelSerializer):
+class RobotSerializer(SparseFieldsMixin, serializers.ModelSerializer):
 
     left_mount = serializers.PrimaryKeyRelatedField(queryset=Module.objects.all())
     right_mount = serializers.PrimaryKeyRelatedField(queryset=Module.objects.all())
@@ -528,23 +694,26 @@ class RobotSerializer(serializers.ModelSerializer):
                   'right_mount', 'left_mount', 'label')
 
 
-class RobotViewSet(viewsets.ModelViewSet):
+class RobotViewSet(DumpMixin, SparseQuerysetMixin, viewsets.ModelViewSet):
 
     def get_queryset(self):
         return Robot.objects.all()
 
     serializer_class = RobotSerializer
+    query_budget = 2
     permission_classes = (IsStaffOrSuperUser,)
 
 
 # Sample
 
 
-class SampleSerializer(serializers.ModelSerializer):
+class SampleSerializer(SparseFieldsMixin, serializers.ModelSerializer):
 
     part = serializers.PrimaryKeyRelatedField(queryset=Part.objects.all())
     derived_from = serializers.PrimaryKeyRelatedField(queryset=Sample.objects.all(), required=False)
     wells = serializers.PrimaryKeyRelatedField(queryset=Well.objects.all(), many=True)
+    expandable_fields = {'part': 'PartSerializer',
+                         'wells': 'WellSerializer'}
     label = serializers.SerializerMethodField('get_label')
 
     def get_label(self, instance):
@@ -557,18 +726,88 @@ class SampleSerializer(serializers.ModelSerializer):
                   'derived_from', 'part', 'index_forward', 'index_reverse',
                   'label', 'wells')
 
-class SampleViewSet(viewsets.ModelViewSet):
+class SampleViewSet(CachedResponseMixin, BulkMixin, DumpMixin, SparseQuerysetMixin, viewsets.ModelViewSet):
 
     def get_queryset(self):
-        return Sample.objects.all()
+        return Sample.objects.prefetch_related('wells')
 
     serializer_class = SampleSerializer
+    query_budget = 3
+    cache_models = (Sample, Part, Well)
+    pagination_class = KeysetPagination
     permission_classes = (AllowAnyGet,)
 
+    # changing a lineage needs the check for cycles done by save
+    bulk_exclude = ('derived_from',)
+
+    def bulk_saving(self, samples, created, fields):
+        '''derive the lineage for new samples from the samples they were
+           derived from (already looked up). For an update, we keep the
+           current wells and parts to refresh after.
+        '''
+        if created:
+            for sample in samples:
+                parent = sample.derived_from
+                if parent is not None:
+                    sample.lineage_depth = parent.lineage_depth + 1
+                    sample.lineage_root_id = parent.lineage_root_id or parent.uuid
+            return
+
+        uuids = [sample.uuid for sample in samples]
+        self._content_wells = list(Sample.wells.through.objects.filter(sample_id__in=uuids)
+                                                               .values_list('well_id', flat=True))
+        self._progress_parts = list(Sample.objects.filter(uuid__in=uuids, part__isnull=False)
+                                                  .values_list('part_id', flat=True))
+
+    def bulk_saved(self, samples, created, fields):
+        '''refresh the contents of plates with wells for the samples, and
+           clear the progress of orders with their parts (see the sample
+           signals).
+        '''
+        wells = set(Sample.wells.through.objects.filter(sample_id__in=[sample.uuid for sample in samples])
+                                                .values_list('well_id', flat=True))
+        if not created or 'wells' in fields:
+            WellContent.refresh_wells(wells.union(getattr(self, '_content_wells', [])))
+
+        parts = set(sample.part_id for sample in samples if sample.part_id)
+        parts.update(getattr(self, '_progress_parts', []))
+        orders = FactoryOrder.parts.through.objects.filter(part_id__in=parts)
+        FactoryOrder.clear_progress(orders.values_list('factoryorder_id', flat=True))
+
+    @action(detail=True, methods=['get'])
+    def lineage(self, request, pk=None):
+        '''return the lineage of a sample: the samples it was derived from
+           (ancestors, nearest first) and a tree of samples derived from it.
+        '''
+        sample = self.get_object()
+        return Response(Sample.get_lineage([sample.uuid])[str(sample.uuid)])
+
+    @action(detail=False, methods=['get', 'post'], permission_classes=(AllowAnyRead,))
+    def lineages(self, request):
+        '''return the lineage for many samples, by uuid. Uuids can be provided
+           as a comma separated list (?uuids=) or a list (uuids) in a post.
+           Samples that don't exist are not included.
+        '''
+        uuids = request.data.get('uuids') if request.method == "POST" else None
+        if uuids is None:
+            uuids = [x for x in request.query_params.get('uuids', '').split(',') if x]
+
+        try:
+            uuids = [str(uuid.UUID(str(x))) for x in uuids]
+        except ValueError:
+            return Response({"detail": "uuids must be a list of sample uuids."},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        if len(uuids) > SAMPLE_LINEAGE_MAX:
+            return Response({"detail": "A maximum of %s samples can be requested." % SAMPLE_LINEAGE_MAX},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        return Response(Sample.get_lineage(uuids))
+
 
 # Schema
 
-class SchemaSerializer(serializers.ModelSerializer):
+class SchemaSerializer(SparseFieldsMixin, serializers.ModelSerializer):
 
     label = serializers.SerializerMethodField('get_label')
 
@@ -580,18 +819,19 @@ class SchemaSerializer(serializers.ModelSerializer):
         fields = ('uuid', 'time_created', 'time_updated', 'name',
                   'description', 'schema', 'schema_version', 'label')
 
-class SchemaViewSet(viewsets.ModelViewSet):
+class SchemaViewSet(DumpMixin, SparseQuerysetMixin, viewsets.ModelViewSet):
 
     def get_queryset(self):
         return Schema.objects.all()
 
     serializer_class = SchemaSerializer
+    query_budget = 2
     permission_classes = (IsStaffOrSuperUser,)
 
 
 # Tags
 
-class TagSerializer(serializers.ModelSerializer):
+class TagSerializer(SparseFieldsMixin, serializers.ModelSerializer):
 
     label = serializers.SerializerMethodField('get_label')
 
@@ -602,24 +842,22 @@ class TagSerializer(serializers.ModelSerializer):
         model = Tag
         fields = ('uuid', 'tag', 'label')
 
-class TagViewSet(viewsets.ModelViewSet):
+class TagViewSet(DumpMixin, SparseQuerysetMixin, viewsets.ModelViewSet):
 
     def get_queryset(self):
         return Tag.objects.all()
 
     serializer_class = TagSerializer
+    query_budget = 2
     permission_classes = (IsStaffOrSuperUser,)
 
 
 # Wells
 
-class WellSerializer(serializers.ModelSerializer):
+class WellSerializer(SparseFieldsMixin, serializers.ModelSerializer):
 
     label = serializers.SerializerMethodField('get_label')
-    organism = serializers.SerializerMethodField('get_organism')
-
-    def get_organism(self, instance):
-        return OrganismSerializer(instance.organism).data
+    organism = NestedRelatedField('OrganismSerializer', queryset=Organism.objects.all(), required=False)
 
     def get_label(self, instance):
         return instance.get_label()
@@ -628,3 +866,19 @@ class WellSerializer(serializers.ModelSerializer):
         model = Well
         fields = ('uuid', 'address', 'volume', 'quantity', 'media', 
                   'time_created', 'time_updated', 'organism', 'label')
+
+class WellViewSet(BulkMixin, DumpMixin, SparseQuerysetMixin, viewsets.ModelViewSet):
+
+    def get_queryset(self):
+        return Well.objects.select_related('organism')
+
+    serializer_class = WellSerializer
+    query_budget = 2
+    permission_classes = (IsStaffOrSuperUser,)
+
+    def bulk_saved(self, wells, created, fields):
+        '''keep the address for well contents, and the volume and media for
+           plate maps (see the well signals).
+        '''
+        if not created and fields.intersection(['address', 'volume', 'media']):
+            WellContent.refresh_wells(wells)
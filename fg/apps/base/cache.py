@@ -0,0 +1,147 @@
+'''
+
+Copyright (C) 2019 Vanessa Sochat.
+
+This Source Code Form is subject to the terms of the
+Mozilla Public License, v. 2.0. If a copy of the MPL was not distributed
+with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+The default cache is two tiers: a shared cache (redis, the same server as
+the task queue) so that all workers see the same entries and counters, and
+a small local (in process) cache in front of it for hot keys. Only keys
+that start with one of LOCAL_KEYS are kept locally, and these should be
+keys that include a version (e.g., a response for the current versions of
+the models it shows, see fg.apps.main.versions), so an entry kept in one
+worker is never out of date. Everything else (including counters for rate
+limits and the versions themselves) is only in the shared cache.
+
+    CACHES = {
+        'default': {
+            'BACKEND': 'fg.apps.base.cache.TieredCache',
+            'OPTIONS': {'SHARED': 'shared', 'LOCAL': 'local',
+                        'LOCAL_KEYS': ['api-response:'], 'LOCAL_TIMEOUT': 300}
+        },
+        'shared': {'BACKEND': 'django_redis.cache.RedisCache', ...},
+        'local': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}
+    }
+
+Key prefixes (namespacing) and versions are those of the underlying caches,
+and a version given for an entry is passed to both.
+
+'''
+
+from django.core.cache import caches
+from django.core.cache.backends.base import (
+    BaseCache,
+    DEFAULT_TIMEOUT
+)
+
+# A default for get, to know if a value (including None) was found
+MISSING = object()
+
+
+class TieredCache(BaseCache):
+    '''a cache with a shared tier (e.g., redis) and a local tier for keys
+       that start with one of LOCAL_KEYS.
+    '''
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self.shared_alias = options.get('SHARED', 'shared')
+        self.local_alias = options.get('LOCAL', 'local')
+        self.local_keys = tuple(options.get('LOCAL_KEYS', []))
+        self.local_timeout = options.get('LOCAL_TIMEOUT', 300)
+
+    @property
+    def shared(self):
+        return caches[self.shared_alias]
+
+    @property
+    def local(self):
+        return caches[self.local_alias]
+
+    def is_local(self, key):
+        return bool(self.local_keys) and key.startswith(self.local_keys)
+
+    def get_local_timeout(self, timeout):
+        if timeout is DEFAULT_TIMEOUT or timeout is None:
+            return self.local_timeout
+        return min(timeout, self.local_timeout)
+
+    def get(self, key, default=None, version=None):
+        local = self.is_local(key)
+        if local:
+            value = self.local.get(key, MISSING, version=version)
+            if value is not MISSING:
+                return value
+
+        value = self.shared.get(key, MISSING, version=version)
+        if value is MISSING:
+            return default
+        if local:
+            self.local.set(key, value, self.local_timeout, version=version)
+        return value
+
+    def get_many(self, keys, version=None):
+        keys = list(keys)
+        found = self.local.get_many([key for key in keys if self.is_local(key)], version=version)
+        missing = [key for key in keys if key not in found]
+        if missing:
+            shared = self.shared.get_many(missing, version=version)
+            local = {key: value for key, value in shared.items() if self.is_local(key)}
+            if local:
+                self.local.set_many(local, self.local_timeout, version=version)
+            found.update(shared)
+        return found
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.shared.set(key, value, timeout, version=version)
+        if self.is_local(key):
+            self.local.set(key, value, self.get_local_timeout(timeout), version=version)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        failed = self.shared.set_many(data, timeout, version=version) or []
+        local = {key: value for key, value in data.items() if self.is_local(key) and key not in failed}
+        if local:
+            self.local.set_many(local, self.get_local_timeout(timeout), version=version)
+        return failed
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        added = self.shared.add(key, value, timeout, version=version)
+        if added and self.is_local(key):
+            self.local.set(key, value, self.get_local_timeout(timeout), version=version)
+        return added
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        return self.shared.touch(key, timeout, version=version)
+
+    def delete(self, key, version=None):
+        self.local.delete(key, version=version)
+        self.shared.delete(key, version=version)
+
+    def delete_many(self, keys, version=None):
+        keys = list(keys)
+        self.local.delete_many(keys, version=version)
+        self.shared.delete_many(keys, version=version)
+
+    def has_key(self, key, version=None):
+        if self.is_local(key) and self.local.has_key(key, version=version):
+            return True
+        return self.shared.has_key(key, version=version)
+
+    def incr(self, key, delta=1, version=None):
+        '''counters are only kept in the shared cache
+        '''
+        self.local.delete(key, version=version)
+        return self.shared.incr(key, delta, version=version)
+
+    def decr(self, key, delta=1, version=None):
+        self.local.delete(key, version=version)
+        return self.shared.decr(key, delta, version=version)
+
+    def clear(self):
+        self.local.clear()
+        self.shared.clear()
+
+    def close(self, **kwargs):
+        self.shared.close(**kwargs)
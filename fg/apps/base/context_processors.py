@@ -9,10 +9,14 @@ with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
 '''
 
 from django.conf import settings
+from django.core.cache import cache
 from fg.apps.main.models import (
-    Part,
-    Distribution
+    Distribution,
+    PlateSet,
+    WellContent
 )
+from fg.apps.main.versions import get_stamp
+from fg.settings import CATALOG_CACHE_TIMEOUT
 
 def get_unique_parts():
     '''we use this function to get parts associated with a distribution (meaning
@@ -24,10 +28,20 @@ def get_unique_parts():
        The function distribution.parts() returns unique gene_ids associated
        with the distribution (not part objects)
     '''
-    parts = set()
-    for distribution in Distribution.objects.all():
-        parts.update(distribution.gene_ids())
-    return parts
+    return set().union(*Distribution.get_gene_ids(Distribution.objects.all()).values())
+
+
+def get_unique_parts_count():
+    '''the count of unique parts (shown on every page) is cached for the
+       versions of the models it's derived from.
+    '''
+    stamp, _ = get_stamp([Distribution, PlateSet, WellContent])
+    key = "node-parts:%s" % stamp
+    count = cache.get(key)
+    if count is None:
+        count = len(get_unique_parts())
+        cache.set(key, count, CATALOG_CACHE_TIMEOUT)
+    return count
 
 
 def domain_processor(request):
@@ -35,7 +49,7 @@ def domain_processor(request):
             'NODE_URI': settings.NODE_URI,
             'NODE_NAME': settings.NODE_NAME,
             'NODE_TWITTER': settings.NODE_TWITTER,  # unique parts
-            'NODE_PARTS': len(get_unique_parts())}
+            'NODE_PARTS': get_unique_parts_count()}
 
 def help_processor(request):
     return {'HELP_CONTACT_EMAIL': settings.HELP_CONTACT_EMAIL,
@@ -15,7 +15,16 @@ from django.core.management.base import (
 from fg.apps.main.models import *
 from fg.settings import SHIPPO_TOKEN
 from fg.apps.orders.models import *
+from fg.apps.factory.models import FactoryOrder
+from fg.apps.main.statistics import reset_statistics
 from fg.apps.main.utils import load_json
+from fg.apps.main.bulk import (
+    bulk_insert,
+    bulk_link,
+    bulk_tags,
+    get_uuid_lookup
+)
+from django.db import transaction
 from dateutil.parser import parse
 import logging
 import os
@@ -38,10 +47,18 @@ def update_dates(instance, entry, create_field='time_created', update_field='tim
        create_field: the create field for entry
        update_field: the update field for entry
     '''
+    instance = set_dates(instance, entry, create_field, update_field)
+    instance.save()
+    return instance
+
+
+def set_dates(instance, entry, create_field='time_created', update_field='time_updated'):
+    '''the same as update_dates, but without saving, for instances that are
+       going to be created in bulk.
+    '''
     for field in [create_field, update_field]:
         if entry.get(field):
             setattr(instance, field, parse(entry[field]))
-    instance.save()
     return instance
 
 
@@ -62,8 +79,11 @@ class Command(BaseCommand):
     '''
     def add_arguments(self, parser):
         parser.add_argument(dest='input_folder', nargs=1, type=str)
+        parser.add_argument('--bulk', dest='bulk', action='store_true', default=False,
+                            help="load entities in bulk (recommended for a full dump)")
     help = "Import data from an input folder with exported json"
 
+    @WellContent.deferred()
     def handle(self, *args, **options):
         if options['input_folder'] is None:
             raise CommandError("Please provide an input folder to parse.")
@@ -74,6 +94,12 @@ class Command(BaseCommand):
             logging.error("Input folder %s does not exist." % folder)
             sys.exit(1)
 
+        # Bulk mode loads all entities in dependency order, in one transaction
+        if options['bulk']:
+            with transaction.atomic():
+                self.bulk_import(folder)
+            return self.import_shipments(folder)
+
         # TAGS are not exported as models, but defined with models (added as we go)
 
         # Institution ##########################################################
@@ -230,50 +256,11 @@ class Command(BaseCommand):
                 robot.save()
 
         
-        # Files ################################################################
-        # Added to upload folder, and we will add logic to use storage when ready
- 
-        files_file = os.path.join(folder, 'files.json')
+        # Files and Material Transfer Agreements ###############################
 
-        # Keep a lookup of filenames for the MTAs
-        files_lookup = {}
+        files_lookup = self.import_files(folder)
+        self.import_mtas(folder, files_lookup)
 
-        if os.path.exists(files_file):
-            files = load_json(files_file)
-            for entry in files:
-                files_lookup[entry['uuid']] = entry
-                file_path = os.path.join(folder, 'files', entry['name'])
-                if os.path.exists(file_path):
-                    newfile, created = Files.objects.get_or_create(file_name=file_path)
-                    original_path = newfile.file_name.name
-                    upload_path = get_upload_to(newfile, newfile.file_name.name)
-                    shutil.copyfile(original_path, upload_path)
-                    newfile.file_name.name = upload_path
-                    newfile.save()
-
-
-        # Material Transfer Agreement ##########################################
-
-        mta_file = os.path.join(folder, 'materialtransferagreement-full.json')
-        if os.path.exists(mta_file):
-            mtas = load_json(mta_file)
-            for mta in mtas:
-                if mta['file'] in files_lookup:
-                    file_path = os.path.join(folder, 'files', files_lookup[mta['file']]['name'])
-                    if os.path.exists(file_path):
-                        institution = Institution.objects.get(uuid=mta['institution'])
-                        newmta, created = MaterialTransferAgreement.objects.get_or_create(
-                                               uuid=mta['uuid'],
-                                               institution=institution,
-                                               mta_type=mta['mta_type'])
-                        if created:
-                            newmta.agreement_file=file_path
-                            original_path = newmta.agreement_file.name
-                            upload_path = get_mta_upload_to(newmta, newmta.agreement_file.name)
-                            shutil.copyfile(original_path, upload_path)
-                            newmta.agreement_file.name = upload_path
-                            newmta.save()
-                        
         # Authors ##############################################################
         # data exported contains uuid for parts, but we will add authors to the parts
         # after they are created
@@ -408,6 +395,7 @@ class Command(BaseCommand):
                 if entry['ip_check_ref']:
                     part.ip_check_ref = entry['ip_check_ref']
 
+                part.collections.add(collection)
                 part = update_dates(part, entry)
                 part = add_tags(part, entry)                
 
@@ -490,8 +478,63 @@ class Command(BaseCommand):
                 order = update_dates(order, entry)
                                                              
 
-        # Shipment ################################################################
+        self.import_shipments(folder)
+
+    # We aren't representing address, shipment, parcel, need to have this linked
+
+    def import_files(self, folder):
+        '''copy exported files to the upload folder. Returns a lookup of files
+           by uuid, used to find the files for MTAs.
+        '''
+        # Added to upload folder, and we will add logic to use storage when ready
+        files_file = os.path.join(folder, 'files.json')
+
+        # Keep a lookup of filenames for the MTAs
+        files_lookup = {}
+
+        if os.path.exists(files_file):
+            files = load_json(files_file)
+            for entry in files:
+                files_lookup[entry['uuid']] = entry
+                file_path = os.path.join(folder, 'files', entry['name'])
+                if os.path.exists(file_path):
+                    newfile, created = Files.objects.get_or_create(file_name=file_path)
+                    original_path = newfile.file_name.name
+                    upload_path = get_upload_to(newfile, newfile.file_name.name)
+                    shutil.copyfile(original_path, upload_path)
+                    newfile.file_name.name = upload_path
+                    newfile.save()
+
+        return files_lookup
 
+    def import_mtas(self, folder, files_lookup):
+        '''import material transfer agreements, copying the agreement files
+           from the files lookup to the upload folder.
+        '''
+        mta_file = os.path.join(folder, 'materialtransferagreement-full.json')
+        if os.path.exists(mta_file):
+            mtas = load_json(mta_file)
+            for mta in mtas:
+                if mta['file'] in files_lookup:
+                    file_path = os.path.join(folder, 'files', files_lookup[mta['file']]['name'])
+                    if os.path.exists(file_path):
+                        institution = Institution.objects.get(uuid=mta['institution'])
+                        newmta, created = MaterialTransferAgreement.objects.get_or_create(
+                                               uuid=mta['uuid'],
+                                               institution=institution,
+                                               mta_type=mta['mta_type'])
+                        if created:
+                            newmta.agreement_file=file_path
+                            original_path = newmta.agreement_file.name
+                            upload_path = get_mta_upload_to(newmta, newmta.agreement_file.name)
+                            shutil.copyfile(original_path, upload_path)
+                            newmta.agreement_file.name = upload_path
+                            newmta.save()
+
+    def import_shipments(self, folder):
+        '''shipments are looked up with the Shippo API (requires a live token)
+           and the label and transaction added to the order.
+        '''
         if "test" in SHIPPO_TOKEN:
             print("Shipments can only be imported with live (non test) Shippo token")
             sys.exit(0)
@@ -525,4 +568,285 @@ class Command(BaseCommand):
                 order.transaction = {"object_id": transaction_id}
                 order.save()
 
-    # We aren't representing address, shipment, parcel, need to have this linked
+
+    # Bulk Import
+
+    def bulk_import(self, folder):
+        '''load the same files as the default import, but ordered by dependency
+           and written in bulk. We preload the uuids that already exist for
+           each model, create only new instances (with bulk_insert, COPY for
+           postgres) and add many to many links directly to through tables.
+           Foreign keys are set by uuid, so no lookups are needed.
+        '''
+        def load(filename):
+            filename = os.path.join(folder, filename)
+            if os.path.exists(filename):
+                return load_json(filename)
+            return []
+
+        def insert(Model, instances):
+            count = bulk_insert(Model, instances)
+            reset_statistics([Model])
+            print("Imported %s new %s" %(count, Model._meta.verbose_name_plural))
+
+        def tag_links(relation, entries):
+            tags = bulk_tags([name for entry in entries for name in entry['tags']])
+            bulk_link(relation, [(entry['uuid'], tags[name]) for entry in entries
+                                 for name in entry['tags'] if name in tags])
+            Tag.clear_statistics()
+
+        # Institution ##########################################################
+
+        institutions = load('institution-full.json')
+        existing = get_uuid_lookup(Institution)
+        insert(Institution, [Institution(uuid=entry['uuid'],
+                                         name=entry['name'],
+                                         signed_master=entry['signed_master'])
+                             for entry in institutions if entry['uuid'] not in existing])
+
+        # Protocol #############################################################
+
+        protocols = load('protocols-full.json')
+        existing = get_uuid_lookup(Protocol)
+        insert(Protocol, [set_dates(Protocol(uuid=entry['uuid'],
+                                             description=entry['description'],
+                                             data=entry['data']), entry)
+                          for entry in protocols if entry['uuid'] not in existing])
+        protocol_ids = get_uuid_lookup(Protocol)
+
+        # Containers ###########################################################
+        # Parents are set directly, foreign keys are checked at commit
+
+        containers = load('containers-full.json')
+        existing = get_uuid_lookup(Container)
+        container_ids = existing.union([entry['uuid'] for entry in containers])
+
+        new_containers = []
+        for entry in containers:
+            if entry['uuid'] in existing:
+                continue
+            parent = entry['parent_uuid'] if entry['parent_uuid'] in container_ids else None
+            new_containers.append(Container(container_type=entry['container_type'].lower(),
+                                            uuid=entry['uuid'],
+                                            name=entry['name'],
+                                            x=entry['x'],
+                                            y=entry['y'],
+                                            z=entry['z'],
+                                            description=entry['description'],
+                                            estimated_temperature=entry['estimated_temperature'],
+                                            parent_id=parent))
+        insert(Container, new_containers)
+        Container.rebuild_paths()
+
+        # Plates are defined with containers, and again (with wells) in plates
+        plates = {}
+        for entry in containers:
+            for plate in entry['plates']:
+                plate['container_uuid'] = entry['uuid']
+                plates[plate['uuid']] = plate
+        for entry in load('plates-full.json'):
+            plates.setdefault(entry['uuid'], {}).update(entry)
+
+        existing = get_uuid_lookup(Plate)
+        new_plates = []
+        for entry in plates.values():
+            if entry['uuid'] in existing:
+                continue
+
+            # There are plates with protocol uuid that don't exist
+            protocol = entry.get('protocol_uuid')
+            if protocol not in protocol_ids:
+                protocol = None
+
+            new_plates.append(set_dates(Plate(uuid=entry['uuid'],
+                                              container_id=entry['container_uuid'],
+                                              protocol_id=protocol,
+                                              plate_type=entry['plate_type'],
+                                              plate_vendor_id=entry['plate_vendor_id'],
+                                              plate_form=entry['plate_form'],
+                                              status=entry['status'],
+                                              name=entry['plate_name'],
+                                              thaw_count=entry['thaw_count']), entry))
+        insert(Plate, new_plates)
+        Container.clear_tree()
+
+        # Organism #############################################################
+
+        organisms = load('organisms-full.json')
+        existing = get_uuid_lookup(Organism)
+        insert(Organism, [set_dates(Organism(uuid=entry['uuid'],
+                                             description=entry['description'],
+                                             genotype=entry['genotype'],
+                                             name=entry['name']), entry)
+                          for entry in organisms if entry['uuid'] not in existing])
+        tag_links(Organism.tags, organisms)
+
+        # Collections ##########################################################
+
+        collections = load('collections-full.json')
+        existing = get_uuid_lookup(Collection)
+        collection_ids = existing.union([entry['uuid'] for entry in collections])
+        insert(Collection, [set_dates(Collection(name=entry['name'],
+                                                 uuid=entry['uuid'],
+                                                 description=entry['readme'],
+                                                 parent_id=entry['parent_uuid'] if entry['parent_uuid'] in collection_ids else None), entry)
+                            for entry in collections if entry['uuid'] not in existing])
+        tag_links(Collection.tags, collections)
+
+        # Modules ##############################################################
+
+        modules = load('modules-full.json')
+        existing = get_uuid_lookup(Module)
+        insert(Module, [Module(uuid=entry['uuid'],
+                               data=entry['data'],
+                               model_id=entry['model_id'],
+                               name=entry['name'],
+                               notes=entry['notes'],
+                               module_type=entry['module_type'],
+                               container_id=entry['container_uuid'])
+                        for entry in modules if entry['uuid'] not in existing])
+
+        # Robots ###############################################################
+
+        robots = load('robots-full.json')
+        existing = get_uuid_lookup(Robot)
+        insert(Robot, [set_dates(Robot(uuid=entry['uuid'],
+                                       left_mount_id=entry['left_mount'],
+                                       right_mount_id=entry['right_mount'],
+                                       container_id=entry['container_uuid'],
+                                       notes=entry['notes'],
+                                       name=entry['name'],
+                                       robot_id=entry['robot_id'],
+                                       server_version=entry['server_version'],
+                                       robot_type=entry['robot_type']), entry)
+                       for entry in robots if entry['uuid'] not in existing])
+
+        # Files and Material Transfer Agreements ###############################
+        # These require copying files, and are done one at a time
+
+        files_lookup = self.import_files(folder)
+        self.import_mtas(folder, files_lookup)
+
+        # Authors ##############################################################
+
+        authors = load('authors-full.json')
+        existing = get_uuid_lookup(Author)
+        insert(Author, [Author(uuid=entry['uuid'],
+                               affiliation=entry['affiliation'],
+                               name=entry['name'],
+                               email=entry['email'],
+                               orcid=os.path.basename(entry['orcid']) if entry['orcid'] else None)
+                        for entry in authors if entry['uuid'] not in existing])
+        tag_links(Author.tags, authors)
+
+        # Wells ################################################################
+
+        wells = load('wells-full.json')
+        existing = get_uuid_lookup(Well)
+        insert(Well, [Well(uuid=entry['uuid'],
+                           media=entry['media'],
+                           organism_id=entry['organism_uuid'],
+                           address=entry['address'],
+                           volume=entry['volume'],
+                           quantity=entry['quantity'] or 0)
+                      for entry in wells if entry['uuid'] not in existing])
+
+        # Plate wells are linked after both exist
+        bulk_link(Plate.wells, [(entry['uuid'], well) for entry in plates.values()
+                                for well in entry.get('wells', [])])
+
+        # PlateSet #############################################################
+
+        platesets = load('plateset-full.json')
+        existing = get_uuid_lookup(PlateSet)
+        insert(PlateSet, [set_dates(PlateSet(uuid=entry['uuid'],
+                                             description=entry['description'],
+                                             name=entry['name']), entry)
+                          for entry in platesets if entry['uuid'] not in existing])
+        bulk_link(PlateSet.plates, [(entry['uuid'], plate) for entry in platesets
+                                    for plate in entry['plates']])
+
+        # Distribution #########################################################
+
+        distributions = load('distribution-full.json')
+        existing = get_uuid_lookup(Distribution)
+        insert(Distribution, [set_dates(Distribution(uuid=entry['uuid'],
+                                                     name=entry['name'],
+                                                     description=entry['description']), entry)
+                              for entry in distributions if entry['uuid'] not in existing])
+        bulk_link(Distribution.platesets, [(entry['uuid'], plateset) for entry in distributions
+                                           for plateset in entry['platesets']])
+
+        # Parts ################################################################
+
+        parts = load('parts-full.json')
+        existing = get_uuid_lookup(Part)
+        new_parts = []
+        for entry in parts:
+            if entry['uuid'] in existing:
+                continue
+            part = Part(uuid=entry['uuid'],
+                        author_id=entry['author_uuid'],
+                        full_sequence=entry['full_sequence'],
+                        optimized_sequence=entry['optimized_sequence'],
+                        original_sequence=entry['original_sequence'],
+                        synthesized_sequence=entry['synthesized_sequence'],
+                        gene_id=entry['gene_id'],
+                        vector=entry['vector'],
+                        genbank=entry['genbank'] or {},
+                        description=entry['description'],
+                        barcode=entry['barcode'],
+                        part_type=entry['part_type'],
+                        name=entry['name'],
+                        translation=entry['translation'],
+                        primer_forward=entry['primer_for'] or "",
+                        primer_reverse=entry['primer_rev'] or "",
+                        ip_check=bool(entry['ip_check']),
+                        ip_check_ref=entry['ip_check_ref'] or "")
+            if entry['ip_check_date']:
+                part.ip_check_date = parse(entry['ip_check_date'])
+            new_parts.append(set_dates(part, entry))
+
+        insert(Part, new_parts)
+        tag_links(Part.tags, parts)
+        bulk_link(Part.collections, [(entry['uuid'], entry['collection_id']) for entry in parts
+                                     if entry['collection_id'] in collection_ids])
+        Collection.clear_rollups()
+
+        # Samples ##############################################################
+        # Derived from is a foreign key to another sample, checked at commit
+
+        samples = load('samples-full.json')
+        existing = get_uuid_lookup(Sample)
+        insert(Sample, [set_dates(Sample(uuid=entry['uuid'],
+                                         evidence=entry['evidence'],
+                                         sample_type=entry['sample_type'],
+                                         status=entry['status'],
+                                         vendor=entry['vendor'],
+                                         part_id=entry['part_uuid'],
+                                         index_forward=entry['index_for'] or None,
+                                         index_reverse=entry['index_rev'] or None,
+                                         derived_from_id=entry['derived_from'] or None), entry)
+                        for entry in samples if entry['uuid'] not in existing])
+        bulk_link(Sample.wells, [(entry['uuid'], well) for entry in samples
+                                 for well in entry['wells']])
+
+        # Samples and links are added in bulk (without save or signals) so
+        # lineage and plate contents are refreshed
+        Sample.rebuild_lineage()
+        WellContent.refresh(plates.keys())
+        FactoryOrder.clear_progress()
+
+        # Schema, Operation, and Plans are not exported from the API
+
+        # Order ################################################################
+
+        orders = load('order-full.json')
+        existing = get_uuid_lookup(Order)
+        insert(Order, [set_dates(Order(uuid=entry['uuid'],
+                                       name=entry['name'],
+                                       material_transfer_agreement_id=entry['materialtransferagreement'],
+                                       notes=entry['notes']), entry)
+                       for entry in orders if entry['uuid'] not in existing])
+        bulk_link(Order.distributions, [(entry['uuid'], distribution) for entry in orders
+                                        for distribution in entry['distributions']])
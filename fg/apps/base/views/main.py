@@ -8,28 +8,12 @@ with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
 '''
 
+from django.core.paginator import Paginator
 from django.shortcuts import render
  
 from ratelimit.decorators import ratelimit
 from fg.apps.orders.models import Order
-from fg.apps.main.models import (
-    Author,
-    Container,
-    Collection,
-    Distribution,
-    Institution,
-    Module,
-    Operation,
-    Organism,
-    Part,
-    Plan,
-    Plate,
-    PlateSet,
-    Protocol,
-    Robot,
-    Sample,
-    Tag
-)
+from fg.apps.main.statistics import get_statistics
 
 from fg.settings import (
     VIEW_RATE_LIMIT as rl_rate, 
@@ -56,39 +40,28 @@ def privacy_view(request):
 @ratelimit(key='ip', rate=rl_rate, block=rl_block)
 def dashboard_view(request):
     '''Show the logged in regular user their orders, or an admin/staff
-       all orders. Also show stats for the node, not including Schema.
+       all orders (paginated). Also show stats for the node, not including
+       Schema, from the statistics snapshot.
     '''
     context = {}
-
-    # Counts go into the bar chart, should be scaled similarity
-    context['counts'] = {
-        "authors": Author.objects.count(),
-        "containers": Container.objects.count(),
-        "collections": Collection.objects.count(),
-        "distributions": Distribution.objects.count(),
-        "institutions": Institution.objects.count(),
-        "modules": Module.objects.count(),
-        "operations": Operation.objects.count(),
-        "organisms": Organism.objects.count(),
-        "plans": Plan.objects.count(),
-        "platesets": PlateSet.objects.count(),
-        "robots": Robot.objects.count(),
-        "protocols": Protocol.objects.count()
-    }
+    counts = get_statistics()
 
     # These are printed (numbers) since they are larged
-    context['parts_count'] = Part.objects.count()
-    context['samples_count'] = Sample.objects.count()
-    context['plates_count'] = Plate.objects.count()
-    context['tags_count'] = Tag.objects.count()
+    for name in ["parts", "samples", "plates", "tags"]:
+        context['%s_count' % name] = counts.pop(name)
+
+    # Counts go into the bar chart, should be scaled similarity
+    context['counts'] = counts
 
-    orders = []
+    orders = Order.objects.none()
     if request.user.is_superuser or request.user.is_staff:
         orders = Order.objects.all()
     elif request.user.is_authenticated:
         orders = Order.objects.filter(user=request.user)
 
-    context['orders'] = orders
+    orders = orders.select_related('user__institution') \
+                   .prefetch_related('distributions').order_by('-time_created')
+    context['orders'] = Paginator(orders, 50).get_page(request.GET.get('page'))
     return render(request, 'main/dashboard.html', context)
 
 @ratelimit(key='ip', rate=rl_rate, block=rl_block)
@@ -12,8 +12,6 @@ from django.db.models import Q
 from django.shortcuts import render
 from ratelimit.decorators import ratelimit
 
-from fg.apps.main.models.queries import get_part_available_query
-from fg.apps.base.context_processors import get_unique_parts
 from fg.apps.orders.models import Order
 from fg.apps.main.models import (
     Author,
@@ -32,7 +30,8 @@ from fg.apps.main.models import (
     Robot,
     Sample,
     Schema,
-    Tag
+    Tag,
+    WellContent
 )
 
 from fg.settings import (
@@ -154,9 +153,9 @@ def parts_query(q, available=False):
                         Q(gene_id__icontains=q)).distinct()
 
     # Generate list of available to annotate
-    gene_ids = list(get_unique_parts())
-    query = get_part_available_query(gene_ids)
-    available_uuids = [str(p.uuid) for p in Part.objects.raw(query)[:]]
+    available_uuids = set(WellContent.objects.filter(part__isnull=False,
+                                                     plate__plateset_plates__distribution_plateset__isnull=False)
+                                             .values_list('part_id', flat=True).distinct())
 
     if available:
         parts = parts.filter(uuid__in=available_uuids)
@@ -164,7 +163,7 @@ def parts_query(q, available=False):
     # Need to annotate parts
     for part in parts:
         part.is_available = False
-        if str(part.uuid) in available_uuids:
+        if part.uuid in available_uuids:
             part.is_available = True
 
     return parts
@@ -0,0 +1,281 @@
+'''
+
+Copyright (C) 2019 Vanessa Sochat.
+
+This Source Code Form is subject to the terms of the
+Mozilla Public License, v. 2.0. If a copy of the MPL was not distributed
+with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+'''
+
+from django.core.management.base import (
+    BaseCommand,
+    CommandError
+)
+from django.db import transaction
+from fg.apps.factory.models import (
+    FactoryOrder,
+    Vendor
+)
+from fg.apps.factory.utils import read_csv
+from fg.apps.factory.views.factory import import_plates_task
+from fg.apps.factory.views.twist import (
+    import_parts_task,
+    import_plate_task
+)
+from fg.apps.main.models import (
+    Author,
+    Container,
+    Part,
+    get_plate_layout
+)
+from fg.apps.main.utils import (
+    capture_queries,
+    load_json,
+    save_json
+)
+
+from contextlib import redirect_stdout
+from io import (
+    BytesIO,
+    StringIO
+)
+import csv
+import time
+import tracemalloc
+import uuid
+
+# Synthetic plates are standard96
+PLATE_HEIGHT = 8
+PLATE_LENGTH = 12
+
+TWIST_PLATE_HEADERS = ['Name', 'Insertion point name', 'Vector name', 'Insert length',
+                       'Construct length', 'Insert sequence', 'Construct sequence',
+                       'Well Location', 'Yield', 'NGS', 'Yield (ng)', 'Product type',
+                       'Plate ID']
+
+TWIST_PART_HEADERS = ['Name', 'Insertion site name', 'Vector name', 'Insert length',
+                      'Construct length', 'Insert sequence', 'Construct sequence',
+                      'Step', 'Shipping est']
+
+
+def generate_csv(headers, rows):
+    '''write synthetic rows to csv (as Twist would export) and read them back
+       with the same function used for uploads.
+    '''
+    content = StringIO()
+    writer = csv.writer(content)
+    writer.writerow(headers)
+    writer.writerows(rows)
+    return read_csv(BytesIO(content.getvalue().encode('utf-8')), delim=',')
+
+
+def generate_twist_rows(gene_ids):
+    '''generate a Twist plate map for a list of (existing) part gene ids,
+       with 96 wells per plate.
+    '''
+    layout = get_plate_layout(PLATE_HEIGHT, PLATE_LENGTH)
+    rows = []
+    for index, gene_id in enumerate(gene_ids):
+        rows.append([gene_id, 'MoClo', 'pOpen_v3', '1000', '3000', 'ATGC', 'ATGC',
+                     layout[index % len(layout)], '1.0', 'Pass', '100', 'Glycerol stock',
+                     'BENCHPLATE%04d' % (index // len(layout))])
+    return generate_csv(TWIST_PLATE_HEADERS, rows)
+
+
+def generate_twist_fields(rows, container):
+    '''generate the plate fields that a user would submit with the plate map
+    '''
+    fields = {}
+    for plate_id in set([row[-1] for row in rows[1:]]):
+        fields.update({"plate_%s" % plate_id: plate_id,
+                       "plate_container_%s" % plate_id: str(container.uuid),
+                       "plate_length_%s" % plate_id: str(PLATE_LENGTH),
+                       "plate_height_%s" % plate_id: str(PLATE_HEIGHT),
+                       "plate_form_%s" % plate_id: "standard96"})
+    return fields
+
+
+def generate_plates_json(size):
+    '''generate an exported plate json with a new part and sample in each
+       of size wells, with 96 wells per plate.
+    '''
+    layout = get_plate_layout(PLATE_HEIGHT, PLATE_LENGTH)
+    author_id = str(uuid.uuid4())
+    author = {'uuid': author_id, 'name': 'Benchmark', 'email': 'benchmark-%s@example.com' % author_id,
+              'affiliation': 'FreeGenes', 'orcid': None, 'tags': []}
+    organism = {'uuid': str(uuid.uuid4()), 'name': 'E. coli', 'description': 'benchmark',
+                'genotype': 'unknown'}
+    plates = []
+    for index in range(size):
+        if index % len(layout) == 0:
+            plates.append({'uuid': str(uuid.uuid4()), 'plate_type': 'glycerol_stock',
+                           'plate_form': 'standard96', 'status': 'Stocked',
+                           'name': 'benchmark-%s' % len(plates), 'thaw_count': 0,
+                           'notes': '', 'height': PLATE_HEIGHT, 'length': PLATE_LENGTH,
+                           'plate_vendor_id': 'BENCHJSON%04d' % len(plates),
+                           'plateset': None, 'distribution': None, 'wells': []})
+
+        part = {'uuid': str(uuid.uuid4()), 'name': 'bench-json-%05d' % index,
+                'description': 'benchmark', 'status': 'null',
+                'gene_id': 'bench-json-%05d' % index, 'part_type': 'cds', 'genbank': {},
+                'original_sequence': 'ATGC', 'optimized_sequence': 'ATGC',
+                'synthesized_sequence': 'ATGC', 'full_sequence': 'ATGC',
+                'vector': 'pOpen_v3', 'primer_forward': 'ATGC', 'primer_reverse': 'ATGC',
+                'barcode': 'ATGC', 'translation': 'M', 'collections': [], 'author': author,
+                'tags': [{'tag': 'benchmark'}]}
+
+        sample = {'uuid': str(uuid.uuid4()), 'outside_collaborator': False,
+                  'sample_type': 'Glycerol stock', 'status': 'Confirmed',
+                  'evidence': 'Twist_Confirmed', 'vendor': 'Twist', 'part': part,
+                  'index_forward': None, 'index_reverse': None, 'derived_from': []}
+
+        plates[-1]['wells'].append({'uuid': str(uuid.uuid4()),
+                                    'address': layout[index % len(layout)],
+                                    'volume': 50, 'quantity': 0, 'media': 'glycerol_lb',
+                                    'organism': organism, 'sample': sample})
+    return plates
+
+
+class Command(BaseCommand):
+    '''Benchmark the factory importers (Twist parts and plate maps, and exported
+       plate json) with synthetic data of several sizes. Each size is run
+       in a transaction that is rolled back, so the database is not changed.
+       We report rows per second, queries, and peak (python) memory.
+
+       usage: python manage.py benchmark_imports --sizes 96,960
+              python manage.py benchmark_imports --output baseline.json
+              python manage.py benchmark_imports --baseline baseline.json
+
+       With a baseline, the command exits with an error if the queries for
+       any importer (or the throughput, with --check-time) regress by more
+       than the tolerance.
+    '''
+    help = "Benchmark factory importers with synthetic data"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', dest='sizes', type=str, default="96,480",
+                            help="comma separated number of rows (wells) to import")
+        parser.add_argument('--output', dest='output', type=str, default=None,
+                            help="save results to a json file (e.g., a baseline)")
+        parser.add_argument('--baseline', dest='baseline', type=str, default=None,
+                            help="compare results to a previous output json file")
+        parser.add_argument('--tolerance', dest='tolerance', type=float, default=0.1,
+                            help="allowed fraction of regression from baseline (default 0.1)")
+        parser.add_argument('--check-time', dest='check_time', action='store_true',
+                            default=False, help="also flag throughput regressions")
+
+    def handle(self, *args, **options):
+        try:
+            sizes = [int(x) for x in options['sizes'].split(',')]
+        except ValueError:
+            raise CommandError("Sizes must be a comma separated list of numbers.")
+
+        results = {}
+        for size in sizes:
+            results.update(self.run_size(size))
+
+        self.print_results(results)
+
+        if options['output']:
+            save_json(results, options['output'])
+            print("Results saved to %s" % options['output'])
+
+        if options['baseline']:
+            self.compare(results, load_json(options['baseline']),
+                         tolerance=options['tolerance'],
+                         check_time=options['check_time'])
+
+    def run_size(self, size):
+        '''run each importer for a number of rows, rolling back after.
+        '''
+        results = {}
+        with transaction.atomic():
+
+            container = Container.objects.create(name="benchmark-%s" % size,
+                                                 container_type="lab",
+                                                 description="Benchmark container")
+            vendor, created = Vendor.objects.get_or_create(name="Twist")
+            order = FactoryOrder.objects.create(name="benchmark-%s" % size, vendor=vendor)
+            author = Author.objects.create(name="Benchmark", email="benchmark-%s@example.com" % size)
+
+            # Twist imports require existing parts
+            gene_ids = ['bench-twist-%05d' % index for index in range(size)]
+            Part.objects.bulk_create([Part(gene_id=gene_id, name=gene_id, part_type='cds',
+                                           author=author) for gene_id in gene_ids])
+
+            parts_rows = generate_csv(TWIST_PART_HEADERS, [[gene_id] + [''] * 8 for gene_id in gene_ids])
+            plate_rows = generate_twist_rows(gene_ids)
+            fields = generate_twist_fields(plate_rows, container)
+            plates = generate_plates_json(size)
+
+            def copy_rows(rows):
+                return [list(row) for row in rows]
+
+            for name, func, arguments in [
+                ("twist_parts", import_parts_task, lambda: (copy_rows(parts_rows), str(order.uuid))),
+                ("twist_plates", import_plate_task, lambda: (copy_rows(plate_rows), fields, str(order.uuid))),
+                ("twist_plates_reimport", import_plate_task, lambda: (copy_rows(plate_rows), fields, str(order.uuid))),
+                ("plate_json", import_plates_task, lambda: (plates, container)),
+                ("plate_json_reimport", import_plates_task, lambda: (plates, container))]:
+
+                key = "%s:%s" %(name, size)
+                results[key] = self.measure(func, arguments(), size)
+
+                # Every importer reads the database, so no queries means they weren't counted
+                if not results[key]['queries']:
+                    raise CommandError("No queries were counted for %s." % key)
+
+            transaction.set_rollback(True)
+        return results
+
+    def measure(self, func, arguments, size):
+        '''run an importer with a list of arguments, and return the seconds,
+           rows per second, queries, and peak memory.
+        '''
+        output = StringIO()
+        tracemalloc.start()
+        start = time.time()
+        with capture_queries() as queries, redirect_stdout(output):
+            func(*arguments)
+        seconds = time.time() - start
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        return {"rows": size,
+                "seconds": round(seconds, 4),
+                "rows_per_second": round(size / seconds, 2) if seconds else None,
+                "queries": len(queries),
+                "peak_memory_kb": round(peak / 1024, 1)}
+
+    def print_results(self, results):
+        print("%-30s %8s %10s %12s %10s %12s" %("importer", "rows", "seconds",
+                                                "rows/second", "queries", "peak (KB)"))
+        for key, result in results.items():
+            print("%-30s %8s %10s %12s %10s %12s" %(key, result['rows'], result['seconds'],
+                                                    result['rows_per_second'],
+                                                    result['queries'],
+                                                    result['peak_memory_kb']))
+
+    def compare(self, results, baseline, tolerance, check_time=False):
+        '''compare results to a baseline, and exit with an error if any
+           importer regressed by more than the tolerance.
+        '''
+        regressions = []
+        for key, result in results.items():
+            if key not in baseline:
+                continue
+            previous = baseline[key]
+
+            if result['queries'] > previous['queries'] * (1 + tolerance):
+                regressions.append("%s queries %s (baseline %s)" %(key, result['queries'],
+                                                                   previous['queries']))
+
+            if check_time and previous['rows_per_second'] and result['rows_per_second'] and \
+               result['rows_per_second'] < previous['rows_per_second'] * (1 - tolerance):
+                regressions.append("%s rows/second %s (baseline %s)" %(key, result['rows_per_second'],
+                                                                       previous['rows_per_second']))
+
+        if regressions:
+            raise CommandError("Import regressions found:\n%s" % "\n".join(regressions))
+        print("No regressions found compared to baseline.")
@@ -9,10 +9,12 @@ with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
 '''
 
 from django.conf import settings
+from django.core.cache import cache
 from django.core.validators import MinValueValidator
 from django.db import models
 from django.db.models import Sum
 from django.shortcuts import reverse
+from fg.settings import FACTORYORDER_PROGRESS_CACHE_TIMEOUT
 
 import os
 import time
@@ -108,39 +110,87 @@ class FactoryOrder(models.Model):
 
     # Counting Functions
 
+    def get_parts(self):
+        '''return the parts for the order, annotated with "completed" (True
+           if the part has a sample, False otherwise) in the same query.
+        '''
+        from fg.apps.main.models import Sample
+        samples = Sample.objects.filter(part=models.OuterRef('pk'))
+        return self.parts.annotate(completed=models.Exists(samples))
+
+    @classmethod
+    def get_progress_key(cls, uuid):
+        return "factoryorder-progress:%s" % uuid
+
+    @classmethod
+    def set_progress(cls, orders):
+        '''set the progress (total, completed and failed parts) for a list
+           of orders. Progress is cached for each order, and those not in
+           the cache are counted together with one (grouped) query.
+        '''
+        orders = list(orders)
+        keys = {cls.get_progress_key(order.uuid): order for order in orders}
+        progress = {keys[key].uuid: value for key, value in cache.get_many(keys.keys()).items()}
+
+        missing = [order.uuid for order in orders if order.uuid not in progress]
+        if missing:
+            from fg.apps.main.models import Sample
+            samples = Sample.objects.filter(part=models.OuterRef('part_id'))
+            counts = (cls.parts.through.objects.filter(factoryorder_id__in=missing)
+                                              .annotate(completed=models.Exists(samples))
+                                              .values('factoryorder_id', 'completed')
+                                              .annotate(count=models.Count('*')))
+
+            computed = {uuid: {"total": 0, "completed": 0, "failed": 0} for uuid in missing}
+            for count in counts:
+                summary = computed[count['factoryorder_id']]
+                summary["completed" if count['completed'] else "failed"] += count['count']
+                summary["total"] += count['count']
+
+            cache.set_many({cls.get_progress_key(uuid): summary for uuid, summary in computed.items()},
+                           FACTORYORDER_PROGRESS_CACHE_TIMEOUT)
+            progress.update(computed)
+
+        for order in orders:
+            order._progress = progress[order.uuid]
+
+    @classmethod
+    def clear_progress(cls, uuids=None):
+        '''clear the cached progress for a list of order uuids (or all orders),
+           done when samples are created for (or parts added to) an order.
+        '''
+        if uuids is None:
+            uuids = cls.objects.values_list('uuid', flat=True)
+        cache.delete_many([cls.get_progress_key(uuid) for uuid in uuids])
+
+    @property
+    def progress(self):
+        '''a summary of the total, completed, and failed parts for the order
+           (see set_progress).
+        '''
+        if not hasattr(self, '_progress'):
+            FactoryOrder.set_progress([self])
+        return self._progress
+
     def count_parts_completed(self):
         '''determine parts completed based on having (or not having) a sample.
         '''
-        count = 0
-        for part in self.parts.all():
-            if part.sample_set.count() > 0:
-                count+=1
-
-        return count
+        return self.progress['completed']
 
     def count_parts_failed(self):
         '''parts failed is total minus parts completed
         '''
-        return self.parts.count() - self.count_parts_completed()
+        return self.progress['failed']
 
     # Get filtered parts
 
     def get_completed_parts(self):
         '''return completed parts'''
-        parts = []
-        for part in self.parts.all():
-            if part.sample_set.count() > 0:
-                parts.append(part)
-        return parts
+        return self.get_parts().filter(completed=True)
 
     def get_failed_parts(self):
-        '''return completed parts'''
-        parts = []
-        for part in self.parts.all():
-            if part.sample_set.count() == 0:
-                parts.append(part)
-        return parts
-   
+        '''return failed parts'''
+        return self.get_parts().filter(completed=False)
 
     def __str__(self):
         return "<FactoryOrder:%s>" % self.name
@@ -204,3 +254,6 @@ class Invoice(models.Model):
 
     class Meta:
         app_label = 'factory'
+
+
+from .signals import clear_factoryorder_progress
@@ -0,0 +1,51 @@
+'''
+
+Copyright (C) 2019 Vanessa Sochat.
+
+This Source Code Form is subject to the terms of the
+Mozilla Public License, v. 2.0. If a copy of the MPL was not distributed
+with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+'''
+
+from django.dispatch import receiver
+from django.db.models.signals import (
+    m2m_changed,
+    post_delete,
+    post_save
+)
+from fg.apps.main.models import Sample
+from fg.apps.factory.models import FactoryOrder
+
+
+@receiver(post_save, sender=Sample, dispatch_uid='sample_save_progress_signal')
+@receiver(post_delete, sender=Sample, dispatch_uid='sample_delete_progress_signal')
+def clear_factoryorder_progress(sender, instance, **kwargs):
+    '''When a sample is created (or deleted) for a part, the part may now be
+       completed (or failed), so we clear the progress of orders with it.
+       An updated sample only changes progress if it's moved to another part.
+    '''
+    part_ids = set([instance.part_id])
+    if not kwargs.get('created', True):
+        loaded = getattr(instance, '_loaded_part', instance.part_id)
+        part_ids = set([loaded, instance.part_id]) if loaded != instance.part_id else set()
+    instance._loaded_part = instance.part_id
+
+    part_ids.discard(None)
+    if part_ids:
+        orders = FactoryOrder.parts.through.objects.filter(part_id__in=part_ids)
+        FactoryOrder.clear_progress(orders.values_list('factoryorder_id', flat=True))
+
+
+@receiver(m2m_changed, sender=FactoryOrder.parts.through, dispatch_uid='factoryorder_parts_progress_signal')
+def factoryorder_parts_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    '''When parts are added to (or removed from) an order, clear its progress.
+       When reversed, the instance is a part and pk_set are orders.
+    '''
+    if action.startswith("post"):
+        if not reverse:
+            FactoryOrder.clear_progress([instance.uuid])
+        elif pk_set:
+            FactoryOrder.clear_progress(pk_set)
+        else:
+            FactoryOrder.clear_progress()
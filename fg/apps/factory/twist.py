@@ -23,17 +23,16 @@ def get_unique_plates(rows):
     # We need to look up all rows to populate the form
     headers = rows.pop(0)
 
-    for row in rows:
+    # The plate id maps to plate.vendor_plate_id, look up existing at once
+    existing = set(Plate.objects.filter(plate_vendor_id__in=[row[headers.index("Plate ID")] for row in rows])
+                                .values_list('plate_vendor_id', flat=True))
 
-        # The plate id maps to plate.vendor_plate_id
+    for row in rows:
         plate_id = row[headers.index("Plate ID")]
-        try:
-            Plate.objects.get(plate_vendor_id=plate_id)
 
         # Only add if it doesn't exist already
-        except Plate.DoesNotExist:
-            if plate_id not in plate_ids:
-                plate_ids[plate_id] = {"product_type": row[headers.index("Product type")],
-                                       "name": row[headers.index("Name")]}
+        if plate_id not in existing and plate_id not in plate_ids:
+            plate_ids[plate_id] = {"product_type": row[headers.index("Product type")],
+                                   "name": row[headers.index("Name")]}
 
     return plate_ids
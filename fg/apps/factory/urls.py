@@ -28,6 +28,7 @@ urlpatterns = [
     url(r'^factoryorder/parts/(?P<uuid>.+)/?$', views.view_factoryorder_parts, name='view_factoryorder_parts'),
 
     # Lab Map
+    url(r'^map/children/?$', views.lab_map_children, name='lab_map_children'),
     url(r'map/?$', views.lab_map_view, name='lab_map'),
 
 ]
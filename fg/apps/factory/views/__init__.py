@@ -11,4 +11,7 @@ from .twist import (
     twist_import_parts
 )
 
-from .map import lab_map_view
+from .map import (
+    lab_map_children,
+    lab_map_view
+)
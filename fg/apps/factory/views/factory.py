@@ -19,6 +19,8 @@ from django.shortcuts import redirect
 from fg.apps.factory.models import FactoryOrder
 from fg.apps.factory.forms import UploadFactoryPlateJsonForm
 from fg.apps.factory.utils import read_json
+from fg.apps.main.models import WellContent
+from fg.apps.main.utils import generate_sha256
 
 from ratelimit.decorators import ratelimit
 from fg.settings import (
@@ -39,7 +41,8 @@ def factory_view(request):
         messages.info(request, "You are not allowed to see this view.")
         return redirect('dashboard')
 
-    orders = FactoryOrder.objects.all()
+    orders = list(FactoryOrder.objects.all())
+    FactoryOrder.set_progress(orders)
     return render(request, 'factory/incoming.html', {"orders": orders})
 
 # Parts Tables
@@ -79,6 +82,7 @@ def view_factoryorder_parts(request, uuid, subset=None):
         parts = order.get_failed_parts()
     else:
         parts = order.parts.all()
+    parts = parts.select_related('author').prefetch_related('tags')
 
     context = {
         "order": order,
@@ -122,6 +126,7 @@ def import_factory_plate(request):
     return render(request, 'factory/factory_plate_import.html', context)
 
 
+@WellContent.deferred()
 def import_plates_task(data, container):
     '''read in a list of plates from an imported json. The json (to be valid)
        should be a list of plates, each of which has wells, each well
@@ -130,83 +135,49 @@ def import_plates_task(data, container):
     from fg.apps.main.models import (
         Plate, Well, Part, Sample, Author, Tag, Organism, PlateSet, Distribution
     )
+    from fg.apps.main.models.schemas import PLATE_IMPORT_SCHEMA
+    from fg.apps.main.models.validators import get_json_errors
 
     # must be a list
     if not isinstance(data, list):
         return "Invalid file: data must be a list of plates."
 
-    plate_fields = ['uuid', 'plate_type', 'plate_form', 'status', 'name', 
-                    'thaw_count', 'notes', 'height', 'length', 
-                    'wells', 'plate_vendor_id']
-
-    well_fields = ['uuid', 'address', 'volume', 'quantity', 'media', 'organism', 'sample']
-
-    sample_fields = ['uuid', 'outside_collaborator', 'sample_type', 'status',
-                     'evidence', 'vendor', 'part', 'index_forward', 'index_reverse']
-
-    part_fields = ['uuid', 'name', 'description', 'status', 'gene_id', 'part_type', 
-                   'genbank', 'original_sequence', 'optimized_sequence', 
-                   'synthesized_sequence', 'full_sequence', 'vector', 
-                   'primer_forward', 'primer_reverse', 'barcode', 
-                   'translation', 'tags', 'collections', 'author']
-
-    author_fields = ['uuid', 'name', 'email', 'affiliation', 'orcid', 'tags']
-
-    # Optional imports
-    plateset_fields = ['uuid', 'description', 'name']
-    distribution_fields = ['uuid', 'name', 'description']
-
     print("Found %s contender plates" % len(data))
 
     # First validate all required - don't do any import if something is wrong
-    for entry in data:
- 
-        # Ensure all plate fields present
-        if not set(plate_fields).issubset(entry.keys()):
-            return "Each plate must have fields %s" % ", ".join(plate_fields)
-
-        # Plateset and Distribution (optional)
-        if entry['plateset'] is not None:
-            if not set(plateset_fields).issubset(entry['plateset'].keys()):
-                return "Each defined plateset must have fields %s" % ", ".join(plateset_fields)
-
-        if entry['distribution'] is not None:
-            if not set(distribution_fields).issubset(entry['distribution'].keys()):
-                return "Each defined distribution must have fields %s" % ", ".join(plateset_fields)
-
-        # Cannot import distribution without plateset
-        if entry['distribution'] is not None and entry['plateset'] is None:
-            return "You cannot import a plate distribution without a plateset."
-
-        for well in entry['wells']:
-
-            # Well fields
-            if not set(well_fields).issubset(well.keys()):
-                return "Each well must have fields %s" % ", ".join(well_fields)
-
-            # Sample fields
-            if not set(sample_fields).issubset(well['sample'].keys()):
-                return "Each sample must have fields %s" % ", ".join(sample_fields)
-
-            # Part fields
-            if not set(part_fields).issubset(well['sample']['part'].keys()):
-                return "Each part must have fields %s" % ", ".join(part_fields)
-
-            # Author fields
-            if not set(author_fields).issubset(well['sample']['part']['author'].keys()):
-                return "Each author must have fields %s" % ", ".join(author_fields)
-
+    errors = get_json_errors(data, PLATE_IMPORT_SCHEMA)
+    if errors:
+        return "Invalid file: %s" % "; ".join(errors)
 
     # Keep a count of objects created
     counts = {'plates': 0, 'samples': 0, 'parts': 0, 'tags': 0, 'authors': 0, 
-              'wells': 0, 'platesets': 0, 'distributions': 0}
+              'wells': 0, 'platesets': 0, 'distributions': 0, 'organisms': 0,
+              'unchanged': 0}
+
+    # Digests of plates and parts already imported, looked up in advance
+    plate_digests = dict(Plate.objects.filter(uuid__in=[entry['uuid'] for entry in data])
+                                      .values_list('uuid', 'digest'))
+    plate_digests = {str(k): v for k, v in plate_digests.items()}
+    parts = {part.gene_id: part for part in Part.objects.filter(
+             gene_id__in=[well['sample']['part']['gene_id'] for entry in data 
+                          for well in entry['wells']])}
 
     # Now we can import knowing all data is provided
     for entry in data:
- 
-        # Only import if it doesn't exist
+
+        # Skip plates that are unchanged since the last import
+        digest = generate_sha256(entry)
+        if plate_digests.get(entry['uuid']) == digest:
+            counts['unchanged']+=1
+            continue
+
+        # A changed plate and its wells are updated, and samples that are missing added
         try:
             plate = Plate.objects.get(uuid=entry['uuid'])
+            for field in ['name', 'plate_vendor_id', 'plate_type', 'status', 'thaw_count']:
+                setattr(plate, field, entry[field])
+            plate.save()
+
         except Plate.DoesNotExist:
 
             # time created and updated aren't included, specific to the node
@@ -222,137 +193,143 @@ def import_plates_task(data, container):
                                          status=entry['status'],
                                          thaw_count=entry['thaw_count'])
 
-            # If a distribution and plateset are defined
-            plateset = None
-            if entry['plateset'] is not None:
+        # If a distribution and plateset are defined
+        plateset = None
+        if entry['plateset'] is not None:
 
-                psEntry = entry['plateset']
-                try:
-                    plateset = PlateSet.objects.get(uuid=psEntry['uuid'])
-                except PlateSet.DoesNotExist:
-                    counts['platesets']+=1
-                    plateset = PlateSet.objects.create(uuid=uuid.UUID(psEntry['uuid']),
-                                                       description=psEntry['description'],
-                                                       name=psEntry['name'])
-
-            # A distribution requires a plateset
-            dist = None
-            if entry['distribution'] is not None and plateset is not None:
-
-                distEntry = entry['distribution']
-                try:
-                    dist = Distribution.objects.get(uuid=distEntry['uuid'])
-                except Distribution.DoesNotExist:
-                    counts['distributions']+=1
-                    dist = Distribution.objects.create(uuid=uuid.UUID(distEntry['uuid']),
-                                                       description=distEntry['description'],
-                                                       name=distEntry['name'])
-
-            # Create each well
-            for wellEntry in entry['wells']:
-                sampleEntry = wellEntry['sample']
-                partEntry = sampleEntry['part']
-                authorEntry = partEntry['author']               
-                organismEntry = wellEntry['organism']
+            psEntry = entry['plateset']
+            try:
+                plateset = PlateSet.objects.get(uuid=psEntry['uuid'])
+            except PlateSet.DoesNotExist:
+                counts['platesets']+=1
+                plateset = PlateSet.objects.create(uuid=uuid.UUID(psEntry['uuid']),
+                                                   description=psEntry['description'],
+                                                   name=psEntry['name'])
+
+        # A distribution requires a plateset
+        dist = None
+        if entry['distribution'] is not None and plateset is not None:
+
+            distEntry = entry['distribution']
+            try:
+                dist = Distribution.objects.get(uuid=distEntry['uuid'])
+            except Distribution.DoesNotExist:
+                counts['distributions']+=1
+                dist = Distribution.objects.create(uuid=uuid.UUID(distEntry['uuid']),
+                                                   description=distEntry['description'],
+                                                   name=distEntry['name'])
+
+        # Create each well
+        for wellEntry in entry['wells']:
+            sampleEntry = wellEntry['sample']
+            partEntry = sampleEntry['part']
+            authorEntry = partEntry['author']               
+            organismEntry = wellEntry['organism']
+
+            # Create the Part (retrieve based on gene id, not uuid)
+            part = parts.get(partEntry['gene_id'])
+            partDigest = generate_sha256(partEntry)
+            if part is None:
 
                 # Author is associated with a part                
                 try:
                     author = Author.objects.get(uuid=authorEntry['uuid'])
                 except Author.DoesNotExist:
+                    counts['authors']+=1
                     author = Author.objects.create(uuid=uuid.UUID(authorEntry['uuid']),
+                                                   name=authorEntry['name'],
                                                    email=authorEntry['email'],
                                                    affiliation=authorEntry['affiliation'],
                                                    orcid=authorEntry['orcid'])
 
-                # Create the Part (retrieve based on gene id, not uuid)
-                try:
-                    part = Part.objects.get(gene_id=partEntry['gene_id'])
-                except Part.DoesNotExist:
-                    counts['parts']+=1
-                    part = Part.objects.create(uuid=uuid.UUID(partEntry['uuid']),
-                                               description=partEntry['description'],
-                                               status=partEntry['status'],
-                                               original_sequence=partEntry['original_sequence'],
-                                               genbank=partEntry['genbank'],
-                                               synthesized_sequence=partEntry['synthesized_sequence'],
-                                               full_sequence=partEntry['full_sequence'],
-                                               vector=partEntry['vector'],
-                                               primer_forward=partEntry['primer_forward'],
-                                               primer_reverse=partEntry['primer_reverse'],
-                                               barcode=partEntry['barcode'],
-                                               translation=partEntry['translation'],
-                                               author=author)
-
-                # Tags are associated with a part
+                counts['parts']+=1
+                part = Part.objects.create(uuid=uuid.UUID(partEntry['uuid']),
+                                           gene_id=partEntry['gene_id'],
+                                           name=partEntry['name'],
+                                           part_type=partEntry['part_type'],
+                                           description=partEntry['description'],
+                                           status=partEntry['status'],
+                                           original_sequence=partEntry['original_sequence'],
+                                           optimized_sequence=partEntry['optimized_sequence'],
+                                           genbank=partEntry['genbank'],
+                                           synthesized_sequence=partEntry['synthesized_sequence'],
+                                           full_sequence=partEntry['full_sequence'],
+                                           vector=partEntry['vector'],
+                                           primer_forward=partEntry['primer_forward'],
+                                           primer_reverse=partEntry['primer_reverse'],
+                                           barcode=partEntry['barcode'],
+                                           translation=partEntry['translation'],
+                                           author=author)
+                parts[partEntry['gene_id']] = part
+
+            # Tags are associated with a part, only updated if the part changed
+            if part.digest != partDigest:
                 for tagEntry in partEntry['tags']:
                     name = tagEntry.get('tag')
                     if name is not None:
-                        tag, created = Tag.objects.get_or_create(tag=tagEntry)
+                        tag, created = Tag.objects.get_or_create(tag=Tag.normalize(name))
                         part.tags.add(tag)
                         if created:
                             counts['tags']+=1
 
+                part.digest = partDigest
                 part.save()
 
-                # Generate the sample (we don't also import derived from)
-                sample, created = generate_sample_entry(sampleEntry, part)
+            # Generate the sample
+            sample, created = generate_sample_entry(sampleEntry, part)
+            if created:
+                counts['samples'] +=1
+
+            # Add list of derived froms (the direct parent first, oldest ancestor last)
+            child = sample
+            for ancestorEntry in sampleEntry['derived_from']:
+                ancestor, created = generate_sample_entry(ancestorEntry, part) # use the same part
                 if created:
                     counts['samples'] +=1
-
-                # Add list of derive froms (oldest ancestor last)
-                derived_froms = sampleEntry['derived_from']
-                ancestors = []
-                while derived_froms:
-                    oldest = derived_froms.pop(-1) # use the same part
-                    olderSample, created = generate_sample_entry(oldest, part)
-                    if created:
-                        counts['samples'] +=1
-                    ancestors.append(olderSample)
-
-                oldest = ancestors.pop(-1)        
-                second = None
-                while len(ancestors) >= 1:
-                    second = ancestors.pop(-1)                    
-                    second.derived_from = oldest
-                    second = oldest
-
-                sample.derived_from = second
-
-                # Organism is associated with a well
-                try:
-                    organism = Organism.objects.get(uuid=organismEntry['uuid'])
-                except Organism.DoesNotExist:
-                    counts['organisms']+=1
-                    organism = Organism.objects.create(uuid=uuid.UUID(organismEntry['uuid']),
-                                                       name=organismEntry['name'],
-                                                       description=organismEntry['description'],
-                                                       genotype=organismEntry['genotype'])
-
-                # Finally, create the well
-                try:
-                    well = Well.objects.get(uuid=wellEntry['uuid'])
-                except Well.DoesNotExist:
-                    counts['wells']+=1
-                    well = Well.objects.create(uuid=uuid.UUID(wellEntry['uuid']),
-                                               address=wellEntry['address'], 
-                                               volume=wellEntry['volume'],
-                                               quantity=wellEntry['quantity'],
-                                               media=wellEntry['media'],
-                                               organism=organism)
-
-                sample.wells.add(well)
-                plate.wells.add(well)
-                plate.save()
-                sample.save()
-
-                # Finally, add the plate to the plateset and plateset to distribution
-                if plateset is not None:
-                    plateset.plates.add(plate)
-                    plateset.save()
-                
-                if dist is not None:
-                    dist.platesets.add(plateset)
-                    dist.save()
+                if child.derived_from_id != ancestor.uuid:
+                    child.derived_from = ancestor
+                    child.save()
+                child = ancestor
+
+            # Organism is associated with a well
+            try:
+                organism = Organism.objects.get(uuid=organismEntry['uuid'])
+            except Organism.DoesNotExist:
+                counts['organisms']+=1
+                organism = Organism.objects.create(uuid=uuid.UUID(organismEntry['uuid']),
+                                                   name=organismEntry['name'],
+                                                   description=organismEntry['description'],
+                                                   genotype=organismEntry['genotype'])
+
+            # Finally, create the well (or update it, for a changed plate)
+            try:
+                well = Well.objects.get(uuid=wellEntry['uuid'])
+                for field in ['address', 'volume', 'quantity', 'media']:
+                    setattr(well, field, wellEntry[field])
+                well.organism = organism
+                well.save()
+            except Well.DoesNotExist:
+                counts['wells']+=1
+                well = Well.objects.create(uuid=uuid.UUID(wellEntry['uuid']),
+                                           address=wellEntry['address'], 
+                                           volume=wellEntry['volume'],
+                                           quantity=wellEntry['quantity'],
+                                           media=wellEntry['media'],
+                                           organism=organism)
+
+            sample.wells.add(well)
+            plate.wells.add(well)
+
+        # Finally, add the plate to the plateset and plateset to distribution
+        if plateset is not None:
+            plateset.plates.add(plate)
+        
+        if dist is not None:
+            dist.platesets.add(plateset)
+
+        # The digest is saved last, so a plate that fails partway is imported again
+        plate.digest = digest
+        plate.save(update_fields=['digest'])
 
     return "Imported %s" % json.dumps(counts)
 
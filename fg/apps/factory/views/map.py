@@ -9,14 +9,11 @@ with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
 '''
 
 
+from django.http import JsonResponse
 from django.shortcuts import render 
 from ratelimit.decorators import ratelimit
 
-from fg.apps.main.models import (
-    Container,
-    Plate,
-    PlateSet
-)
+from fg.apps.main.models import Container
 
 from fg.settings import (
     VIEW_RATE_LIMIT as rl_rate, 
@@ -26,71 +23,72 @@ from fg.settings import (
 
 ## Map
 
+def get_map_node(tree, uuid):
+    '''return a node from the lab map tree with the number of children,
+       but without the children themselves.
+    '''
+    node = dict(tree['nodes'][uuid])
+    node['children_count'] = len(tree['children'].get(uuid, []))
+    return node
+
+
+def get_map_parents(tree):
+    '''return a lookup of child uuid to parent uuid for the lab map tree
+    '''
+    parents = {}
+    for parent, children in tree['children'].items():
+        for child in children:
+            parents[child] = parent
+    return parents
+
+
 @ratelimit(key='ip', rate=rl_rate, block=rl_block)
 def lab_map_view(request):
-    '''the lab map view shows a map of all containers and platesets,
-       which we can derive starting at the parent container. This will work
-       fine for smaller labs, if a lab has thousands of containers it will
-       start to run slowly and we will need a method that generates children
-       on demand from the view.
+    '''the lab map view shows a map of all containers and plates. We start
+       with the top level containers, and the children of any other node
+       are loaded on demand (see lab_map_children). If the user has selected
+       a container or plate, the containers above it are expanded.
     '''
     # Does the user want to jump to a container or plate?
     selection = request.GET.get('uuid')
 
-    # Return the parent container
-    nodes = {}
-    max_level = 1
-    for container in Container.objects.all():
-
-        node = {"name": container.name,
-                "url": container.get_absolute_url(),
-                "uuid": str(container.uuid)} # used to link directly to node
-
-        # Keep a record of the container parent uuid, if has one
-        if container.parent:
-            node['parent'] = str(container.parent.uuid)
-
-        # Get the level in the tree
-        level = 1
-        parent = container.parent
-        while parent:
-            level +=1
-            parent = parent.parent
-           
-        # Update the max nesting level
-        if level > max_level:
-            max_level = level
-
-        node['level'] = level
-
-        # If the container has plates, it's the last in a hierarchy
+    tree = Container.get_tree()
+    parents = get_map_parents(tree)
+
+    # Expand the path from the root down to the selection
+    expanded = set()
+    parent = parents.get(selection)
+    while parent and parent != "root" and parent not in expanded:
+        expanded.add(parent)
+        parent = parents.get(parent)
+
+    def get_children(uuid):
         children = []
-        if container.plate_set.count() > 0:
-            for plate in container.plate_set.all():
-                children.append({"name": plate.name, 
-                                 "uuid": str(plate.uuid),
-                                 "url": plate.get_absolute_url()})
-        node['children'] = children
-
-        nodes[str(container.uuid)] = node
-  
-    # Next, append children to their parents - start at most nested
-    for level in range(max_level, 0, -1): 
-        for uuid, node in nodes.items():
-            if node['level'] == level:
-                if "parent" in node:
-                    nodes[node['parent']]['children'].append(node)
-                    
-
-    # Remove all but level 1
-    keepers = []
-    for uuid, node in nodes.items():
-        if node['level'] == 1:
-            keepers.append(node)
+        for child in tree['children'].get(uuid, []):
+            node = get_map_node(tree, child)
+            if child in expanded:
+                node['children'] = get_children(child)
+            children.append(node)
+        return children
 
     context = {"data": {
                   "name": "root",
-                  "children": keepers},
+                  "children": get_children("root")},
                "selection": selection}
 
     return render(request, "maps/lab.html", context)
+
+
+@ratelimit(key='ip', rate=rl_rate, block=rl_block)
+def lab_map_children(request):
+    '''return the children (containers and plates) of a node in the lab map,
+       or the top level containers if no uuid is provided.
+    '''
+    uuid = request.GET.get('uuid') or "root"
+    tree = Container.get_tree()
+
+    if uuid != "root" and uuid not in tree['nodes']:
+        return JsonResponse({"message": "This container or plate does not exist."}, status=404)
+
+    children = [get_map_node(tree, child) for child in tree['children'].get(uuid, [])]
+    return JsonResponse({"uuid": uuid, "children": children})
@@ -23,11 +23,13 @@ from fg.apps.main.models import (
     Container, 
     Plate,
     Sample,
-    Well
+    Well,
+    WellContent
 )
 
 from fg.apps.factory.utils import read_csv
 from fg.apps.factory.twist import get_unique_plates
+from fg.apps.main.utils import generate_sha256
 from fg.apps.factory.forms import (
     UploadTwistPlatesForm,
     UploadTwistPartsForm
@@ -188,13 +190,8 @@ def import_parts_task(rows, factory_order):
         missing = abs(len(existing) - len(names))
         return "All parts are required for import: missing %s, import cancelled." % missing
 
-    for part_id in part_ids:
-
-        # We are already sure that it exists
-        name = part_lookup[part_id][headers.index("Name")]
-        part = Part.objects.get(gene_id=name)
-        factory_order.parts.add(part)
-
+    # We are already sure that they exist (adding existing parts is a no-op)
+    factory_order.parts.add(*Part.objects.filter(gene_id__in=part_ids))
     factory_order.save()
 
     return "Successfully added %s parts to %s" %(len(part_ids), factory_order.name)
@@ -202,6 +199,7 @@ def import_parts_task(rows, factory_order):
 
 # Tasks
 
+@WellContent.deferred()
 def import_plate_task(rows, fields, factory_order):
     '''Using the rows (plate map) import plates and wells (physicals) into 
        the Bionet Server. We always generate samples (a previously defined 
@@ -255,20 +253,28 @@ def import_plate_task(rows, fields, factory_order):
 
     # First create the plates - we need a lookup row for plate metadata
     plate_lookup = dict()
+    plate_rows = dict()
     for row in rows:
         plate_lookup[row[headers.index("Plate ID")]] = row
+        plate_rows.setdefault(row[headers.index("Plate ID")], []).append(row)
     
     plate_ids = list(plate_lookup.keys())
     plates = dict()
 
     # Get plate names in advance. We are required to have all parts
     names = set([row[headers.index("Name")] for row in rows])
-    existing = Part.objects.filter(gene_id__in=names).values_list('gene_id', flat=True)
+    existing = {part.gene_id: part for part in Part.objects.filter(gene_id__in=names)}
 
     # We are required to have all parts represented
     if len(existing) != len(names):
         return "All parts are required to exist for import, import cancelled."
 
+    # Plates already imported are looked up at once, and skipped if unchanged
+    existing_plates = {plate.plate_vendor_id: plate for plate in 
+                       Plate.objects.filter(plate_vendor_id__in=plate_ids)}
+    unchanged = 0
+    digests = dict()
+
     for plate_id in plate_ids:
 
         container_id = fields.get("plate_container_%s" % plate_id)  
@@ -277,6 +283,19 @@ def import_plate_task(rows, fields, factory_order):
         plate_height = fields.get("plate_height_%s" % plate_id)
         plate_form = fields.get("plate_form_%s" % plate_id)
         product_type = plate_lookup[plate_id][headers.index("Product type")]
+
+        # The digest is for the plate rows in the sheet
+        digest = generate_sha256(plate_rows[plate_id])
+        plate = existing_plates.get(plate_id)
+
+        # A changed plate is updated with wells not yet present
+        if plate is not None:
+            if plate.digest == digest:
+                unchanged += 1
+            else:
+                plates[plate.plate_vendor_id] = plate
+                digests[plate.plate_vendor_id] = digest
+            continue
  
         # Create the plate if both exist
         if not container_id:
@@ -285,51 +304,53 @@ def import_plate_task(rows, fields, factory_order):
 
         container = Container.objects.get(uuid=container_id)
 
-        # Try looking up the plate
-        try:
-            plate = Plate.objects.get(plate_vendor_id=plate_id)
-
-        # We want to create only if doesn't exist!
-        except Plate.DoesNotExist:
-            plate = None
-
-            # We can only create with a plate_name and container
-            if not plate_name:
-                print("Missing plate name, skipping plate %s." % plate_id)
-                continue
-
-            if product_type == "Clonal Genes":
-                plate = Plate.objects.create(name=plate_name,
-                                             container=container,
-                                             plate_vendor_id=plate_id,
-                                             plate_type="plasmid_plate",
-                                             plate_form=plate_form,
-                                             height=int(plate_height),
-                                             length=int(plate_length),
-                                             status="Stocked")
-
-            elif product_type == "Glycerol stock":
-                plate = Plate.objects.create(name=plate_name,
-                                             container=container,
-                                             plate_vendor_id=plate_id,
-                                             plate_type="glycerol_stock",
-                                             plate_form=plate_form,
-                                             height=int(plate_height),
-                                             length=int(plate_length),
-                                             status="Stocked")
-
-            # Save the object to lookup to add wells to
-            if plate:
-                plates[plate.plate_vendor_id] = plate
-                
-                # And if we have a factory order object
-                if factory_order:
-                    print("Adding %s to %s" %(plate, factory_order))
-                    factory_order.plates.add(plate)
-                    factory_order.save()
+        # We can only create with a plate_name and container
+        if not plate_name:
+            print("Missing plate name, skipping plate %s." % plate_id)
+            continue
 
-    # Sample lookup will hold samples for this order associated with parts
-    samples = dict()    
+        if product_type == "Clonal Genes":
+            plate = Plate.objects.create(name=plate_name,
+                                         container=container,
+                                         plate_vendor_id=plate_id,
+                                         plate_type="plasmid_plate",
+                                         plate_form=plate_form,
+                                         height=int(plate_height),
+                                         length=int(plate_length),
+                                         status="Stocked")
+
+        elif product_type == "Glycerol stock":
+            plate = Plate.objects.create(name=plate_name,
+                                         container=container,
+                                         plate_vendor_id=plate_id,
+                                         plate_type="glycerol_stock",
+                                         plate_form=plate_form,
+                                         height=int(plate_height),
+                                         length=int(plate_length),
+                                         status="Stocked")
+
+        # Save the object to lookup to add wells to
+        if plate:
+            plates[plate.plate_vendor_id] = plate
+            digests[plate.plate_vendor_id] = digest
+            
+            # And if we have a factory order object
+            if factory_order:
+                print("Adding %s to %s" %(plate, factory_order))
+                factory_order.plates.add(plate)
+                factory_order.save()
+
+    # Sample lookup holds samples for this order associated with parts
+    samples = dict()
+    if isinstance(factory_order, FactoryOrder):
+        for sample in Sample.objects.filter(wells__plate_wells__factoryorder_plates=factory_order,
+                                            part__in=existing.values()):
+            samples.setdefault(sample.part_id, sample)
+
+    # Wells already on the plates (for changed plates) are updated, not added again
+    addresses = {(plate_id, address): well_id for well_id, plate_id, address in
+                 Well.objects.filter(plate_wells__in=plates.values())
+                             .values_list('uuid', 'plate_wells', 'address')}
 
     # Now create the wells, add to their correct plate
     for row in rows:
@@ -343,6 +364,13 @@ def import_plate_task(rows, fields, factory_order):
             well_location = row[headers.index('Well Location')]
             plate = plates[plate_id]
 
+            if (plate.uuid, well_location) in addresses:
+                if product_type == "Clonal genes":
+                    well = Well.objects.get(uuid=addresses[(plate.uuid, well_location)])
+                    well.quantity = int(row[headers.index("Yield (ng)")])
+                    well.save()
+                continue
+
             well = None
             if product_type == "Glycerol stock":
                 well = Well.objects.create(address=well_location,
@@ -356,34 +384,29 @@ def import_plate_task(rows, fields, factory_order):
                                            quantity=quantity)
 
             if well:
-                well.save()
                 plate.wells.add(well)
-                plate.save()
+                addresses[(plate.uuid, well_location)] = well.uuid
 
                 # Look up the associated part
-                part = Part.objects.get(gene_id=name)
-
-                # Look for a Sample for a Part WITHIN a FactoryOrder
-                sample = None
-                for plate in factory_order.plates.all():
-
-                   # Look for a sample already associated with plate from the factory order      
-                    for plate_well in plate.wells.all():
-                        contenders = Sample.objects.filter(wells=plate_well).filter(part=part)
-                        if contenders.count() > 0:
-                            sample = contenders[0]
-                            break
+                part = existing[name]
 
-                # If we didn't find a sample already associated with the Factory order, create it
+                # Look for a Sample for a Part WITHIN a FactoryOrder, create if not found
+                sample = samples.get(part.uuid)
                 if not sample:
                     sample = Sample.objects.create(vendor=factory_order.vendor.name,
                                                    part=part, evidence='Twist_Confirmed',
                                                    status='Confirmed')
+                    samples[part.uuid] = sample
   
-                sample.save()
                 sample.wells.add(well)
-                sample.save()
 
+    # Digests are saved once the wells are added, so a plate that fails is imported again
+    for plate_id, plate in plates.items():
+        plate.digest = digests[plate_id]
+        plate.save(update_fields=['digest'])
+
+    if unchanged:
+        print("Skipped %s unchanged plates" % unchanged)
 
     # Confirm number of wells per plate
     for plate_id, plate in plates.items():
@@ -9,6 +9,7 @@ with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
 '''
 
 from django.contrib import admin
+from django.contrib.admin.views.main import ChangeList
 from fg.apps.main.models import (
     Author,
     Container,
@@ -35,7 +36,9 @@ class AuthorAdmin(admin.ModelAdmin):
     
 class ContainerAdmin(admin.ModelAdmin):
     list_display = ('name', 'parent', 'container_type', 'description', 
-                    'estimated_temperature',)
+                    'estimated_temperature', 'depth',)
+    list_select_related = ('parent',)
+    readonly_fields = ('path', 'depth',)
 
 class CollectionAdmin(admin.ModelAdmin):
     list_display = ('name', 'parent', 'time_updated', 'time_created',)
@@ -64,8 +67,22 @@ class PartAdmin(admin.ModelAdmin):
 class PlanAdmin(admin.ModelAdmin):
     list_display = ('name', 'status', 'description', 'parent', 'time_updated', 'time_created', )
 
+class PlateChangeList(ChangeList):
+    '''look up the breadcrumbs for a page of plates in one query
+    '''
+    def get_results(self, request):
+        super().get_results(request)
+        Container.set_breadcrumbs(set(plate.container for plate in self.result_list))
+
 class PlateAdmin(admin.ModelAdmin):
     list_display = ('name', 'status', 'breadcrumb', 'plate_type', 'plate_form', 'thaw_count', 'height', 'length')
+    list_select_related = ('container',)
+
+    def get_changelist(self, request, **kwargs):
+        return PlateChangeList
+
+    def breadcrumb(self, plate):
+        return " > ".join([container.name for container in plate.breadcrumb])
 
 class PlateSetAdmin(admin.ModelAdmin):
     list_display = ('name', 'description', 'time_updated', 'time_created', )
@@ -0,0 +1,219 @@
+'''
+
+Copyright (C) 2019 Vanessa Sochat.
+
+This Source Code Form is subject to the terms of the
+Mozilla Public License, v. 2.0. If a copy of the MPL was not distributed
+with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+Bulk helpers are shared by importers that need to write thousands of rows.
+They skip save() and signals, so callers are responsible for anything
+a save() would normally do (e.g., tag normalization). The versions of the
+models written are bumped here (see fg.apps.main.versions).
+
+'''
+
+from django.db import (
+    connection,
+    transaction,
+    IntegrityError,
+    models
+)
+from fg.apps.main.versions import bump_versions
+
+from io import StringIO
+import datetime
+import json
+
+# Default number of objects per INSERT statement
+BATCH_SIZE = 1000
+
+
+def get_uuid_lookup(Model, uuids=None):
+    '''return a set of (string) uuids that already exist for a model. If a list
+       of uuids is provided, we limit the lookup to those.
+
+       Parameters
+       ==========
+       Model: the model class to look up
+       uuids: an optional list of uuids to filter to
+    '''
+    queryset = Model.objects.all()
+    if uuids is not None:
+        queryset = queryset.filter(uuid__in=list(uuids))
+    return set(str(x) for x in queryset.values_list('uuid', flat=True))
+
+
+def _existing_pks(Model, pks, batch_size=BATCH_SIZE):
+    '''return the set of primary keys (of those given) that exist for a model
+    '''
+    pks = list(pks)
+    existing = set()
+    for start in range(0, len(pks), batch_size):
+        existing.update(Model.objects.filter(pk__in=pks[start:start + batch_size])
+                                     .values_list('pk', flat=True))
+    return existing
+
+
+def _auto_date_fields(Model):
+    '''return the attnames of date fields that are set automatically on save
+    '''
+    return [field.attname for field in Model._meta.concrete_fields
+            if isinstance(field, models.DateField) and
+            (field.auto_now or field.auto_now_add)]
+
+
+def _copy_value(value):
+    '''format a single value for the postgres COPY text format
+    '''
+    if value is None:
+        return '\\N'
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+
+    # JSONField values are wrapped in an adapter for psycopg2
+    if hasattr(value, 'adapted'):
+        value = value.adapted
+    if isinstance(value, (dict, list)):
+        value = json.dumps(value)
+    elif isinstance(value, (datetime.datetime, datetime.date)):
+        value = value.isoformat()
+
+    value = str(value)
+    for character, escaped in [('\\', '\\\\'), ('\t', '\\t'), ('\n', '\\n'), ('\r', '\\r')]:
+        value = value.replace(character, escaped)
+    return value
+
+
+def copy_insert(Model, instances):
+    '''insert instances using postgres COPY. Dates that are provided are kept,
+       and those that are not are set as a save() would. The instances must
+       not exist yet, otherwise an IntegrityError is raised.
+    '''
+    fields = Model._meta.concrete_fields
+    auto_dates = _auto_date_fields(Model)
+
+    buffer = StringIO()
+    for instance in instances:
+        row = []
+        for field in fields:
+            if field.attname in auto_dates and getattr(instance, field.attname) is not None:
+                value = getattr(instance, field.attname)
+            else:
+                value = field.pre_save(instance, True)
+            row.append(_copy_value(field.get_db_prep_save(value, connection)))
+        buffer.write('\t'.join(row) + '\n')
+    buffer.seek(0)
+
+    columns = ", ".join(connection.ops.quote_name(field.column) for field in fields)
+    sql = "COPY %s (%s) FROM STDIN" % (connection.ops.quote_name(Model._meta.db_table), columns)
+    # copy_expert is on the driver cursor, so errors are wrapped (e.g., as
+    # django.db.IntegrityError) here
+    with connection.cursor() as cursor, connection.wrap_database_errors:
+        cursor.copy_expert(sql, buffer)
+
+
+def bulk_insert(Model, instances, use_copy=True, batch_size=BATCH_SIZE, ignore_conflicts=True):
+    '''insert a list of new (unsaved) instances for a model. With postgres we
+       use COPY, and otherwise (or if COPY hits a conflict) we fall back to
+       bulk_create, ignoring rows that already exist. Provided created and
+       updated dates are preserved in both cases (for rows that are inserted).
+       Returns the number of rows inserted.
+
+       Parameters
+       ==========
+       Model: the model class for the instances
+       instances: a list of model instances (not saved)
+       use_copy: use postgres COPY, if available (default True)
+       batch_size: the number of rows per INSERT for bulk_create
+       ignore_conflicts: if False, a conflict raises IntegrityError instead
+                         of skipping the rows (e.g., for the API)
+    '''
+    if not instances:
+        return 0
+
+    bump_versions([Model])
+    if use_copy and connection.vendor == 'postgresql':
+        try:
+            with transaction.atomic():
+                copy_insert(Model, instances)
+            return len(instances)
+        except IntegrityError:
+            if not ignore_conflicts:
+                raise
+
+    # bulk_create sets auto dates on the instances, so we keep them to restore
+    auto_dates = _auto_date_fields(Model)
+    provided = {}
+    for instance in instances:
+        dates = {name: getattr(instance, name) for name in auto_dates
+                 if getattr(instance, name) is not None}
+        if dates:
+            provided[instance] = dates
+
+    # conflicting rows are skipped without an error, so the rows inserted are
+    # those with a primary key that is new, and that exists after the insert
+    to_python = Model._meta.pk.to_python
+    pks = set(to_python(instance.pk) for instance in instances)
+    if ignore_conflicts:
+        pks = pks.difference(_existing_pks(Model, pks, batch_size))
+
+    Model.objects.bulk_create(instances, batch_size=batch_size, ignore_conflicts=ignore_conflicts)
+
+    if ignore_conflicts:
+        pks = _existing_pks(Model, pks, batch_size)
+
+    provided = {instance: dates for instance, dates in provided.items()
+                if to_python(instance.pk) in pks}
+    if provided:
+        for instance, dates in provided.items():
+            for name, value in dates.items():
+                setattr(instance, name, value)
+        Model.objects.bulk_update(list(provided.keys()), auto_dates, batch_size=batch_size)
+
+    return len(pks)
+
+
+def bulk_link(relation, pairs, batch_size=BATCH_SIZE):
+    '''add many to many links directly to the through table, ignoring links
+       that already exist. The relation is the many to many attribute on the
+       model class (e.g., Plate.wells) and pairs is a list of (source pk,
+       target pk) tuples. Note that m2m_changed is not sent.
+
+       Parameters
+       ==========
+       relation: the many to many descriptor on the model class
+       pairs: a list of tuples, (source primary key, target primary key)
+       batch_size: the number of rows per INSERT
+    '''
+    through = relation.through
+    source = "%s_id" % relation.field.m2m_field_name()
+    target = "%s_id" % relation.field.m2m_reverse_field_name()
+    links = [through(**{source: s, target: t}) for s, t in set(pairs)]
+    through.objects.bulk_create(links, batch_size=batch_size, ignore_conflicts=True)
+    if links:
+        bump_versions([relation.field.model, relation.field.related_model])
+    return len(links)
+
+
+def bulk_tags(names):
+    '''given a list of tag names, create the missing tags and return a lookup
+       of the original name to the tag uuid. Names are normalized as they
+       would be with Tag.save.
+    '''
+    from fg.apps.main.models import Tag
+
+    normalized = {name: Tag.normalize(name) for name in set(names)}
+    existing = dict(Tag.objects.filter(tag__in=set(normalized.values()))
+                               .values_list('tag', 'uuid'))
+
+    missing = set(normalized.values()).difference(existing)
+    if missing:
+        bump_versions([Tag])
+    Tag.objects.bulk_create([Tag(tag=tag) for tag in missing],
+                            batch_size=BATCH_SIZE, ignore_conflicts=True)
+
+    if missing:
+        existing.update(Tag.objects.filter(tag__in=missing).values_list('tag', 'uuid'))
+
+    return {name: existing[tag] for name, tag in normalized.items() if tag in existing}
@@ -0,0 +1,338 @@
+'''
+
+Copyright (C) 2019 Vanessa Sochat.
+
+This Source Code Form is subject to the terms of the
+Mozilla Public License, v. 2.0. If a copy of the MPL was not distributed
+with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+'''
+
+from django.apps import apps
+from django.contrib.auth.models import AnonymousUser
+from django.core.management.base import (
+    BaseCommand,
+    CommandError
+)
+from django.db import (
+    connection,
+    transaction
+)
+from django.test import RequestFactory
+from fg.apps.base.views.search import parts_query
+from fg.apps.factory.management.commands.benchmark_imports import generate_plates_json
+from fg.apps.factory.views.factory import import_plates_task
+from fg.apps.main.models import (
+    Container,
+    Distribution,
+    Part,
+    Plate,
+    Sample
+)
+from fg.apps.main.utils import (
+    capture_queries,
+    load_json,
+    save_json
+)
+from fg.apps.main.views.catalog import catalog_pagination
+from fg.apps.main.views.download import generate_plate_csv
+
+from contextlib import redirect_stdout
+from io import StringIO
+import json
+import re
+import uuid
+
+# Plan nodes that use an index
+INDEX_NODES = ['Index Scan', 'Index Only Scan', 'Bitmap Index Scan']
+
+# Columns compared in a filter, e.g., (plate_id = '...'::uuid)
+FILTER_COLUMN = re.compile(r'\(?"?(\w+)"?(?:\)::\w+)? (=|<>|<|>|<=|>=|IS|~~|= ANY)\s')
+
+
+def get_query_shape(sql):
+    '''return a query with literals removed, so that the same query run
+       for different rows (e.g., a query per plate) is only explained once.
+    '''
+    sql = re.sub(r"'(?:[^']|'')*'", "?", sql)
+    return re.sub(r'\b\d+\b', "?", sql)
+
+
+def get_nodes(plan):
+    '''yield each node in an explain (json) plan, depth first
+    '''
+    yield plan
+    for child in plan.get('Plans', []):
+        for node in get_nodes(child):
+            yield node
+
+
+def get_filter_columns(node):
+    '''return the columns (in order) used in the filter for a scan node,
+       with equality comparisons first (as they would be in an index).
+    '''
+    equal, other = [], []
+    for column, operator in FILTER_COLUMN.findall(node.get('Filter', '')):
+        columns = equal if operator in ['=', '= ANY', 'IS'] else other
+        if column not in equal + other:
+            columns.append(column)
+    return equal + other
+
+
+def get_sort_columns(node):
+    '''return the columns a sort node sorts by, e.g., main_part.time_updated DESC
+    '''
+    columns = []
+    for key in node.get('Sort Key', []):
+        column = key.split(' ')[0].split('.')[-1].strip('"()')
+        columns.append("-%s" % column if key.endswith('DESC') else column)
+    return columns
+
+
+class Command(BaseCommand):
+    '''Explain the queries behind the hot paths (part search, catalog
+       pagination, plate csv export, part availability, and distribution
+       gene ids) against a seeded local database. Each path is run and the
+       queries it makes are captured, and each unique query is explained
+       with EXPLAIN (ANALYZE, BUFFERS). Seeding is done in a transaction
+       that is rolled back, so the database is not changed.
+
+       usage: python manage.py explain_queries --seed 960
+              python manage.py explain_queries --output plans.json
+              python manage.py explain_queries --baseline plans.json
+              python manage.py explain_queries --verbose
+
+       We report the indexes used and the tables read with a sequential
+       scan, and propose (composite) indexes for sequential scans with a
+       filter or sort that isn't covered by an existing index. With a
+       baseline, the command exits with an error if a query that used an
+       index now reads a table with a sequential scan.
+    '''
+    help = "Explain the queries for search, catalog, export, and availability"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', dest='seed', type=int, default=960,
+                            help="number of synthetic wells to add (0 to use existing data)")
+        parser.add_argument('--output', dest='output', type=str, default=None,
+                            help="save results to a json file (e.g., a baseline)")
+        parser.add_argument('--baseline', dest='baseline', type=str, default=None,
+                            help="compare results to a previous output json file")
+        parser.add_argument('--verbose', dest='verbose', action='store_true',
+                            default=False, help="print the text plan for each query")
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError("Explaining queries requires postgres.")
+
+        with transaction.atomic():
+            if options['seed'] > 0:
+                self.seed(options['seed'])
+
+            # Update planner statistics so plans reflect the seeded data
+            with connection.cursor() as cursor:
+                cursor.execute("ANALYZE")
+
+            results = {}
+            for name, func in self.get_paths():
+                results[name] = self.explain_path(func, verbose=options['verbose'])
+            transaction.set_rollback(True)
+
+        self.print_results(results)
+
+        if options['output']:
+            save_json(results, options['output'])
+            print("Results saved to %s" % options['output'])
+
+        if options['baseline']:
+            self.compare(results, load_json(options['baseline']))
+
+    def seed(self, size):
+        '''add synthetic plates (in a plateset and distribution) with a part
+           and sample in each of size wells.
+        '''
+        container = Container.objects.create(name="explain-%s" % size,
+                                             container_type="lab",
+                                             description="Explain container")
+        plates = generate_plates_json(size)
+        plateset = {'uuid': str(uuid.uuid4()), 'name': 'explain', 'description': 'explain'}
+        distribution = {'uuid': str(uuid.uuid4()), 'name': 'explain', 'description': 'explain'}
+        for plate in plates:
+            plate.update({'plateset': plateset, 'distribution': distribution})
+
+        with redirect_stdout(StringIO()):
+            result = import_plates_task(plates, container)
+        if result.startswith("Invalid"):
+            raise CommandError(result)
+
+    def get_paths(self):
+        '''return a list of (name, function) for each hot path, where the
+           function makes the same queries that the path does.
+        '''
+        request = RequestFactory().get('/')
+        request.user = AnonymousUser()
+
+        distribution = Distribution.objects.order_by('-time_created').first()
+        plate = Plate.objects.order_by('-time_created').first()
+        gene_ids = list(Part.objects.order_by('-time_created').values_list('gene_id', flat=True)[:10])
+
+        paths = [("parts_query", lambda: list(parts_query(gene_ids[0] if gene_ids else "all"))),
+                 ("parts_query:available", lambda: list(parts_query("all", available=True))),
+                 ("catalog_pagination:parts", lambda: catalog_pagination(
+                     request, Part.objects.all().order_by('-time_updated'), "parts")),
+                 ("catalog_pagination:samples", lambda: catalog_pagination(
+                     request, Sample.objects.all().order_by('-time_updated'), "samples")),
+                 ("catalog_pagination:plates", lambda: catalog_pagination(
+                     request, Plate.objects.all().order_by('-time_updated'), "plates")),
+                 ("Part.available", lambda: [part.available() for part in
+                                             Part.objects.filter(gene_id__in=gene_ids)])]
+
+        if plate is not None:
+            paths.append(("generate_plate_csv", lambda: generate_plate_csv([plate], "explain.csv")))
+        if distribution is not None:
+            paths.append(("Distribution.gene_ids", lambda: distribution.gene_ids()))
+        return paths
+
+    def explain_path(self, func, verbose=False):
+        '''run a path, capture its queries, and explain each unique query.
+        '''
+        with capture_queries() as captured:
+            func()
+
+        queries = {}
+        for query in captured:
+            if query['many']:
+                continue
+            sql = self.get_sql(query['sql'], query['params'])
+            if not sql.lstrip().upper().startswith(("SELECT", "WITH")):
+                continue
+            shape = get_query_shape(sql)
+            if shape in queries:
+                queries[shape]['calls'] += 1
+                continue
+            queries[shape] = self.explain(sql, verbose=verbose)
+        return list(queries.values())
+
+    def get_sql(self, sql, params):
+        '''return a captured query with its parameters, as it was run
+        '''
+        if params is None:
+            return sql
+        with connection.cursor() as cursor:
+            return cursor.mogrify(sql, params).decode()
+
+    def explain(self, sql, verbose=False):
+        '''explain (and analyze) a single query, and return the time, buffers,
+           indexes used, tables with sequential scans, and proposed indexes.
+        '''
+        with connection.cursor() as cursor:
+            cursor.execute("EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) %s" % sql)
+            explained = cursor.fetchone()[0]
+            if isinstance(explained, str):
+                explained = json.loads(explained)
+            explained = explained[0]
+
+            if verbose:
+                cursor.execute("EXPLAIN (ANALYZE, BUFFERS) %s" % sql)
+                print("%s\n%s\n" % (sql, "\n".join(row[0] for row in cursor.fetchall())))
+
+        plan = explained['Plan']
+        nodes = list(get_nodes(plan))
+        return {"sql": sql[:500],
+                "calls": 1,
+                "milliseconds": explained.get('Execution Time'),
+                "shared_hit": plan.get('Shared Hit Blocks', 0),
+                "shared_read": plan.get('Shared Read Blocks', 0),
+                "indexes": sorted(set(node['Index Name'] for node in nodes
+                                      if node['Node Type'] in INDEX_NODES)),
+                "seq_scans": sorted(set(node['Relation Name'] for node in nodes
+                                        if node['Node Type'] == 'Seq Scan')),
+                "proposed": self.propose_indexes(nodes)}
+
+    def propose_indexes(self, nodes):
+        '''propose an index for each sequential scan with a filter, or a sort
+           on the same table, that an existing index doesn't already cover.
+           We return a list of strings that can be added to a model Meta.
+        '''
+        proposed = []
+        for index, node in enumerate(nodes):
+            if node['Node Type'] != 'Seq Scan':
+                continue
+
+            table = node['Relation Name']
+            columns = get_filter_columns(node)
+
+            # A sort directly above the scan (e.g., for catalog ordering)
+            for parent in nodes[:index]:
+                if parent['Node Type'] in ['Sort', 'Incremental Sort'] and node in parent.get('Plans', []):
+                    columns += [column for column in get_sort_columns(parent)
+                                if column.strip('-') not in columns]
+
+            if not columns or self.is_indexed(table, [column.strip('-') for column in columns]):
+                continue
+
+            Model = self.get_model(table)
+            if Model is None:
+                continue
+
+            lookup = {field.column: field.name for field in Model._meta.concrete_fields}
+            fields = []
+            for column in columns:
+                name = lookup.get(column.strip('-'))
+                if name is None:
+                    break
+                fields.append("-%s" % name if column.startswith('-') else name)
+
+            if fields:
+                proposed.append("%s: models.Index(fields=%s)" % (Model.__name__, fields))
+        return proposed
+
+    def is_indexed(self, table, columns):
+        '''determine if an existing index on a table starts with the columns
+        '''
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(cursor, table)
+        for constraint in constraints.values():
+            indexed = constraint['index'] or constraint['primary_key'] or constraint['unique']
+            if indexed and constraint['columns'][:len(columns)] == columns:
+                return True
+        return False
+
+    def get_model(self, table):
+        for Model in apps.get_models(include_auto_created=True):
+            if Model._meta.db_table == table:
+                return Model
+
+    def print_results(self, results):
+        for name, queries in results.items():
+            print("\n%s (%s unique queries)" %(name, len(queries)))
+            for query in queries:
+                print("  %-10s %-8s %-10s %s" %("%sms" % query['milliseconds'],
+                                                "x%s" % query['calls'],
+                                                "%s/%s" %(query['shared_hit'], query['shared_read']),
+                                                query['sql'][:80].replace('\n', ' ')))
+                if query['indexes']:
+                    print("    indexes: %s" % ", ".join(query['indexes']))
+                if query['seq_scans']:
+                    print("    sequential scans: %s" % ", ".join(query['seq_scans']))
+                for proposed in query['proposed']:
+                    print("    proposed: %s" % proposed)
+
+    def compare(self, results, baseline):
+        '''compare results to a baseline, and exit with an error if a query
+           that used an index now has a sequential scan on a table.
+        '''
+        regressions = []
+        for name, queries in results.items():
+            previous = {get_query_shape(query['sql']): query for query in baseline.get(name, [])}
+            for query in queries:
+                before = previous.get(get_query_shape(query['sql']))
+                if before is None or not before['indexes']:
+                    continue
+                scans = set(query['seq_scans']).difference(before['seq_scans'])
+                if scans:
+                    regressions.append("%s sequential scan on %s (baseline used %s)" %(
+                                       name, ", ".join(sorted(scans)), ", ".join(before['indexes'])))
+
+        if regressions:
+            raise CommandError("Query plan regressions found:\n%s" % "\n".join(regressions))
+        print("No query plan regressions found compared to baseline.")
@@ -0,0 +1,31 @@
+'''
+
+Copyright (C) 2019 Vanessa Sochat.
+
+This Source Code Form is subject to the terms of the
+Mozilla Public License, v. 2.0. If a copy of the MPL was not distributed
+with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+'''
+
+from django.core.management.base import BaseCommand
+from fg.apps.main.models import Container
+
+
+class Command(BaseCommand):
+    '''Rebuild the path and depth for all containers. These are kept current
+       on save, so this is only needed to populate them for existing data,
+       or after containers are created without save (e.g., bulk inserts).
+    '''
+    help = "Rebuild container paths and depths"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--missing', dest='missing', action='store_true', default=False,
+                            help="Only rebuild if a container has no path (e.g., on start)")
+
+    def handle(self, *args, **options):
+        if options['missing'] and not Container.objects.filter(path="").exists():
+            print("Container paths are current")
+            return
+        count = Container.rebuild_paths()
+        print("Updated paths for %s containers" % count)
@@ -0,0 +1,32 @@
+'''
+
+Copyright (C) 2019 Vanessa Sochat.
+
+This Source Code Form is subject to the terms of the
+Mozilla Public License, v. 2.0. If a copy of the MPL was not distributed
+with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+'''
+
+from django.core.management.base import BaseCommand
+from fg.apps.main.models import Sample
+
+
+class Command(BaseCommand):
+    '''Rebuild the lineage depth and root for all samples. These are kept
+       current on save, so this is only needed to populate them for existing
+       data, or after samples are created without save (e.g., bulk inserts).
+    '''
+    help = "Rebuild sample lineage depths and roots"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--missing', dest='missing', action='store_true', default=False,
+                            help="Only rebuild if a derived sample has no lineage (e.g., on start)")
+
+    def handle(self, *args, **options):
+        if options['missing'] and not Sample.objects.filter(derived_from__isnull=False,
+                                                            lineage_depth=0).exists():
+            print("Sample lineage is current")
+            return
+        count = Sample.rebuild_lineage()
+        print("Updated lineage for %s samples" % count)
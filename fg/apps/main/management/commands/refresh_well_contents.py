@@ -0,0 +1,36 @@
+'''
+
+Copyright (C) 2019 Vanessa Sochat.
+
+This Source Code Form is subject to the terms of the
+Mozilla Public License, v. 2.0. If a copy of the MPL was not distributed
+with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+'''
+
+from django.core.management.base import BaseCommand
+from fg.apps.main.models import (
+    Plate,
+    WellContent
+)
+
+
+class Command(BaseCommand):
+    '''Rebuild the well contents (plate, address, sample, part) for all plates.
+       Contents are kept current by signals, so this is only needed to
+       populate the table for existing data, or after changes made without
+       signals (e.g., directly in the database).
+    '''
+    help = "Rebuild well contents for all plates"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--missing', dest='missing', action='store_true', default=False,
+                            help="Only refresh plates with wells but no contents (e.g., on start)")
+
+    def handle(self, *args, **options):
+        plates = Plate.objects.all()
+        if options['missing']:
+            plates = plates.filter(wells__isnull=False, contents__isnull=True).distinct()
+        plates = list(plates.values_list('uuid', flat=True))
+        count = WellContent.refresh(plates)
+        print("Refreshed %s wells for %s plates" %(count, len(plates)))
@@ -14,8 +14,18 @@ with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
 '''
 
 from django.conf import settings
+from django.core.cache import cache
 from django.core.exceptions import ValidationError
-from django.db import models
+from django.db import (
+    connection,
+    models,
+    transaction
+)
+from django.db.models.functions import (
+    Coalesce,
+    Concat,
+    Substr
+)
 from django.dispatch import receiver
 from django.urls import reverse
 from django.contrib.contenttypes.fields import GenericForeignKey
@@ -24,21 +34,43 @@ from django.contrib.postgres.fields import JSONField
 from taggit.managers import TaggableManager
 from fg.settings import (
     DEFAULT_PLATE_HEIGHT,
-    DEFAULT_PLATE_LENGTH
+    DEFAULT_PLATE_LENGTH,
+    COLLECTION_ROLLUPS_CACHE_TIMEOUT,
+    LAB_MAP_CACHE_TIMEOUT,
+    PLATE_MAP_CACHE_TIMEOUT,
+    TAG_STATISTICS_CACHE_TIMEOUT
 )
 from sortedm2m.fields import SortedManyToManyField
-from .queries import get_part_available_query
+from .queries import (
+    SAMPLE_DESCENDANTS,
+    get_collection_rollup_query,
+    get_collection_subtree_query,
+    get_plan_subtree_query,
+    get_sample_ancestors_query,
+    get_sample_descendants_query,
+    get_sample_lineage_update_query
+)
 from .schemas import MODULE_SCHEMAS
+from fg.apps.main.versions import (
+    bump_instance_versions,
+    bump_versions,
+    get_instance_version
+)
 from .validators import (
     validate_direction_string,
     validate_dna_string,
     validate_name, 
-    validate_json_schema
+    get_json_errors,
+    get_json_validator
 )
+from jsonschema.exceptions import SchemaError
 
+from contextlib import contextmanager
+from functools import lru_cache
 from itertools import chain
 import os
 import string
+import threading
 import uuid
 import re
 import time
@@ -48,6 +80,10 @@ import time
 # Tags #########################################################################
 ################################################################################
 
+# The cache key for tag usage counts (see Tag.get_statistics)
+TAG_STATISTICS_CACHE_KEY = "tag-statistics"
+
+
 class Tag(models.Model):
     '''tags are ways to organize the different categories they are associated with. 
        As an example, we may tag a plasmid part as conferring ampicillin 
@@ -63,23 +99,77 @@ class Tag(models.Model):
     def __repr__(self):
         return self.__str__()
 
+    @classmethod
+    def get_statistics(cls):
+        '''return a lookup of tag uuid to the number of authors, organisms,
+           collections and parts with the tag, and the total. The counts are
+           annotated from the tag tables in one query for all tags, and
+           cached until tags are added or removed (see clear_statistics).
+        '''
+        statistics = cache.get(TAG_STATISTICS_CACHE_KEY)
+        if statistics is not None:
+            return statistics
+
+        counts = {}
+        for name, Model in TAG_STATISTICS_MODELS.items():
+            through = Model.tags.through.objects.filter(tag_id=models.OuterRef('pk'))
+            count = through.order_by().values('tag_id').annotate(count=models.Count('*')).values('count')
+            counts[name] = Coalesce(models.Subquery(count, output_field=models.IntegerField()), 0)
+
+        statistics = {}
+        for values in cls.objects.annotate(**counts).values('uuid', *counts.keys()):
+            pk = str(values.pop('uuid'))
+            values['total'] = sum(values.values())
+            statistics[pk] = values
+
+        cache.set(TAG_STATISTICS_CACHE_KEY, statistics, TAG_STATISTICS_CACHE_TIMEOUT)
+        return statistics
+
+    @classmethod
+    def clear_statistics(cls):
+        '''clear the cached statistics, done when tags are added or removed
+        '''
+        cache.delete(TAG_STATISTICS_CACHE_KEY)
+
+    @classmethod
+    def set_statistics(cls, tags):
+        '''set the statistics for a list of tags, so a template can show
+           them without a lookup for each.
+        '''
+        statistics = cls.get_statistics()
+        for tag in tags:
+            tag._statistics = statistics.get(str(tag.uuid))
+
+    @property
+    def statistics(self):
+        '''the number of authors, organisms, collections and parts with the
+           tag, and the total (see get_statistics).
+        '''
+        if not hasattr(self, '_statistics'):
+            self._statistics = Tag.get_statistics().get(str(self.uuid))
+        return self._statistics or dict({name: 0 for name in TAG_STATISTICS_MODELS}, total=0)
+
     @property
     def total_count(self):
         '''Return a total count of all associated entities.
         '''
-        return (self.author_tags.count() +
-                self.organism_tags.count() +
-                self.collection_tags.count() +
-                self.part_tags.count())
+        return self.statistics['total']
 
-    def save(self, *args, **kwargs):
+    @staticmethod
+    def normalize(tag):
         '''tags are enforced as all lowercase to avoid duplication, along
            with removing all special characters except for dashes and :.
-           Dashes and : are allowed. 
+           Dashes and : are allowed.
         '''
-        if self.pk is None:
-            self.tag = self.tag.replace(' ', '-') # replace space with -
-            self.tag = re.sub('[^A-Za-z0-9:-]+', '', self.tag).lower()
+        tag = tag.replace(' ', '-') # replace space with -
+        return re.sub('[^A-Za-z0-9:-]+', '', tag).lower()
+
+    def save(self, *args, **kwargs):
+        '''normalize the tag (see normalize) before the first save. The
+           uuid primary key is set on init, so we check the instance state.
+        '''
+        if self._state.adding:
+            self.tag = Tag.normalize(self.tag)
         return super(Tag, self).save(*args, **kwargs)
 
     def get_absolute_url(self):
@@ -299,17 +389,17 @@ class Part(models.Model):
     # Authors cannot be deleted if there is a part
     author = models.ForeignKey('Author', on_delete=models.PROTECT, blank=False)
 
+    # Content digest of the last imported entry, to skip unchanged re-imports
+    digest = models.CharField(max_length=250, blank=True, null=True, db_index=True, editable=False)
+
 
     def available(self):
         '''returns True if a part is available via a distribution, False
            otherwise. Useful to run before part.get_distribution.
         '''
-        # if there is a result, the part is available
-        query = get_part_available_query(self.gene_id)
-        for p in Part.objects.raw(query):
-            if p is not None:
-                return True
-        return False
+        # if the part is in a plate of a distribution, the part is available
+        return WellContent.objects.filter(part=self, 
+                                          plate__plateset_plates__distribution_plateset__isnull=False).exists()
 
 
     def get_distribution(self):
@@ -317,9 +407,7 @@ class Part(models.Model):
            we assume each part only belongs to one distribution, and return
            the first.
         '''
-        for distribution in Distribution.objects.all():
-            if self.gene_id in distribution.gene_ids():
-                return distribution
+        return Distribution.objects.filter(platesets__plates__contents__part=self).first()
 
     def get_absolute_url(self):
         return reverse('part_details', args=[self.uuid])
@@ -329,6 +417,10 @@ class Part(models.Model):
 
     class Meta:
         app_label = 'main'
+        # catalogs and api pages are ordered by most recently updated
+        indexes = [
+            models.Index(fields=['-time_updated', '-uuid'])
+        ]
 
 
 ################################################################################
@@ -336,6 +428,10 @@ class Part(models.Model):
 ################################################################################
 
 
+# The cache key for collection rollups (see Collection.get_rollups)
+COLLECTION_ROLLUPS_CACHE_KEY = "collection-rollups"
+
+
 class Collection(models.Model):
     '''A collection object represents a collection of parts. A collection
        may contain several subcollections containing more parts. For example,
@@ -358,6 +454,66 @@ class Collection(models.Model):
                                    related_name="collection_tags",
                                    related_query_name="collection_tags")
 
+    @classmethod
+    def get_rollups(cls):
+        '''return a lookup of collection uuid to the number of subcollections,
+           direct parts, and parts (including all subcollections). This is
+           one (recursive) query for all collections, and is cached until a
+           collection or its parts change (see clear_rollups).
+        '''
+        rollups = cache.get(COLLECTION_ROLLUPS_CACHE_KEY)
+        if rollups is not None:
+            return rollups
+
+        rollups = {}
+        with connection.cursor() as cursor:
+            cursor.execute(get_collection_rollup_query())
+            for pk, subcollections, direct_parts, parts in cursor.fetchall():
+                rollups[str(pk)] = {"subcollections": subcollections,
+                                    "direct_parts": direct_parts,
+                                    "parts": parts}
+
+        cache.set(COLLECTION_ROLLUPS_CACHE_KEY, rollups, COLLECTION_ROLLUPS_CACHE_TIMEOUT)
+        return rollups
+
+    @classmethod
+    def clear_rollups(cls):
+        '''clear the cached rollups, done when collections or their parts change
+        '''
+        cache.delete(COLLECTION_ROLLUPS_CACHE_KEY)
+
+    @classmethod
+    def set_rollups(cls, collections):
+        '''set the rollup for a list of collections, so a template can show
+           them without a lookup for each.
+        '''
+        rollups = cls.get_rollups()
+        for collection in collections:
+            collection._rollup = rollups.get(str(collection.uuid))
+
+    @property
+    def rollup(self):
+        '''the number of subcollections, direct parts, and parts (including
+           subcollections) for the collection (see get_rollups).
+        '''
+        if not hasattr(self, '_rollup'):
+            self._rollup = Collection.get_rollups().get(str(self.uuid))
+        return self._rollup or {"subcollections": 0, "direct_parts": 0, "parts": 0}
+
+    def descendants(self):
+        '''return a queryset of all subcollections, at any depth
+        '''
+        subtree = models.expressions.RawSQL(get_collection_subtree_query(), [self.uuid])
+        return Collection.objects.filter(uuid__in=subtree).exclude(uuid=self.uuid)
+
+    def subtree_parts(self):
+        '''return a queryset of unique parts in the collection or any of
+           its subcollections.
+        '''
+        subtree = models.expressions.RawSQL(get_collection_subtree_query(), [self.uuid])
+        return Part.objects.filter(uuid__in=Part.collections.through.objects.filter(
+                                   collection_id__in=subtree).values('part_id'))
+
     def __str__(self):
         return "<Collection:%s>" % self.name
 
@@ -374,6 +530,10 @@ class Collection(models.Model):
         app_label = 'main'
 
 
+# The cache key for the lab map (see Container.get_tree)
+LAB_MAP_CACHE_KEY = "lab-map-tree"
+
+
 class Container(models.Model):
     '''A physical container in the lab space. Put together, forms a tree view of 
       a lab. Inside of a lab is a room, inside of that room is a freezer, 
@@ -421,22 +581,147 @@ class Container(models.Model):
     parent = models.ForeignKey('Container', on_delete=models.CASCADE, blank=True, null=True)
     image = models.ForeignKey('Files', on_delete=models.DO_NOTHING, blank=True, null=True)
 
+    # Materialized path of uuids (hex) from the root to this container, and
+    # the number of ancestors. Both are derived from the parent on save.
+    path = models.CharField(max_length=2000, blank=True, default="", db_index=True, editable=False)
+    depth = models.PositiveIntegerField(default=0, editable=False)
+
+    def save(self, *args, **kwargs):
+        '''derive the path and depth from the parent. If the container has
+           moved, the paths of all descendants are updated with one query.
+        '''
+        previous = None
+        if not self._state.adding:
+            previous = Container.objects.filter(uuid=self.uuid).values_list('path', flat=True).first()
+
+        self.path = self.uuid.hex if isinstance(self.uuid, uuid.UUID) else uuid.UUID(str(self.uuid)).hex
+        self.depth = 0
+        if self.parent_id:
+            parent_path = Container.objects.filter(uuid=self.parent_id).values_list('path', flat=True).first() or ""
+            if self.path in parent_path.split('/'):
+                raise ValidationError("A container cannot be moved inside of itself.")
+            self.path = "%s/%s" %(parent_path, self.path)
+            self.depth = self.path.count('/')
+
+        with transaction.atomic():
+            super(Container, self).save(*args, **kwargs)
+            if previous and previous != self.path:
+                Container.objects.filter(path__startswith=previous + '/').update(
+                    path=Concat(models.Value(self.path), Substr('path', len(previous) + 1)),
+                    depth=models.F('depth') + (self.depth - previous.count('/')))
+
+    @classmethod
+    def rebuild_paths(cls):
+        '''derive the path and depth for all containers from the parents,
+           for containers created without save (e.g., bulk inserts). Returns
+           the number of containers updated.
+        '''
+        containers = {c.uuid: c for c in cls.objects.only('uuid', 'parent', 'path', 'depth')}
+        paths = {}
+
+        def get_path(container, seen):
+            if container.uuid not in paths:
+                parent = containers.get(container.parent_id)
+                if parent is None or parent.uuid in seen:
+                    paths[container.uuid] = container.uuid.hex
+                else:
+                    paths[container.uuid] = "%s/%s" %(get_path(parent, seen | {container.uuid}),
+                                                      container.uuid.hex)
+            return paths[container.uuid]
+
+        changed = []
+        for container in containers.values():
+            path = get_path(container, set())
+            if container.path != path or container.depth != path.count('/'):
+                container.path = path
+                container.depth = path.count('/')
+                changed.append(container)
+
+        cls.objects.bulk_update(changed, ['path', 'depth'], batch_size=1000)
+        return len(changed)
+
+    @classmethod
+    def get_tree(cls):
+        '''return the lab map as a lookup of nodes (containers and plates) by
+           uuid, and a lookup of children uuids by parent uuid ("root" for
+           top level containers). The tree is built with one query for
+           containers and one for plates, and cached until a container or
+           plate changes (see clear_tree).
+        '''
+        tree = cache.get(LAB_MAP_CACHE_KEY)
+        if tree is not None:
+            return tree
+
+        nodes = {}
+        children = {}
+
+        # Plates are the last in a hierarchy, and come before nested containers
+        plates = Plate.objects.order_by('container_id', 'name').values_list('uuid', 'name', 'container_id')
+        for pk, name, container_id in plates:
+            nodes[str(pk)] = {"name": name,
+                                "uuid": str(pk),
+                                "type": "plate",
+                                "url": reverse('plate_details', args=[pk])}
+            children.setdefault(str(container_id), []).append(str(pk))
+
+        containers = cls.objects.order_by('depth', 'name').values_list('uuid', 'name', 'container_type',
+                                                                       'parent_id', 'depth')
+        for pk, name, container_type, parent_id, depth in containers:
+            nodes[str(pk)] = {"name": name,
+                                "uuid": str(pk),
+                                "type": container_type,
+                                "level": depth + 1,
+                                "url": reverse('container_details', args=[pk])}
+            parent = str(parent_id) if parent_id else "root"
+            children.setdefault(parent, []).append(str(pk))
+
+        tree = {"nodes": nodes, "children": children}
+        cache.set(LAB_MAP_CACHE_KEY, tree, LAB_MAP_CACHE_TIMEOUT)
+        return tree
+
+    @classmethod
+    def clear_tree(cls):
+        '''clear the cached lab map, done when containers or plates change
+        '''
+        cache.delete(LAB_MAP_CACHE_KEY)
+
+    @classmethod
+    def set_breadcrumbs(cls, containers):
+        '''look up the ancestors for a list of containers with one query,
+           so that a breadcrumb for each does not need another query.
+        '''
+        containers = [c for c in containers if c is not None]
+        uuids = set(chain(*[c.path.split('/') for c in containers]))
+        lookup = {c.uuid.hex: c for c in cls.objects.filter(uuid__in=uuids)}
+        for container in containers:
+            container._breadcrumb = [lookup[x] for x in container.path.split('/') if x in lookup]
+
+    def ancestors(self):
+        '''return a queryset of ancestors (including self), root first
+        '''
+        return Container.objects.filter(uuid__in=self.path.split('/')).order_by('depth')
+
+    def descendants(self):
+        '''return a queryset of all containers nested under this one
+        '''
+        return Container.objects.filter(path__startswith=self.path + '/')
+
+    def subtree_plates(self):
+        '''return a queryset of plates in this container or any container
+           nested under it (e.g., all plates in a freezer).
+        '''
+        return Plate.objects.filter(models.Q(container=self) |
+                                    models.Q(container__path__startswith=self.path + '/'))
+
     @property
     def breadcrumb(self):
-        '''a breadcrumb is a trace of the plate up to the parent container.
-           we start at the child and trace up to the parent, so the order
-           is first child to parent, and we reverse to give user parent
-           to child.
+        '''a breadcrumb is a trace from the root container down to this one.
+           The ancestors are derived from the path, so this is one query
+           (or none, if set_breadcrumbs was used).
         '''
-        breadcrumb = []
-        container = self
-        while container:
-            breadcrumb.append(container)
-            container = container.parent
-
-        # Reverse, give to user parent to child
-        breadcrumb = breadcrumb[::-1]
-        return breadcrumb
+        if not hasattr(self, '_breadcrumb'):
+            self._breadcrumb = list(self.ancestors())
+        return self._breadcrumb
  
     def __str__(self):
         return "<Container:%s>" % self.name
@@ -577,8 +862,9 @@ class Module(models.Model):
         '''
         schema = self.SCHEMAS.get(self.module_type)
         if schema:
-            if not validate(self.data, schema):
-                raise ValidationError('Invalid schema for %s type %s' % (self.uuid, self.module_type))
+            errors = get_json_errors(self.data, schema)
+            if errors:
+                raise ValidationError({'data': errors})
 
     SCHEMAS = MODULE_SCHEMAS
 
@@ -746,6 +1032,24 @@ class MaterialTransferAgreement(models.Model):
 # Plates
 ################################################################################
 
+@lru_cache(maxsize=None)
+def get_plate_layout(height, length):
+    '''return the well addresses (e.g., A1, A2, ... H12) for a plate with
+       a given height (rows) and length (columns). Layouts are computed once
+       for each size and shared, so the tuple returned is immutable.
+    '''
+    return tuple("%s%s" % (letter, number + 1) 
+                 for letter in string.ascii_uppercase[0:height]
+                 for number in range(length))
+
+
+# The cache key for a plate map, by plate uuid and version (see Plate.get_map)
+PLATE_MAP_CACHE_KEY = "plate-map:%s:%s"
+
+# The fields for each well in a plate map, in order
+PLATE_MAP_FIELDS = ['address', 'well', 'sample', 'part', 'gene_id', 'evidence', 'volume', 'media']
+
+
 class Plate(models.Model):
     '''A physical plate in the lab.
     '''
@@ -798,22 +1102,17 @@ class Plate(models.Model):
     container = models.ForeignKey('Container', on_delete=models.CASCADE)
     protocol = models.ForeignKey('Protocol', on_delete=models.CASCADE, blank=True, null=True)
 
+    # Content digest of the last imported entry, to skip unchanged re-imports
+    digest = models.CharField(max_length=250, blank=True, null=True, db_index=True, editable=False)
+
     @property
     def breadcrumb(self):
-        '''a breadcrumb is a trace of the plate up to the parent container.
-           we start at the child and trace up to the parent, so the order
-           is first child to parent, and we reverse to give user parent
-           to child.
+        '''a breadcrumb is a trace from the root container down to the
+           container of the plate (see Container.breadcrumb).
         '''
-        breadcrumb = []
-        container = self.container
-        while container:
-            breadcrumb.append(container)
-            container = container.parent
-
-        # Reverse, give to user parent to child
-        breadcrumb = breadcrumb[::-1]
-        return breadcrumb
+        if not self.container_id:
+            return []
+        return self.container.breadcrumb
 
 
     def json(self):
@@ -838,30 +1137,106 @@ class Plate(models.Model):
             {"key": "Length", "value": self.length}]
         return fields
 
+    @property
+    def layout(self):
+        '''the well addresses for the plate dimensions (see get_plate_layout)
+        '''
+        return get_plate_layout(self.height, self.length)
+
     def generate_wells(self):
         '''Given a set length and height, generate plate wells, but only
            if the plate does not have any. We return the number of wells
            created.
         '''
-        # Imported data will already have wells added, skip this
-        if self.wells.count() > 0:
-            print("Plate already has wells.")
-            return 0
+        return Plate.generate_wells_many([self])
+
+    @staticmethod
+    def generate_wells_many(plates):
+        '''generate wells for a list of plates (e.g., for a batch of new
+           plates) that don't have any yet. All wells are created with one 
+           bulk insert, and added to their plates with a second.
+           We return the number of wells created.
+        '''
+        from fg.apps.main.bulk import BATCH_SIZE, bulk_link
 
-        # Well positions are generated based on the plate dimensions
-        positions = []
-    
-        for letter in list(string.ascii_uppercase[0:self.height]):
-            for number in range(self.length):
-                positions.append((letter, number+1))
+        plates = list(plates)
 
-        # Create wells, add to plate
-        for location in [x[0]+str(x[1]) for x in positions]:
-            well = Well.objects.create(address=location, volume=0)
-            well.save()
-            self.wells.add(well)
+        # Imported data will already have wells added, skip these plates
+        with_wells = set(Plate.wells.through.objects.filter(plate_id__in=[p.uuid for p in plates])
+                                                    .values_list('plate_id', flat=True))
+
+        wells = []
+        links = []
+        for plate in plates:
+            if plate.uuid in with_wells:
+                print("Plate %s already has wells." % plate.name)
+                continue
 
-        self.save()
+            # Well positions are generated based on the plate dimensions
+            for address in plate.layout:
+                well = Well(address=address, volume=0)
+                wells.append(well)
+                links.append((plate.uuid, well.uuid))
+
+        with transaction.atomic():
+            Well.objects.bulk_create(wells, batch_size=BATCH_SIZE)
+            bulk_link(Plate.wells, links)
+            WellContent.refresh(set([plate_id for plate_id, _ in links]))
+        return len(wells)
+
+    @classmethod
+    def get_map(cls, uuid):
+        '''return the map for a plate (by uuid), or None if the plate doesn't
+           exist. The map is cached for each version of the plate, which is
+           changed when its contents (or wells) change.
+        '''
+        version = get_instance_version(cls, uuid)
+        key = PLATE_MAP_CACHE_KEY %(uuid, version[1])
+        plate_map = cache.get(key)
+        if plate_map is None:
+            plate = cls.objects.filter(uuid=uuid).values('uuid', 'name', 'plate_form', 'height', 'length').first()
+            if plate is None:
+                return None
+            plate_map = cls.build_map(plate)
+            cache.set(key, plate_map, PLATE_MAP_CACHE_TIMEOUT)
+        return plate_map
+
+    @classmethod
+    def build_map(cls, plate):
+        '''build the map for a plate (a dictionary with uuid, name, plate_form,
+           height and length) from the well contents, with one query. Each
+           field (see PLATE_MAP_FIELDS) is a list with a value for each
+           position in the grid, by row and then column, so the well at row
+           r and column c (from 1) is at index (r - 1) * columns + (c - 1).
+           Positions without a well have an address (for plates up to 26
+           rows) and None for the rest. Wells with an address that can't
+           be parsed are not included.
+        '''
+        contents = list(WellContent.objects.filter(plate_id=plate['uuid'], row__isnull=False, column__isnull=False)
+                                           .values_list('row', 'column', 'address', 'well_id', 'sample_id',
+                                                        'part_id', 'gene_id', 'evidence',
+                                                        'well__volume', 'well__media'))
+
+        # The grid is the plate dimensions, unless a well is outside of it
+        rows = max([plate['height']] + [content[0] for content in contents])
+        columns = max([plate['length']] + [content[1] for content in contents])
+        grid = {name: [None] * (rows * columns) for name in PLATE_MAP_FIELDS}
+        if rows <= len(string.ascii_uppercase):
+            grid['address'] = list(get_plate_layout(rows, columns))
+
+        for row, column, *values in contents:
+            index = (row - 1) * columns + (column - 1)
+            for name, value in zip(PLATE_MAP_FIELDS, values):
+                grid[name][index] = str(value) if isinstance(value, uuid.UUID) else value
+
+        plate_map = {"uuid": str(plate['uuid']),
+                     "name": plate['name'],
+                     "plate_form": plate['plate_form'],
+                     "rows": rows,
+                     "columns": columns,
+                     "wells": len(contents)}
+        plate_map.update(grid)
+        return plate_map
 
     def get_absolute_url(self):
         return reverse('plate_details', args=[self.uuid])
@@ -877,6 +1252,10 @@ class Plate(models.Model):
 
     class Meta:
         app_label = 'main'
+        # catalogs and api pages are ordered by most recently updated
+        indexes = [
+            models.Index(fields=['-time_updated', '-uuid'])
+        ]
 
     # wells are deleted with a pre_delete signal
     wells = models.ManyToManyField('main.Well', blank=True, default=None,
@@ -957,17 +1336,44 @@ class Distribution(models.Model):
     def gene_ids(self):
         '''return a list of unique part gene_ids for the distribution
         '''
-        gene_ids = set()
-        for plateset in self.platesets.all():
+        return Distribution.get_gene_ids([self]).get(self.uuid, set())
 
-            if plateset.plates.count() == 0:
-                continue
-
-            # Each plate should be the same, so we look at the first
-            plate = plateset.plates.first()          
-            for well in plate.wells.all():
-                gene_ids.add(well.sample_wells.first().part.gene_id)
-        return gene_ids
+    @classmethod
+    def get_gene_ids(cls, distributions):
+        '''return the unique part gene_ids for a list of distributions (by
+           uuid), with two queries regardless of the number of distributions.
+        '''
+        # Each plate should be the same, so we look at the first for each plateset.
+        # plates is not a sorted many to many, so (as for plateset.plates.first())
+        # the first is by the default ordering for a plate, or the primary key
+        ordering = ['%splate__%s' %('-' if field.startswith('-') else '', field.lstrip('-'))
+                    for field in Plate._meta.ordering or ['pk']]
+        plates = {}
+        platesets = {}
+        for distribution_id, plateset_id, plate_id in (
+            PlateSet.plates.through.objects.filter(plateset__distribution_plateset__in=distributions)
+                                   .order_by('plateset_id', *ordering)
+                                   .values_list('plateset__distribution_plateset', 'plateset_id', 'plate_id')):
+            plates.setdefault(plateset_id, plate_id)
+            platesets.setdefault(distribution_id, set()).add(plateset_id)
+
+        gene_ids = {}
+        for plate_id, gene_id in (WellContent.objects.filter(plate_id__in=plates.values(), gene_id__isnull=False)
+                                                     .values_list('plate_id', 'gene_id').distinct()):
+            gene_ids.setdefault(plate_id, set()).add(gene_id)
+
+        return {distribution_id: set().union(*[gene_ids.get(plates[plateset_id], set())
+                                               for plateset_id in plateset_ids])
+                for distribution_id, plateset_ids in platesets.items()}
+
+    @classmethod
+    def set_unique_parts(cls, distributions):
+        '''set the count of unique parts for a list of distributions, so a
+           template can show them without a lookup for each.
+        '''
+        gene_ids = cls.get_gene_ids(distributions)
+        for distribution in distributions:
+            distribution._unique_parts = len(gene_ids.get(distribution.uuid, []))
 
     def parts(self):
         '''return unique list of part objects'''
@@ -978,7 +1384,9 @@ class Distribution(models.Model):
         '''return the count of unique parts (intended for the distribution 
            catalog view or the function in views to count parts
         '''
-        return len(self.gene_ids())
+        if not hasattr(self, '_unique_parts'):
+            self._unique_parts = len(self.gene_ids())
+        return self._unique_parts
 
     def __str__(self):
         return "<Distribution:%s,%s>" %(self.name, self.platesets.count())
@@ -1071,6 +1479,168 @@ class Sample(models.Model):
                                    related_name="sample_wells",
                                    related_query_name="sample_wells")
 
+    # The number of samples above this one in the lineage (by derived_from),
+    # and the first sample (None for a sample not derived from another)
+    lineage_depth = models.PositiveIntegerField(default=0, editable=False)
+    lineage_root = models.ForeignKey('Sample', on_delete=models.SET_NULL, blank=True, null=True,
+                                     editable=False, related_name="lineage_samples",
+                                     related_query_name="lineage_samples")
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        '''keep the loaded derived_from, so save knows if the lineage changed,
+           and part (for signals, see fg.apps.factory.signals)
+        '''
+        instance = super(Sample, cls).from_db(db, field_names, values)
+        instance._loaded_derived_from = instance.__dict__.get('derived_from_id')
+        instance._loaded_part = instance.__dict__.get('part_id')
+        return instance
+
+    def save(self, *args, **kwargs):
+        '''derive the lineage depth and root from the sample this one was
+           derived from. If it changed, the lineage of all samples derived
+           from this one is updated with one query.
+        '''
+        adding = self._state.adding
+        changed = adding or self.derived_from_id != getattr(self, '_loaded_derived_from', None)
+        if not changed:
+            return super(Sample, self).save(*args, **kwargs)
+
+        self.lineage_depth = 0
+        self.lineage_root = None
+        if self.derived_from_id:
+            derivations = set([str(self.uuid)])
+            if not adding:
+                derivations.update(x for x, _ in Sample.get_descendants([self.uuid])[str(self.uuid)])
+            if str(self.derived_from_id) in derivations:
+                raise ValidationError("A sample cannot be derived from itself or its derivations.")
+
+            depth, root = Sample.objects.filter(uuid=self.derived_from_id) \
+                                        .values_list('lineage_depth', 'lineage_root').first() or (0, None)
+            self.lineage_depth = depth + 1
+            self.lineage_root_id = root or self.derived_from_id
+
+        with transaction.atomic():
+            super(Sample, self).save(*args, **kwargs)
+
+            # A new sample has no derivations to update
+            if not adding:
+                with connection.cursor() as cursor:
+                    cursor.execute(get_sample_lineage_update_query(),
+                                   [[str(self.uuid)], self.lineage_depth,
+                                    str(self.lineage_root_id or self.uuid)])
+        self._loaded_derived_from = self.derived_from_id
+
+    @classmethod
+    def rebuild_lineage(cls):
+        '''derive the lineage depth and root for all samples, for samples
+           created without save (e.g., bulk inserts). Returns the number of
+           samples updated.
+        '''
+        samples = {s.uuid: s for s in cls.objects.only('uuid', 'derived_from', 'lineage_depth', 'lineage_root')}
+        lineage = {}
+
+        def get_lineage(sample, seen):
+            if sample.uuid not in lineage:
+                parent = samples.get(sample.derived_from_id)
+                if parent is None or parent.uuid in seen:
+                    lineage[sample.uuid] = (0, None)
+                else:
+                    depth, root = get_lineage(parent, seen | {sample.uuid})
+                    lineage[sample.uuid] = (depth + 1, root or parent.uuid)
+            return lineage[sample.uuid]
+
+        changed = []
+        for sample in samples.values():
+            depth, root = get_lineage(sample, set())
+            if sample.lineage_depth != depth or sample.lineage_root_id != root:
+                sample.lineage_depth = depth
+                sample.lineage_root_id = root
+                changed.append(sample)
+
+        cls.objects.bulk_update(changed, ['lineage_depth', 'lineage_root'], batch_size=1000)
+        return len(changed)
+
+    @classmethod
+    def get_ancestors(cls, uuids):
+        '''return a lookup of sample uuid to the list of samples (uuids) it
+           was derived from, nearest first, for a list of samples. This is
+           one (recursive) query regardless of the number of samples.
+        '''
+        ancestors = {str(x): [] for x in uuids}
+        with connection.cursor() as cursor:
+            cursor.execute(get_sample_ancestors_query(), [list(ancestors)])
+            for sample_id, ancestor_id, _ in cursor.fetchall():
+                ancestors[str(sample_id)].append(str(ancestor_id))
+        return ancestors
+
+    @classmethod
+    def get_descendants(cls, uuids):
+        '''return a lookup of sample uuid to a list of (descendant, parent)
+           uuids, nearest first, for all samples derived (at any depth) from
+           a list of samples. This is one (recursive) query.
+        '''
+        descendants = {str(x): [] for x in uuids}
+        with connection.cursor() as cursor:
+            cursor.execute(get_sample_descendants_query(), [list(descendants)])
+            for sample_id, descendant_id, parent_id, _ in cursor.fetchall():
+                descendants[str(sample_id)].append((str(descendant_id), str(parent_id)))
+        return descendants
+
+    @classmethod
+    def get_lineage(cls, uuids):
+        '''return a lookup of sample uuid to its lineage for a list of samples.
+           The lineage includes the sample, the samples it was derived from
+           (ancestors, nearest first) and a tree of samples derived from it
+           (descendants, each with children). This is three queries
+           regardless of the number of samples or depth.
+        '''
+        fields = ['uuid', 'sample_type', 'status', 'evidence', 'vendor', 'part',
+                  'derived_from', 'lineage_depth', 'lineage_root']
+
+        ancestors = cls.get_ancestors(uuids)
+        descendants = cls.get_descendants(uuids)
+
+        lookup = set(ancestors)
+        for sample_id in ancestors:
+            lookup.update(ancestors[sample_id])
+            lookup.update(x for x, _ in descendants[sample_id])
+
+        samples = {}
+        for values in cls.objects.filter(uuid__in=lookup).values(*fields):
+            samples[str(values['uuid'])] = {key: str(value) if isinstance(value, uuid.UUID) else value
+                                            for key, value in values.items()}
+
+        lineage = {}
+        for sample_id in ancestors:
+            if sample_id not in samples:
+                continue
+
+            # Each derived sample is added to the children of its parent
+            nodes = {sample_id: {"children": []}}
+            for descendant_id, parent_id in descendants[sample_id]:
+                nodes[descendant_id] = dict(samples[descendant_id], children=[])
+                nodes[parent_id]['children'].append(nodes[descendant_id])
+
+            lineage[sample_id] = {"sample": samples[sample_id],
+                                  "ancestors": [samples[x] for x in ancestors[sample_id]],
+                                  "descendants": nodes[sample_id]['children']}
+        return lineage
+
+    def ancestors(self):
+        '''return the samples this one was derived from, nearest first
+        '''
+        uuids = Sample.get_ancestors([self.uuid])[str(self.uuid)]
+        lookup = Sample.objects.in_bulk(uuids)
+        return [lookup[uuid.UUID(x)] for x in uuids]
+
+    def descendants(self):
+        '''return a queryset of all samples derived (at any depth) from this one
+        '''
+        subtree = models.expressions.RawSQL(SAMPLE_DESCENDANTS + " SELECT descendant_id FROM lineage",
+                                            [[str(self.uuid)]])
+        return Sample.objects.filter(uuid__in=subtree)
+
     def get_absolute_url(self):
         return reverse('sample_details', args=[self.uuid])
 
@@ -1079,6 +1649,10 @@ class Sample(models.Model):
 
     class Meta:
         app_label = 'main'
+        # catalogs and api pages are ordered by most recently updated
+        indexes = [
+            models.Index(fields=['-time_updated', '-uuid'])
+        ]
 
 
 ################################################################################
@@ -1124,6 +1698,148 @@ class Well(models.Model):
         app_label = 'main'
 
 
+################################################################################
+# Well Contents
+################################################################################
+
+def parse_well_address(address):
+    '''parse a well address (e.g., A1 or H12) into a row (1 is A) and column,
+       returning (None, None) if the address cannot be parsed.
+    '''
+    match = re.search("^([A-Za-z]+)0*([0-9]+)$", (address or "").strip())
+    if not match:
+        return None, None
+    row = 0
+    for letter in match.group(1).upper():
+        row = row * 26 + (ord(letter) - ord('A') + 1)
+    return row, int(match.group(2))
+
+
+class WellContent(models.Model):
+    '''A read only projection of what is in each well of a plate, so a plate
+       (e.g., for a plate map, export, or to check availability) is read
+       with one query instead of following plate wells to samples, parts,
+       and authors. Rows are kept current by signals (see signals.py) and
+       bulk operations that skip signals should call WellContent.refresh.
+    '''
+    uuid = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    plate = models.ForeignKey('Plate', on_delete=models.CASCADE, related_name="contents")
+    well = models.ForeignKey('Well', on_delete=models.CASCADE, related_name="contents")
+    address = models.CharField(max_length=32)
+    row = models.PositiveIntegerField(blank=True, null=True)
+    column = models.PositiveIntegerField(blank=True, null=True)
+
+    # A well doesn't require a sample, the first sample (as for well.sample_wells.first())
+    sample = models.ForeignKey('Sample', on_delete=models.SET_NULL, blank=True, null=True)
+    part = models.ForeignKey('Part', on_delete=models.SET_NULL, blank=True, null=True)
+    gene_id = models.CharField(max_length=250, blank=True, null=True)
+    evidence = models.CharField(max_length=32, blank=True, null=True)
+
+    def __str__(self):
+        return "<WellContent:%s,%s>" %(self.address, self.gene_id)
+
+    def __repr__(self):
+        return self.__str__()
+
+    # Plates and wells to refresh at the end of a deferred block, per thread
+    deferred_refresh = threading.local()
+
+    @classmethod
+    @contextmanager
+    def deferred(cls):
+        '''defer refreshes (e.g., from signals for each well added during an
+           import) to the end of the block, so each plate is refreshed once.
+           This can also be used as a decorator, @WellContent.deferred()
+        '''
+        if getattr(cls.deferred_refresh, 'plates', None) is not None:
+            yield
+            return
+
+        cls.deferred_refresh.plates = set()
+        cls.deferred_refresh.wells = set()
+        failed = False
+        try:
+            yield
+        except BaseException:
+            failed = True
+            raise
+        finally:
+            plates = cls.deferred_refresh.plates
+            wells = cls.deferred_refresh.wells
+            cls.deferred_refresh.plates = None
+            cls.deferred_refresh.wells = None
+
+            # If the block fails, what it wrote is kept (and refreshed) unless
+            # it's in a transaction, which is rolled back
+            if not failed or not transaction.get_connection().in_atomic_block:
+                if wells:
+                    plates.update(Plate.wells.through.objects.filter(well_id__in=wells)
+                                              .values_list('plate_id', flat=True))
+                cls.refresh(plates)
+
+    @classmethod
+    def refresh(cls, plates):
+        '''rebuild the contents for a list of plates (or plate uuids). This
+           is done with three queries (and a delete and insert) regardless
+           of the number of wells. Returns the number of rows written.
+        '''
+        plate_ids = set([getattr(plate, 'uuid', plate) for plate in plates])
+        if getattr(cls.deferred_refresh, 'plates', None) is not None:
+            cls.deferred_refresh.plates.update(plate_ids)
+            return 0
+
+        if not plate_ids:
+            return 0
+
+        plate_wells = list(Plate.wells.through.objects.filter(plate_id__in=plate_ids)
+                                      .values_list('plate_id', 'well_id', 'well__address'))
+
+        # The first sample (by primary key) for each well
+        samples = {}
+        for well_id, sample_id, part_id, gene_id, evidence in (
+            Sample.wells.through.objects.filter(well_id__in=[x[1] for x in plate_wells])
+                                .order_by('well_id', 'sample_id')
+                                .values_list('well_id', 'sample_id', 'sample__part_id',
+                                             'sample__part__gene_id', 'sample__evidence')):
+            samples.setdefault(well_id, (sample_id, part_id, gene_id, evidence))
+
+        contents = []
+        for plate_id, well_id, address in plate_wells:
+            row, column = parse_well_address(address)
+            sample_id, part_id, gene_id, evidence = samples.get(well_id, (None, None, None, None))
+            contents.append(cls(plate_id=plate_id, well_id=well_id, address=address,
+                                row=row, column=column, sample_id=sample_id, part_id=part_id,
+                                gene_id=gene_id, evidence=evidence))
+
+        with transaction.atomic():
+            cls.objects.filter(plate_id__in=plate_ids).delete()
+            cls.objects.bulk_create(contents, batch_size=1000)
+        bump_versions([cls])
+        bump_instance_versions(Plate, plate_ids)
+        return len(contents)
+
+    @classmethod
+    def refresh_wells(cls, wells):
+        '''rebuild the contents for all plates that include a list of wells
+           (or well uuids).
+        '''
+        well_ids = [getattr(well, 'uuid', well) for well in wells]
+        if getattr(cls.deferred_refresh, 'wells', None) is not None:
+            cls.deferred_refresh.wells.update(well_ids)
+            return 0
+
+        return cls.refresh(Plate.wells.through.objects.filter(well_id__in=well_ids)
+                                       .values_list('plate_id', flat=True).distinct())
+
+    class Meta:
+        app_label = 'main'
+        unique_together = (('plate', 'well'),)
+        indexes = [
+            models.Index(fields=['plate', 'row', 'column']),
+            models.Index(fields=['gene_id'])
+        ]
+
+
 ################################################################################
 # Schemas
 ################################################################################
@@ -1140,6 +1856,15 @@ class Schema(models.Model):
     schema = JSONField(default=dict, blank=False, unique=True)
     schema_version = models.CharField(max_length=250)
 
+    def clean(self):
+        '''ensure that the schema is itself a valid json schema. This also
+           compiles (and caches) the validator for protocols to use.
+        '''
+        try:
+            get_json_validator(self.schema)
+        except SchemaError as error:
+            raise ValidationError({'schema': error.message})
+
     def get_absolute_url(self):
         return reverse('schema_details', args=[self.uuid])
 
@@ -1174,6 +1899,14 @@ class Protocol(models.Model):
     # but not unless an admin does it or something
     schema = models.ForeignKey('Schema', on_delete=models.DO_NOTHING, blank=True, null=True)
 
+    def clean(self):
+        '''if the protocol has a schema, validate the data against it.
+        '''
+        if self.schema is not None:
+            errors = get_json_errors(self.data, self.schema.schema)
+            if errors:
+                raise ValidationError({'data': errors})
+
     def get_absolute_url(self):
         return reverse('schema_details', args=[self.uuid])
 
@@ -1202,6 +1935,20 @@ class Operation(models.Model):
                                    related_name="operation_plans",
                                    related_query_name="operation_plans")
 
+    def get_plans(self):
+        '''return a queryset of plans for the operation, either added to
+           the operation's plans or with the operation as their operation.
+        '''
+        return Plan.objects.filter(models.Q(operation=self) |
+                                   models.Q(operation_plans=self)).distinct()
+
+    def get_plan_tree(self):
+        '''return the root plans for the operation, with the children and
+           items (plan data) of every plan loaded (see Plan.set_tree). This
+           is a fixed number of queries, regardless of the number of plans.
+        '''
+        return Plan.set_tree(list(self.get_plans().order_by('time_created')))
+
     def get_absolute_url(self):
         return reverse('operation_details', args=[self.uuid])
 
@@ -1260,9 +2007,98 @@ class Plan(models.Model):
         return PlanData.objects.create(
             plan=self,
             data_content_type=data_content_type,
-            data_object_id=item.pk,
+            data_object_id=str(item.pk),
         )
 
+    @classmethod
+    def set_items(cls, plans):
+        '''given a list of plans, look up the items (wells, protocols, plates,
+           samples) for all of them and set them on each plan. Instead of
+           resolving each PlanData with its own query, we look up the plan
+           data in one query, and then the items in one query per content type.
+        '''
+        plans = list(plans)
+        plandata = list(PlanData.objects.filter(plan__in=plans).order_by('id'))
+
+        # Group object ids by content type (content types are cached)
+        ids = {}
+        for entry in plandata:
+            ids.setdefault(entry.data_content_type_id, set()).add(entry.data_object_id)
+
+        lookup = {}
+        for content_type_id, object_ids in ids.items():
+            Model = ContentType.objects.get_for_id(content_type_id).model_class()
+            for pk, item in Model.objects.in_bulk(list(object_ids)).items():
+                lookup[(content_type_id, str(pk))] = item
+
+        items = {plan.uuid: [] for plan in plans}
+        for entry in plandata:
+            item = lookup.get((entry.data_content_type_id, entry.data_object_id))
+            if item is not None:
+                items[entry.plan_id].append(item)
+
+        for plan in plans:
+            plan._items = items[plan.uuid]
+
+    @classmethod
+    def set_tree(cls, plans):
+        '''given a list of plans (e.g., all plans for an operation) set the
+           children and items of each, and return the plans without a parent
+           in the list (the roots). Children keep the order of the list.
+        '''
+        plans = list(plans)
+        cls.set_items(plans)
+
+        children = {plan.uuid: [] for plan in plans}
+        roots = []
+        for plan in plans:
+            if plan.parent_id in children:
+                children[plan.parent_id].append(plan)
+            else:
+                roots.append(plan)
+
+        for plan in plans:
+            plan._children = children[plan.uuid]
+        return roots
+
+    def descendants(self):
+        '''return a queryset of all child plans, at any depth
+        '''
+        subtree = models.expressions.RawSQL(get_plan_subtree_query(), [[str(self.uuid)]])
+        return Plan.objects.filter(uuid__in=subtree).exclude(uuid=self.uuid)
+
+    def get_tree(self):
+        '''load the children (at any depth) and items of the plan, in a
+           fixed number of queries, and return the plan.
+        '''
+        Plan.set_tree([self] + list(self.descendants().order_by('time_created')))
+        return self
+
+    @property
+    def children(self):
+        if not hasattr(self, '_children'):
+            self._children = list(self.plan_set.order_by('time_created'))
+        return self._children
+
+    @property
+    def items(self):
+        if not hasattr(self, '_items'):
+            Plan.set_items([self])
+        return self._items
+
+    def tree(self):
+        '''return a json serializable tree of the plan, its items, and its
+           children. Use after get_tree (or set_tree) to avoid extra queries.
+        '''
+        return {"uuid": str(self.uuid),
+                "name": self.name,
+                "status": self.status,
+                "parent": str(self.parent_id) if self.parent_id else None,
+                "items": [{"uuid": str(item.pk),
+                           "label": item.get_label(),
+                           "name": getattr(item, 'name', None)} for item in self.items],
+                "children": [child.tree() for child in self.children]}
+
     def get_absolute_url(self):
         return reverse('plan_details', args=[self.uuid])
 
@@ -1284,7 +2120,8 @@ class PlanData(models.Model):
        represented under a plan as plan_data, e.g., plan.plan_data.all()
     '''
     plan = models.ForeignKey('main.Plan', on_delete=models.CASCADE, related_name="plan_data")
-    data_object_id = models.IntegerField()
+    # a string holds any primary key (all of our models use uuids)
+    data_object_id = models.CharField(max_length=36)
     data_content_type = models.ForeignKey(ContentType, on_delete=models.PROTECT)
     data = GenericForeignKey(
         'data_content_type',
@@ -1308,4 +2145,12 @@ class PlanData(models.Model):
     class Meta:
         app_label = 'main'
 
+
+# Models with tags, by the name used for their count in tag statistics
+TAG_STATISTICS_MODELS = {"authors": Author,
+                         "organisms": Organism,
+                         "collections": Collection,
+                         "parts": Part}
+
+
 from .signals import protect_containers, delete_wells, protect_plan
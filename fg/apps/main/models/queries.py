@@ -8,31 +8,113 @@ with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
 '''
 
-def get_part_available_query(gene_ids):
-    '''a custom query to return if a part is available based on being associated
-       with a distribution. You can provide a single gene_id to look for,
-       or a list of more then one (which will run a query to return more
-       than one result for those available.
+# Collections are a tree (by parent), and the recursive part of each query
+# keeps the path of uuids to stop at a cycle (the parent is not protected)
+
+COLLECTION_TREE = """WITH RECURSIVE tree(ancestor_id, collection_id, path) AS (
+    SELECT c.uuid, c.uuid, ARRAY[c.uuid] FROM main_collection AS c %s
+  UNION ALL
+    SELECT t.ancestor_id, c.uuid, t.path || c.uuid
+    FROM main_collection AS c
+    JOIN tree AS t on c.parent_id=t.collection_id
+    WHERE NOT c.uuid = ANY(t.path)
+)"""
+
+
+def get_collection_subtree_query():
+    '''a custom query to return the uuids of a collection (the single parameter)
+       and all of its subcollections, at any depth.
+    '''
+    return COLLECTION_TREE % "WHERE c.uuid = %s" + """
+SELECT collection_id FROM tree"""
+
+
+def get_collection_rollup_query():
+    '''a custom query to return, for every collection, the number of
+       subcollections (at any depth), the number of parts directly in the
+       collection, and the number of unique parts in the collection or
+       any of its subcollections.
+    '''
+    return COLLECTION_TREE % "" + """
+SELECT t.ancestor_id,
+       COUNT(DISTINCT t.collection_id) - 1 AS subcollections,
+       COUNT(DISTINCT pc.part_id) FILTER (WHERE t.collection_id=t.ancestor_id) AS direct_parts,
+       COUNT(DISTINCT pc.part_id) AS parts
+FROM tree AS t
+LEFT JOIN main_part_collections AS pc on pc.collection_id=t.collection_id
+GROUP BY t.ancestor_id"""
+
+
+# Samples are derived from other samples, and the recursive part of each
+# query keeps the path of uuids to stop at a cycle
+
+SAMPLE_ANCESTORS = """WITH RECURSIVE lineage(sample_id, ancestor_id, distance, path) AS (
+    SELECT s.uuid, s.derived_from_id, 1, ARRAY[s.uuid]
+    FROM main_sample AS s
+    WHERE s.uuid = ANY(%s::uuid[]) AND s.derived_from_id IS NOT NULL
+  UNION ALL
+    SELECT l.sample_id, s.derived_from_id, l.distance + 1, l.path || s.uuid
+    FROM lineage AS l
+    JOIN main_sample AS s on s.uuid=l.ancestor_id
+    WHERE s.derived_from_id IS NOT NULL AND NOT s.derived_from_id = ANY(l.path || s.uuid)
+)"""
+
+SAMPLE_DESCENDANTS = """WITH RECURSIVE lineage(sample_id, descendant_id, parent_id, distance, path) AS (
+    SELECT s.derived_from_id, s.uuid, s.derived_from_id, 1, ARRAY[s.derived_from_id, s.uuid]
+    FROM main_sample AS s
+    WHERE s.derived_from_id = ANY(%s::uuid[])
+  UNION ALL
+    SELECT l.sample_id, s.uuid, s.derived_from_id, l.distance + 1, l.path || s.uuid
+    FROM lineage AS l
+    JOIN main_sample AS s on s.derived_from_id=l.descendant_id
+    WHERE NOT s.uuid = ANY(l.path)
+)"""
+
+
+def get_sample_ancestors_query():
+    '''a custom query to return (sample, ancestor, distance) for all ancestors
+       of a list of samples (the single parameter, a list of uuids). The
+       sample it was derived from has distance 1.
+    '''
+    return SAMPLE_ANCESTORS + """
+SELECT sample_id, ancestor_id, distance FROM lineage ORDER BY sample_id, distance"""
+
+
+def get_sample_descendants_query():
+    '''a custom query to return (sample, descendant, parent, distance) for all
+       samples derived (at any depth) from a list of samples (the single 
+       parameter, a list of uuids).
+    '''
+    return SAMPLE_DESCENDANTS + """
+SELECT sample_id, descendant_id, parent_id, distance FROM lineage ORDER BY sample_id, distance"""
+
+
+def get_sample_lineage_update_query():
+    '''a custom query to set the lineage depth and root of all samples derived
+       from a sample. Parameters are the sample uuid (in a list), the depth
+       of the sample, and the root for its descendants.
+    '''
+    return SAMPLE_DESCENDANTS + """
+UPDATE main_sample SET lineage_depth = %s + l.distance, lineage_root_id = %s
+FROM lineage AS l WHERE main_sample.uuid=l.descendant_id"""
+
+
+# Plans are a tree (by parent), and the recursive part of the query keeps
+# the path of uuids to stop at a cycle
+
+PLAN_TREE = """WITH RECURSIVE tree(plan_id, path) AS (
+    SELECT p.uuid, ARRAY[p.uuid] FROM main_plan AS p WHERE p.uuid = ANY(%s::uuid[])
+  UNION ALL
+    SELECT p.uuid, t.path || p.uuid
+    FROM main_plan AS p
+    JOIN tree AS t on p.parent_id=t.plan_id
+    WHERE NOT p.uuid = ANY(t.path)
+)"""
+
+
+def get_plan_subtree_query():
+    '''a custom query to return the uuids of a list of plans (the single
+       parameter, a list of uuids) and all of their child plans, at any depth.
     '''
-    query = """SELECT DISTINCT p.uuid AS uuid, p.name AS part_name, p.description AS part_description, p.gene_id AS part_gene_id
-FROM main_part AS p
-JOIN main_sample as s on s.part_id=p.uuid
-JOIN main_sample_wells AS sw on sw.sample_id=s.uuid
-JOIN main_well AS w on w.uuid=sw.well_id
-JOIN main_plate_wells AS pw on pw.well_id=w.uuid
-JOIN main_plate AS pl on pl.uuid=pw.plate_id
-JOIN main_plateset_plates AS pp on pp.plate_id=pl.uuid
-JOIN main_plateset AS ps on ps.uuid=pp.plateset_id
-JOIN main_distribution_platesets AS dp on dp.plateset_id=ps.uuid
-JOIN main_distribution AS d on d.uuid=dp.distribution_id
-WHERE '' LIKE p.name OR '' LIKE p.description OR '' LIKE p.part_type"""
-
-    # If we're given one string, just for one part
-    if isinstance(gene_ids, str):
-        return query + " OR '%s' LIKE p.gene_id" % gene_ids
-
-    # If we're given a list, assemble a LIKE for each one
-    for gene_id in gene_ids:
-        query += " OR '%s' LIKE p.gene_id" % gene_id
-
-    return query
+    return PLAN_TREE + """
+SELECT DISTINCT plan_id FROM tree"""
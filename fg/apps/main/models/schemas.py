@@ -12,12 +12,12 @@ MODULE_SCHEMAS = {
 
     "pipette": {
         'type': 'object',
-        'schema': 'http://json-schema.org/draft-07/schema#',
+        '$schema': 'http://json-schema.org/draft-07/schema#',
         'required': ['upper_range_ul', 'lower_range_ul', 'channels', 'compatible_with'],
         'properties': {
             'upper_range_ul': {'type': 'number'},
             'lower_range_ul': {'type': 'number'},
-            'channels': {'type': 'int'},
+            'channels': {'type': 'integer'},
             'compatible_with': {
                 'type': 'array',
                 'items': {
@@ -29,7 +29,7 @@ MODULE_SCHEMAS = {
     },
     "incubator": { 
         'type': 'object',
-        'schema': 'http://json-schema.org/draft-07/schema#',
+        '$schema': 'http://json-schema.org/draft-07/schema#',
         'required': ['temperature', 'shaking', 'fits'],
         'properties': {
            'temperature': {'type': 'number'},
@@ -45,7 +45,7 @@ MODULE_SCHEMAS = {
     },
     "magdeck": {
         'type': 'object',
-        'schema': 'http://json-schema.org/draft-07/schema#',
+        '$schema': 'http://json-schema.org/draft-07/schema#',
         'required': ['fits', 'compatible_with'],
         'properties': {
             'fits': {
@@ -66,13 +66,13 @@ MODULE_SCHEMAS = {
     },
     "tempdeck": {
         'type': 'object',
-        'schema': 'http://json-schema.org/draft-07/schema#',
+        '$schema': 'http://json-schema.org/draft-07/schema#',
         'required': ['upper_range_tm', 'lower_range_tm', 'default_tm', 'compatible_with', 'fits'],
         'properties': {
             'upper_range_tm': {'type': 'number'},
             'lower_range_tm': {'type': 'number'},
             'default_tm': {'type': 'number'},
-            'channels': {'type': 'int'},
+            'channels': {'type': 'integer'},
             'fits': {
                 'type': 'array',
                 'items': {
@@ -90,3 +90,76 @@ MODULE_SCHEMAS = {
         }
     }
 }
+
+
+# Factory plate import (a list of exported plates, see import_plates_task)
+
+PLATE_IMPORT_AUTHOR_SCHEMA = {
+    'type': 'object',
+    'required': ['uuid', 'name', 'email', 'affiliation', 'orcid', 'tags']
+}
+
+PLATE_IMPORT_PART_SCHEMA = {
+    'type': 'object',
+    'required': ['uuid', 'name', 'description', 'status', 'gene_id', 'part_type', 
+                 'genbank', 'original_sequence', 'optimized_sequence', 
+                 'synthesized_sequence', 'full_sequence', 'vector', 
+                 'primer_forward', 'primer_reverse', 'barcode', 
+                 'translation', 'tags', 'collections', 'author'],
+    'properties': {
+        'tags': {'type': 'array'},
+        'author': PLATE_IMPORT_AUTHOR_SCHEMA
+    }
+}
+
+PLATE_IMPORT_SAMPLE_SCHEMA = {
+    'type': 'object',
+    'required': ['uuid', 'outside_collaborator', 'sample_type', 'status',
+                 'evidence', 'vendor', 'part', 'index_forward', 'index_reverse',
+                 'derived_from'],
+    'properties': {
+        'part': PLATE_IMPORT_PART_SCHEMA,
+        'derived_from': {'type': 'array'}
+    }
+}
+
+PLATE_IMPORT_WELL_SCHEMA = {
+    'type': 'object',
+    'required': ['uuid', 'address', 'volume', 'quantity', 'media', 'organism', 'sample'],
+    'properties': {
+        'organism': {
+            'type': 'object',
+            'required': ['uuid', 'name', 'description', 'genotype']
+        },
+        'sample': PLATE_IMPORT_SAMPLE_SCHEMA
+    }
+}
+
+PLATE_IMPORT_SCHEMA = {
+    '$schema': 'http://json-schema.org/draft-07/schema#',
+    'type': 'array',
+    'items': {
+        'type': 'object',
+        'required': ['uuid', 'plate_type', 'plate_form', 'status', 'name', 
+                     'thaw_count', 'notes', 'height', 'length', 
+                     'wells', 'plate_vendor_id', 'plateset', 'distribution'],
+        'properties': {
+            'wells': {
+                'type': 'array',
+                'items': PLATE_IMPORT_WELL_SCHEMA
+            },
+            'plateset': {
+                'type': ['object', 'null'],
+                'required': ['uuid', 'description', 'name']
+            },
+            'distribution': {
+                'type': ['object', 'null'],
+                'required': ['uuid', 'name', 'description']
+            }
+        },
+
+        # Cannot import distribution without plateset
+        'if': {'properties': {'distribution': {'type': 'object'}}},
+        'then': {'properties': {'plateset': {'type': 'object'}}}
+    }
+}
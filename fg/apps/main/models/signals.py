@@ -11,14 +11,33 @@ with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
 from django.db.models import ProtectedError
 from django.dispatch import receiver
 from django.db.models.signals import (
+    m2m_changed,
+    post_delete,
     post_save,
     pre_delete
 )
 from fg.apps.main.models import (
+    Author,
+    Collection,
+    CompositePart,
+    Organism,
+    Part,
     Plate,
     Plan,
     Container,
-    Well
+    Sample,
+    Schema,
+    Tag,
+    Well,
+    WellContent
+)
+from fg.apps.main.statistics import (
+    STATISTICS_MODELS,
+    adjust_statistics
+)
+from fg.apps.main.versions import (
+    bump_instance_versions,
+    bump_versions
 )
  
 @receiver(pre_delete, sender=Plate, dispatch_uid='plate_pre_delete_signal')
@@ -53,3 +72,181 @@ def protect_plan(sender, instance, using, **kwargs):
     # Don't allow delete if plan is executed
     if instance.status == "Executed": 
         raise ProtectedError('An executed plan cannot be deleted.')
+
+
+# Statistics (see fg.apps.main.statistics) ####################################
+
+def count_created(sender, instance, created, **kwargs):
+    '''When an instance is created, add one to the count for the model.
+    '''
+    if created:
+        adjust_statistics(sender, 1)
+
+def count_deleted(sender, instance, **kwargs):
+    '''When an instance is deleted, subtract one from the count for the model.
+    '''
+    adjust_statistics(sender, -1)
+
+for name, Model in STATISTICS_MODELS.items():
+    post_save.connect(count_created, sender=Model, dispatch_uid='%s_save_statistics_signal' % name)
+    post_delete.connect(count_deleted, sender=Model, dispatch_uid='%s_delete_statistics_signal' % name)
+
+
+# Versions (see fg.apps.main.versions) ########################################
+
+def version_changed(sender, instance, **kwargs):
+    '''When an instance is saved or deleted, bump the version for the model.
+    '''
+    bump_versions([instance.__class__])
+
+def version_links_changed(sender, instance, action, model, **kwargs):
+    '''When links are added or removed, bump the versions for both models.
+    '''
+    if action.startswith('post'):
+        bump_versions([instance.__class__, model])
+
+for Model in list(STATISTICS_MODELS.values()) + [CompositePart, Schema, Well]:
+    name = Model._meta.model_name
+    post_save.connect(version_changed, sender=Model, dispatch_uid='%s_save_version_signal' % name)
+    post_delete.connect(version_changed, sender=Model, dispatch_uid='%s_delete_version_signal' % name)
+    for field in Model._meta.many_to_many:
+        m2m_changed.connect(version_links_changed, sender=field.remote_field.through,
+                            dispatch_uid='%s_%s_version_signal' %(name, field.name))
+
+
+# Lab Map (see Container.get_tree) #############################################
+
+@receiver(post_save, sender=Container, dispatch_uid='container_save_map_signal')
+@receiver(post_delete, sender=Container, dispatch_uid='container_delete_map_signal')
+@receiver(post_save, sender=Plate, dispatch_uid='plate_save_map_signal')
+@receiver(post_delete, sender=Plate, dispatch_uid='plate_delete_map_signal')
+def clear_lab_map(sender, instance, **kwargs):
+    '''When a container or plate is added, moved, renamed or deleted, the
+       cached lab map is cleared.
+    '''
+    Container.clear_tree()
+
+
+# Collection Rollups (see Collection.get_rollups) ##############################
+
+@receiver(post_save, sender=Collection, dispatch_uid='collection_save_rollups_signal')
+@receiver(post_delete, sender=Collection, dispatch_uid='collection_delete_rollups_signal')
+@receiver(m2m_changed, sender=Part.collections.through, dispatch_uid='part_collections_rollups_signal')
+def clear_collection_rollups(sender, instance, **kwargs):
+    '''When a collection is added, moved or deleted, or parts are added
+       to (or removed from) collections, the cached rollups are cleared.
+    '''
+    if kwargs.get('action', 'post').startswith('post'):
+        Collection.clear_rollups()
+
+
+# Tag Statistics (see Tag.get_statistics) #####################################
+
+@receiver(m2m_changed, sender=Author.tags.through, dispatch_uid='author_tags_statistics_signal')
+@receiver(m2m_changed, sender=Organism.tags.through, dispatch_uid='organism_tags_statistics_signal')
+@receiver(m2m_changed, sender=Collection.tags.through, dispatch_uid='collection_tags_statistics_signal')
+@receiver(m2m_changed, sender=Part.tags.through, dispatch_uid='part_tags_statistics_signal')
+@receiver(post_delete, sender=Author, dispatch_uid='author_delete_statistics_signal')
+@receiver(post_delete, sender=Organism, dispatch_uid='organism_delete_statistics_signal')
+@receiver(post_delete, sender=Collection, dispatch_uid='collection_delete_statistics_signal')
+@receiver(post_delete, sender=Part, dispatch_uid='part_delete_statistics_signal')
+@receiver(post_delete, sender=Tag, dispatch_uid='tag_delete_statistics_signal')
+def clear_tag_statistics(sender, instance, **kwargs):
+    '''When tags are added to (or removed from) an author, organism,
+       collection or part, or a tagged instance is deleted, the cached
+       tag statistics are cleared.
+    '''
+    if kwargs.get('action', 'post').startswith('post'):
+        Tag.clear_statistics()
+
+
+# Well Contents (see WellContent) ##############################################
+
+@receiver(m2m_changed, sender=Plate.wells.through, dispatch_uid='plate_wells_contents_signal')
+def plate_wells_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    '''When wells are added to (or removed from) a plate, refresh the plate
+       contents. When reversed, the instance is a well and pk_set are plates.
+    '''
+    if action == "pre_clear" and reverse:
+        instance._content_plates = list(instance.plate_wells.values_list('uuid', flat=True))
+
+    elif action in ["post_add", "post_remove"]:
+        WellContent.refresh(pk_set if reverse else [instance])
+
+    elif action == "post_clear":
+        WellContent.refresh(getattr(instance, '_content_plates', []) if reverse else [instance])
+
+
+@receiver(m2m_changed, sender=Sample.wells.through, dispatch_uid='sample_wells_contents_signal')
+def sample_wells_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    '''When a sample is added to (or removed from) wells, refresh the plates
+       with the wells. When reversed, the instance is a well.
+    '''
+    if action == "pre_clear" and not reverse:
+        instance._content_wells = list(instance.wells.values_list('uuid', flat=True))
+
+    elif action in ["post_add", "post_remove"]:
+        WellContent.refresh_wells([instance] if reverse else pk_set)
+
+    elif action == "post_clear":
+        WellContent.refresh_wells([instance] if reverse else getattr(instance, '_content_wells', []))
+
+
+@receiver(post_save, sender=Sample, dispatch_uid='sample_contents_signal')
+def sample_saved(sender, instance, created, **kwargs):
+    '''A new sample has no wells yet, but a changed sample (e.g., the part or
+       evidence) is updated for wells that include it.
+    '''
+    if not created and WellContent.objects.filter(sample=instance).exists():
+        WellContent.refresh_wells(instance.wells.all())
+
+
+@receiver(pre_delete, sender=Sample, dispatch_uid='sample_delete_contents_signal')
+def sample_deleted(sender, instance, **kwargs):
+    '''The wells for a sample are cleared on delete, so we keep them to 
+       refresh the plates (another sample may be in the well) after.
+    '''
+    instance._content_wells = list(instance.wells.values_list('uuid', flat=True))
+
+
+@receiver(post_delete, sender=Sample, dispatch_uid='sample_post_delete_contents_signal')
+def sample_post_deleted(sender, instance, **kwargs):
+    '''refresh the plates with wells that included the deleted sample.
+    '''
+    WellContent.refresh_wells(getattr(instance, '_content_wells', []))
+
+
+@receiver(post_save, sender=Part, dispatch_uid='part_contents_signal')
+def part_saved(sender, instance, created, **kwargs):
+    '''The gene_id for a part is kept with the contents (and plate maps).
+    '''
+    if not created:
+        contents = WellContent.objects.filter(part=instance).exclude(gene_id=instance.gene_id)
+        plates = set(contents.values_list('plate_id', flat=True))
+        if plates:
+            contents.update(gene_id=instance.gene_id)
+            bump_instance_versions(Plate, plates)
+
+
+@receiver(post_save, sender=Well, dispatch_uid='well_contents_signal')
+def well_saved(sender, instance, created, **kwargs):
+    '''The address (and row and column) is kept with the contents, and
+       the volume and media are shown in plate maps.
+    '''
+    if not created:
+        contents = list(WellContent.objects.filter(well=instance).values_list('plate_id', 'address'))
+        if any(address != instance.address for _, address in contents):
+            WellContent.refresh_wells([instance])
+        else:
+            bump_instance_versions(Plate, [plate_id for plate_id, _ in contents])
+
+
+# Plate Maps (see Plate.get_map) ###############################################
+
+@receiver(post_save, sender=Plate, dispatch_uid='plate_save_version_signal')
+@receiver(post_delete, sender=Plate, dispatch_uid='plate_delete_version_signal')
+def plate_changed(sender, instance, **kwargs):
+    '''When a plate is saved (e.g., renamed or resized) or deleted, its map
+       is out of date.
+    '''
+    bump_instance_versions(Plate, [instance.uuid])
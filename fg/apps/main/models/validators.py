@@ -8,10 +8,15 @@ with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
 '''
 
-from jsonschema import validate
+from jsonschema.validators import validator_for
 from django.core.validators import BaseValidator
+from functools import lru_cache
+import json
 import re
 
+# The number of compiled json schema validators to keep (most recently used)
+JSON_VALIDATORS_MAX = 128
+
 def validate_direction_string(value):
     '''a direction string can only have < and > characters.
     '''
@@ -33,6 +38,63 @@ def validate_name(value):
         return False
     return True
 
+
+# JSON Schema
+
+def get_json_validator(schema):
+    '''return a compiled validator for a schema. The schema itself is checked
+       (raising jsonschema.SchemaError if invalid) only the first time it is
+       seen, and the validator is cached (by the schema) for reuse.
+    '''
+    return compile_json_validator(json.dumps(schema, sort_keys=True))
+
+
+@lru_cache(maxsize=JSON_VALIDATORS_MAX)
+def compile_json_validator(schema):
+    '''check and compile a validator for a schema, given as a json string
+       (so it can be a cache key).
+    '''
+    schema = json.loads(schema)
+    cls = validator_for(schema)
+    cls.check_schema(schema)
+    return cls(schema)
+
+
+def format_json_errors(errors):
+    '''return a list of messages for jsonschema errors, sorted by and prefixed
+       with the path to the invalid entry (e.g., 0/wells/1/sample).
+    '''
+    messages = []
+    for error in sorted(errors, key=lambda e: list(map(str, e.path))):
+        path = "/".join([str(x) for x in error.path]) or "root"
+        messages.append("%s: %s" %(path, error.message))
+    return messages
+
+
+def get_json_errors(instance, schema):
+    '''validate an instance against a schema, and return a list of all
+       errors found (empty if valid).
+    '''
+    return format_json_errors(get_json_validator(schema).iter_errors(instance))
+
+
 def validate_json_schema(instance, schema):
-    return validate(instance=instance, schema=schema)
+    '''validate an instance against a schema, raising a
+       jsonschema.ValidationError for the first error.
+    '''
+    return get_json_validator(schema).validate(instance)
+
+
+def validate_json_many(instances, schema):
+    '''validate a list of instances against the same schema. The validator
+       is compiled once, and we return a dictionary of errors for invalid
+       instances, keyed by the index in the list.
+    '''
+    validator = get_json_validator(schema)
+    invalid = {}
+    for index, instance in enumerate(instances):
+        errors = list(validator.iter_errors(instance))
+        if errors:
+            invalid[index] = format_json_errors(errors)
+    return invalid
 
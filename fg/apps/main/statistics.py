@@ -0,0 +1,154 @@
+'''
+
+Copyright (C) 2019 Vanessa Sochat.
+
+This Source Code Form is subject to the terms of the
+Mozilla Public License, v. 2.0. If a copy of the MPL was not distributed
+with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+A statistics snapshot keeps the number of instances for each model (shown
+in the dashboard) in the cache, one key per model. Signals adjust a count
+when an instance is created or deleted, a periodic job (recompute_statistics)
+corrects any drift, and a missing count is computed when it is requested.
+
+'''
+
+from django.core.cache import cache
+from django.db import connection
+from fg.apps.main.models import (
+    Author,
+    Container,
+    Collection,
+    Distribution,
+    Institution,
+    Module,
+    Operation,
+    Organism,
+    Part,
+    Plan,
+    Plate,
+    PlateSet,
+    Protocol,
+    Robot,
+    Sample,
+    Tag
+)
+from fg.settings import (
+    STATISTICS_CACHE_TIMEOUT,
+    STATISTICS_ESTIMATE_ROWS
+)
+
+from collections import OrderedDict
+
+# Models counted for the snapshot, by name
+STATISTICS_MODELS = OrderedDict([
+    ("authors", Author),
+    ("containers", Container),
+    ("collections", Collection),
+    ("distributions", Distribution),
+    ("institutions", Institution),
+    ("modules", Module),
+    ("operations", Operation),
+    ("organisms", Organism),
+    ("plans", Plan),
+    ("platesets", PlateSet),
+    ("robots", Robot),
+    ("protocols", Protocol),
+    ("parts", Part),
+    ("samples", Sample),
+    ("plates", Plate),
+    ("tags", Tag)
+])
+
+
+def get_statistics_key(name):
+    return "statistics:%s" % name
+
+
+def get_model_name(Model):
+    '''return the name of a model in the snapshot, or None if not counted
+    '''
+    for name, Counted in STATISTICS_MODELS.items():
+        if Counted == Model:
+            return name
+
+
+def get_estimates():
+    '''return the postgres planner estimate (reltuples, updated by vacuum and
+       analyze) of the number of rows for each model, by name. This is
+       a single query on pg_class, and empty for other databases.
+    '''
+    if connection.vendor != 'postgresql':
+        return {}
+
+    tables = {Model._meta.db_table: name for name, Model in STATISTICS_MODELS.items()}
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT relname, reltuples FROM pg_class WHERE relkind = 'r' AND relname IN %s",
+                       [tuple(tables)])
+        return {tables[relname]: int(reltuples) for relname, reltuples in cursor.fetchall()}
+
+
+def compute_statistics(names=None):
+    '''count instances for a list of models (by name, all if not provided) and
+       save the counts to the cache. Models with more rows than 
+       STATISTICS_ESTIMATE_ROWS (by planner estimate) use the estimate,
+       and the rest are counted exactly in one query.
+    '''
+    names = list(names or STATISTICS_MODELS)
+    counts = {}
+
+    if STATISTICS_ESTIMATE_ROWS:
+        for name, estimate in get_estimates().items():
+            if name in names and estimate > STATISTICS_ESTIMATE_ROWS:
+                counts[name] = estimate
+
+    exact = [name for name in names if name not in counts]
+    if exact:
+        tables = [connection.ops.quote_name(STATISTICS_MODELS[name]._meta.db_table) for name in exact]
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT %s" % ", ".join(["(SELECT COUNT(*) FROM %s)" % table for table in tables]))
+            counts.update(zip(exact, cursor.fetchone()))
+
+    cache.set_many({get_statistics_key(name): count for name, count in counts.items()},
+                   STATISTICS_CACHE_TIMEOUT)
+    return counts
+
+
+def get_statistics():
+    '''return the snapshot of counts for all models, by name. Counts that are
+       not in the cache are computed (and saved).
+    '''
+    keys = {get_statistics_key(name): name for name in STATISTICS_MODELS}
+    counts = {keys[key]: count for key, count in cache.get_many(keys.keys()).items()}
+    missing = [name for name in STATISTICS_MODELS if name not in counts]
+    if missing:
+        counts.update(compute_statistics(missing))
+    return OrderedDict([(name, counts[name]) for name in STATISTICS_MODELS])
+
+
+def adjust_statistics(Model, delta):
+    '''adjust the count for a model, e.g., when an instance is created (1) or
+       deleted (-1). If the count is not in the cache, it will be computed
+       the next time it is needed.
+    '''
+    name = get_model_name(Model)
+    if name is not None:
+        try:
+            cache.incr(get_statistics_key(name), delta)
+        except ValueError:
+            pass
+
+
+def reset_statistics(models=None):
+    '''remove the counts for a list of models (all if not provided), e.g.,
+       after a bulk insert that doesn't send signals.
+    '''
+    names = [get_model_name(Model) for Model in models] if models else STATISTICS_MODELS
+    cache.delete_many([get_statistics_key(name) for name in names if name is not None])
+
+
+def recompute_statistics():
+    '''recompute_statistics is a task intended to be run by django_rq, to
+       correct any drift in the counts.
+    '''
+    return compute_statistics()
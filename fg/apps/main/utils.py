@@ -9,6 +9,8 @@ with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
 '''
 
 from django.core.management import call_command
+from django.db import connection
+from contextlib import contextmanager
 import django_rq
 import hashlib
 import json
@@ -47,17 +49,17 @@ def backup_db():
 
 
 def generate_sha256(content):
-    '''Generate a sha256 hex digest for a string or dictionary. If it's a 
-       dictionary, we dump as a string (with sorted keys) and encode for utf-8.
+    '''Generate a sha256 hex digest for a string or dictionary. If it's not a 
+       string, we dump as a string (with sorted keys) and encode for utf-8.
        The intended use is for a Schema Hash
 
        Parameters
        ==========
-       content: a string or dict to be hashed.
+       content: a string, dict, or other json serializable content to hash.
     '''
-    if isinstance(content, dict):
-        content = json.dumps(content, sort_keys=True).encode('utf-8')
-    return "sha256:%s" % hashlib.sha256().hexdigest()
+    if not isinstance(content, str):
+        content = json.dumps(content, sort_keys=True)
+    return "sha256:%s" % hashlib.sha256(content.encode('utf-8')).hexdigest()
 
 
 def save_json(input_dict, output_file):
@@ -84,3 +86,24 @@ def load_json(input_file):
         content = json.loads(filey.read())
     return content
 
+
+@contextmanager
+def capture_queries(using=connection):
+    '''record the queries run on a connection in a block, as a list of
+       dictionaries with sql and params. This uses an execute wrapper, so
+       (unlike connection.queries) it doesn't need DEBUG and isn't limited
+       to the last 9000 queries. Queries that are not run with execute (e.g.,
+       a COPY with copy_expert) are not included.
+
+       with capture_queries() as queries:
+           ...
+       print(len(queries))
+    '''
+    queries = []
+
+    def record(execute, sql, params, many, context):
+        queries.append({"sql": sql, "params": params, "many": many})
+        return execute(sql, params, many, context)
+
+    with using.execute_wrapper(record):
+        yield queries
@@ -0,0 +1,98 @@
+'''
+
+Copyright (C) 2019 Vanessa Sochat.
+
+This Source Code Form is subject to the terms of the
+Mozilla Public License, v. 2.0. If a copy of the MPL was not distributed
+with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+A version stamp for each model is kept in the cache, and changed (bumped)
+by signals when an instance is saved or deleted, or its links change, and
+by the bulk helpers (which skip signals). A single instance (e.g., a plate
+for its map) can also have a version, bumped when what it shows changes.
+Cached responses and fragments include the versions for the models they
+show in their keys, so they are out of date as soon as one changes without
+tracking each key. A version is the time it was bumped with a random token,
+so a stamp that is evicted from the cache is never reused.
+
+'''
+
+from django.core.cache import cache
+from django.db import transaction
+
+import time
+import uuid
+
+
+def get_version_key(Model, pk=None):
+    if pk is not None:
+        return "version:%s:%s" %(Model._meta.label_lower, pk)
+    return "version:%s" % Model._meta.label_lower
+
+
+def new_version():
+    '''return a new version, a tuple of (timestamp, token)
+    '''
+    return (time.time(), uuid.uuid4().hex)
+
+
+def get_versions(models):
+    '''return the versions for a list of models, by model label. A version
+       that is missing (never bumped or evicted) is added.
+    '''
+    keys = {get_version_key(Model): Model._meta.label_lower for Model in models}
+    versions = cache.get_many(keys.keys())
+    for key in set(keys).difference(versions):
+        cache.add(key, new_version(), None)
+        versions[key] = cache.get(key) or new_version()
+    return {keys[key]: version for key, version in versions.items()}
+
+
+def get_stamp(models):
+    '''return a single string for the versions of a list of models, for use
+       in a cache key or ETag, and the time of the last change.
+    '''
+    versions = get_versions(models)
+    stamp = "-".join("%s:%s" %(label, versions[label][1]) for label in sorted(versions))
+    return stamp, max(version[0] for version in versions.values())
+
+
+def get_instance_version(Model, pk):
+    '''return the version (timestamp, token) for a single instance, by primary
+       key, adding it if missing.
+    '''
+    key = get_version_key(Model, pk)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, new_version(), None)
+        version = cache.get(key) or new_version()
+    return version
+
+
+def bump_versions(models):
+    '''change the versions for a list of models, done when instances are
+       saved or deleted.
+    '''
+    bump_keys([get_version_key(Model) for Model in models])
+
+
+def bump_instance_versions(Model, pks):
+    '''change the versions for a list of instances (by primary key)
+    '''
+    bump_keys([get_version_key(Model, pk) for pk in pks])
+
+
+def bump_keys(keys):
+    '''set a new version for each of a list of keys. In a transaction, the
+       versions are changed again on commit, so a response cached before
+       then (with the old data) isn't kept.
+    '''
+    if not keys:
+        return
+
+    def bump():
+        cache.set_many({key: new_version() for key in keys}, None)
+
+    bump()
+    if transaction.get_connection().in_atomic_block:
+        transaction.on_commit(bump)
@@ -9,11 +9,13 @@ with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
 '''
 
 from django.core.paginator import Paginator
+from django.db.models import Count
 from django.shortcuts import render 
 from django.http import Http404
 from ratelimit.decorators import ratelimit
 
 from fg.apps.main.models import (
+    Author,
     Container,
     Collection,
     Distribution,
@@ -22,10 +24,13 @@ from fg.apps.main.models import (
     Plate,
     PlateSet,
     Sample,
-    Tag
+    Tag,
+    WellContent
 )
+from fg.apps.main.versions import get_stamp
 
 from fg.settings import (
+    CATALOG_CACHE_TIMEOUT,
     VIEW_RATE_LIMIT as rl_rate, 
     VIEW_RATE_LIMIT_BLOCK as rl_block
 )
@@ -34,33 +39,64 @@ import os
 
 ## Catalogs
 
+def get_catalog_context(models, **context):
+    '''return the context for a catalog page, with the stamp (the versions
+       of the models shown) and timeout to cache the table. A value for the
+       table should be a function, so it's only called (by the template) when
+       the table isn't cached.
+    '''
+    context["stamp"], _ = get_stamp(models)
+    context["cache_timeout"] = CATALOG_CACHE_TIMEOUT
+    return context
+
+
 @ratelimit(key='ip', rate=rl_rate, block=rl_block)
 def catalog_view(request):
     return render(request, "catalogs/catalog.html")
 
 @ratelimit(key='ip', rate=rl_rate, block=rl_block)
 def collections_catalog_view(request):
-    context = {"collections": Collection.objects.all()}
+    def get_collections():
+        collections = list(Collection.objects.select_related('parent').prefetch_related('tags'))
+        Collection.set_rollups(collections)
+        return collections
+    context = get_catalog_context([Collection, Part, Tag], collections=get_collections)
     return render(request, "catalogs/collections.html", context=context)
 
 @ratelimit(key='ip', rate=rl_rate, block=rl_block)
 def containers_catalog_view(request):
-    context = {"containers": Container.objects.all()}
+    context = get_catalog_context([Container], 
+                                  containers=lambda: Container.objects.select_related('parent'))
     return render(request, "catalogs/containers.html", context=context)
 
 @ratelimit(key='ip', rate=rl_rate, block=rl_block)
 def organisms_catalog_view(request):
-    context = {"organisms": Organism.objects.all()}
+    context = get_catalog_context([Organism, Tag],
+                                  organisms=lambda: Organism.objects.prefetch_related('tags'))
     return render(request, "catalogs/organisms.html", context=context)
 
 @ratelimit(key='ip', rate=rl_rate, block=rl_block)
 def platesets_catalog_view(request):
-    context = {"platesets": PlateSet.objects.all()}
+    platesets = lambda: (PlateSet.objects.annotate(plates_count=Count('plates'))
+                                         .prefetch_related('distribution_plateset'))
+    context = get_catalog_context([PlateSet, Plate, Distribution], platesets=platesets)
     return render(request, "catalogs/platesets.html", context=context)
 
 @ratelimit(key='ip', rate=rl_rate, block=rl_block)
 def distributions_catalog_view(request):        
-    context = {"distributions": Distribution.objects.all()}
+    def get_distributions():
+        distributions = list(Distribution.objects.prefetch_related('platesets'))
+        Distribution.set_unique_parts(distributions)
+        return distributions
+
+    # The table shows if each distribution is in the user's cart
+    cart = []
+    if request.user.is_authenticated:
+        cart = request.user.get_cart_items()
+    context = get_catalog_context([Distribution, PlateSet, WellContent], 
+                                  distributions=get_distributions,
+                                  cart=cart,
+                                  cart_key=",".join(sorted(str(item.uuid) for item in cart)))
     return render(request, "catalogs/distributions.html", context=context)
 
 @ratelimit(key='ip', rate=rl_rate, block=rl_block)
@@ -68,8 +104,13 @@ def tags_catalog_view(request, selection=None):
     '''if selection is defined, the user wants to jump directly to one of
        the tabbed sections.
     '''
-    context = {"tags": Tag.objects.all(), 
-              "selection": selection}
+    def get_tags():
+        tags = list(Tag.objects.all())
+        Tag.set_statistics(tags)
+        return tags
+    context = get_catalog_context([Tag, Author, Collection, Organism, Part], 
+                                  tags=get_tags,
+                                  selection=selection)
     return render(request, "catalogs/tags.html", context=context)
 
 
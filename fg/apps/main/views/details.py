@@ -30,7 +30,8 @@ from fg.apps.main.models import (
     Robot,
     Sample,
     Schema,
-    Tag
+    Tag,
+    PLATE_MAP_FIELDS
 )
 
 from fg.settings import (
@@ -65,7 +66,18 @@ def container_details(request, uuid):
 
 @ratelimit(key='ip', rate=rl_rate, block=rl_block)
 def collection_details(request, uuid):
-    return get_instance(request, uuid, Collection)
+    '''the collection details include rollups (part counts including all
+       subcollections) for the collection and its direct subcollections.
+    '''
+    try:
+        instance = Collection.objects.select_related('parent').get(uuid=uuid)
+    except Collection.DoesNotExist:
+        raise Http404
+
+    subcollections = list(instance.collection_set.order_by('name'))
+    Collection.set_rollups([instance] + subcollections)
+    context = {'instance': instance, 'subcollections': subcollections}
+    return render(request, 'details/collection_details.html', context=context)
 
 @ratelimit(key='ip', rate=rl_rate, block=rl_block)
 def distribution_details(request, uuid):
@@ -82,8 +94,17 @@ def module_details(request, uuid):
 
 @ratelimit(key='ip', rate=rl_rate, block=rl_block)
 def operation_details(request, uuid):
+    '''the operation details show the plan tree, with the items for each
+       plan loaded in a fixed number of queries (see Operation.get_plan_tree)
+    '''
     # likely will require admin/staff
-    return get_instance(request, uuid, Operation)
+    try:
+        instance = Operation.objects.get(uuid=uuid)
+    except Operation.DoesNotExist:
+        raise Http404
+
+    context = {'instance': instance, 'plans': instance.get_plan_tree()}
+    return render(request, 'details/operation_details.html', context=context)
 
 @ratelimit(key='ip', rate=rl_rate, block=rl_block)
 def organism_details(request, uuid):
@@ -95,11 +116,34 @@ def part_details(request, uuid):
 
 @ratelimit(key='ip', rate=rl_rate, block=rl_block)
 def plan_details(request, uuid):
-    return get_instance(request, uuid, Plan)
+    '''the plan details show the items and child plans (at any depth),
+       loaded in a fixed number of queries (see Plan.get_tree)
+    '''
+    try:
+        instance = Plan.objects.select_related('parent', 'operation').get(uuid=uuid)
+    except Plan.DoesNotExist:
+        raise Http404
+
+    context = {'instance': instance.get_tree(), 'plans': instance.children}
+    return render(request, 'details/plan_details.html', context=context)
 
 @ratelimit(key='ip', rate=rl_rate, block=rl_block)
 def plate_details(request, uuid):
-    return get_instance(request, uuid, Plate)
+    '''the plate details include the plate map (see Plate.get_map), shown
+       as a grid with a list of wells for each row.
+    '''
+    try:
+        instance = Plate.objects.get(uuid=uuid)
+    except Plate.DoesNotExist:
+        raise Http404
+
+    plate_map = Plate.get_map(instance.uuid)
+    columns = plate_map['columns']
+    grid = [[{name: plate_map[name][index] for name in PLATE_MAP_FIELDS}
+             for index in range(row * columns, (row + 1) * columns)]
+            for row in range(plate_map['rows'])]
+    context = {'instance': instance, 'grid': grid, 'columns': range(1, columns + 1)}
+    return render(request, 'details/plate_details.html', context=context)
 
 @ratelimit(key='ip', rate=rl_rate, block=rl_block)
 def plateset_details(request, uuid):
@@ -123,4 +167,28 @@ def schema_details(request, uuid):
 
 @ratelimit(key='ip', rate=rl_rate, block=rl_block)
 def tag_details(request, uuid):
-    return get_instance(request, uuid, Tag)
+    '''the tag details show tables for each of the tagged models. We only
+       query for models that have the tag (see Tag.statistics), with the
+       tags (and collection rollups) for each table looked up once.
+    '''
+    try:
+        instance = Tag.objects.get(uuid=uuid)
+    except Tag.DoesNotExist:
+        raise Http404
+
+    context = {'instance': instance, 'authors': [], 'collections': [],
+               'organisms': [], 'parts': []}
+
+    statistics = instance.statistics
+    if statistics['authors'] > 0:
+        context['authors'] = instance.author_tags.prefetch_related('tags')
+    if statistics['organisms'] > 0:
+        context['organisms'] = instance.organism_tags.prefetch_related('tags')
+    if statistics['parts'] > 0:
+        context['parts'] = instance.part_tags.select_related('author').prefetch_related('tags')
+    if statistics['collections'] > 0:
+        context['collections'] = list(instance.collection_tags.select_related('parent')
+                                                              .prefetch_related('tags'))
+        Collection.set_rollups(context['collections'])
+
+    return render(request, 'details/tag_details.html', context=context)
@@ -22,7 +22,8 @@ from fg.apps.main.models import (
     Distribution,
     Plate,
     PlateSet,
-    Sample
+    Sample,
+    WellContent
 )
 
 from fg.settings import (
@@ -31,6 +32,7 @@ from fg.settings import (
 )
 
 from datetime import datetime
+from itertools import chain
 import json
 import os
 import csv
@@ -97,26 +99,31 @@ def generate_plate_csv(plates, filename, content_type='text/csv'):
 
     for plate in plates:
  
-        # Add each well to the csv
-        for well in plate.wells.all():
+        # Add each well to the csv, the contents include the sample and part
+        contents = WellContent.objects.filter(plate=plate).select_related(
+                       'well', 'sample', 'part__author').order_by('row', 'column', 'address')
 
-            # We get the part via the associated sample
-            sample = well.sample_wells.first()
-            part_description = sample.part.description or "" # can be None
+        for content in contents:
+            well = content.well
+
+            # Wells without a sample (or part) have empty fields
+            sample = content.sample
+            part = content.part
+            part_description = (part.description or "") if part else "" # can be None
             writer.writerow([plate.name,
                              plate.plate_type,
                              plate.plate_form,
                              well.address,
                              well.media,
                              well.volume,
-                             sample.part.name,
-                             sample.part.gene_id,
-                             sample.evidence,
-                             sample.status,
-                             sample.part.full_sequence,
-                             sample.part.optimized_sequence,
+                             part.name if part else "",
+                             content.gene_id or "",
+                             content.evidence or "",
+                             sample.status if sample else "",
+                             part.full_sequence if part else "",
+                             part.optimized_sequence if part else "",
                              part_description.replace(',', ' '),
-                             sample.part.author.name])
+                             part.author.name if part else ""])
 
     return response
 
@@ -227,31 +234,42 @@ def generate_plate_json(plates, distribution=None, plateset=None):
             dist = DistributionSerializer(distribution).data
             dist['platesets'] = []
 
-        # Add each well to the csv
-        for well in plate.wells.all():
+        # Add each well, the contents include the sample and part
+        contents = WellContent.objects.filter(plate=plate).select_related(
+                       'well__organism', 'sample', 'part__author').prefetch_related(
+                       'sample__wells', 'part__tags', 'part__collections', 
+                       'part__author__tags').order_by('row', 'column', 'address')
+
+        # Samples derived from (at any depth) are looked up once for the plate
+        lineage = Sample.get_ancestors([c.sample_id for c in contents if c.sample_id])
+        ancestors = set(chain(*lineage.values()))
+        ancestors = {str(sample.uuid): sample for sample in 
+                     Sample.objects.filter(uuid__in=ancestors).prefetch_related('wells')}
+
+        for content in contents:
+            well = content.well
+
+            # A well can only be imported with a sample
+            if content.sample is None or content.part is None:
+                continue
 
-            # We get the part via the associated sample
-            sample = well.sample_wells.first()
-            author_tags = [TagSerializer(t).data for t in sample.part.author.tags.all()]
-            author = AuthorSerializer(sample.part.author).data
+            author_tags = [TagSerializer(t).data for t in content.part.author.tags.all()]
+            author = AuthorSerializer(content.part.author).data
             author['tags'] = author_tags
-            tags = [TagSerializer(t).data for t in sample.part.tags.all()]
-            part = PartSerializer(sample.part).data
-            sample = SampleSerializer(sample).data
+            tags = [TagSerializer(t).data for t in content.part.tags.all()]
+            part = PartSerializer(content.part).data
+            sample = SampleSerializer(content.sample).data
             
             # Remove reverse relationship of Sample.wells
             del sample['wells']
  
-            # Create recursive loop of death to get list of all samples derived from
-            derived_from = sample['derived_from']
+            # The list of all samples derived from, nearest first
             derived_froms = None
-            if derived_from is not None:
+            if sample['derived_from'] is not None:
                 derived_froms = []
-                while derived_from is not None:
-                    next_sample = Sample.objects.get(uuid=derived_from)
-                    next_sample = SampleSerializer(next_sample).data
+                for ancestor in lineage[str(content.sample_id)]:
+                    next_sample = SampleSerializer(ancestors[ancestor]).data
                     next_sample['part'] = str(next_sample['part'])
-                    derived_from = next_sample['derived_from']
                     next_sample['derived_from'] = None
                     del next_sample['wells']
                     derived_froms.append(next_sample)
@@ -51,7 +51,10 @@ def tag_authors_details(request, uuid):
 @ratelimit(key='ip', rate=rl_rate, block=rl_block)
 def tag_collections_details(request, uuid):
     tag = get_tag(uuid)
-    context = {"collections": Collection.objects.filter(tags=tag),
+    collections = list(Collection.objects.filter(tags=tag).select_related('parent')
+                                                        .prefetch_related('tags'))
+    Collection.set_rollups(collections)
+    context = {"collections": collections,
                "title": "Collections",
                "description": "Collections with Tag %s" % tag.tag}
     return render(request, "catalogs/collections.html", context=context)
@@ -184,3 +184,6 @@ class Order(models.Model):
 
     class Meta:
         app_label = 'orders'
+        indexes = [
+            models.Index(fields=['user', 'status'])
+        ]
@@ -9,16 +9,11 @@ with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
 '''
 
 from django import template
-from fg.apps.orders.models import Order
 
 register = template.Library()
 
 @register.filter
 def cart_item_count(user):
     if user.is_authenticated:
-        try:
-            cart = Order.objects.get(user=user, status="Cart")
-        except Order.DoesNotExist:
-            return 0
-        return cart.distributions.count()
-
+        return user.get_cart_item_count()
+    return 0
@@ -75,6 +75,7 @@ def remove_from_cart(request, uuid):
             # Remove the cart order if it's empty, they can re-generate
             if order.distributions.count() == 0:
                 order.delete()
+            request.user.clear_cart()
         else:
             messages.info(request, "This distribution was not in your cart.")
         return redirect('orders')
@@ -102,6 +103,7 @@ def add_to_cart(request, uuid):
             messages.info(request, "This distribution is already in your cart.")
         else:
             order.distributions.add(distribution)
+            request.user.clear_cart()
             messages.info(request, "This distribution was added to your cart.")
         return redirect('orders')
 
@@ -112,6 +114,7 @@ def add_to_cart(request, uuid):
                                      name=distribution.name)
         order.distributions.add(distribution)
         order.save()
+        request.user.clear_cart()
         messages.info(request, "This item was added to your cart.")
         return redirect('orders')
 
@@ -143,6 +146,7 @@ def submit_order(request, uuid):
     # We can only get here when the user has uploaded the MTA
     order.status = 'Awaiting Countersign'
     order.save()   
+    request.user.clear_cart()
     return JsonResponse({"message": "Your order has been submit.",
                          "code": "success"})
 
@@ -235,6 +239,7 @@ class CheckoutView(View):
                 order.lab_address = lab_address
                 order.shipping_address = shipping_address
                 order.save()
+                self.request.user.clear_cart()
 
                 # Send email to lab with link to order
                 comments = (self.request.POST.get('lab_comments', '') + 
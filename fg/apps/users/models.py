@@ -17,6 +17,7 @@ from django.db.models.signals import post_save
 from django.dispatch import receiver
 
 from django.db import models
+from django.db.models import Count
 
 from rest_framework.authtoken.models import Token
 from fg.apps.users.utils import get_usertoken
@@ -79,21 +80,37 @@ class User(AbstractUser):
     def get_cart(self):
         '''Get a user's cart (an order that is not yet submit). A user
            is only allowed one order with this status and their association.
+           The cart (with its item_count) is looked up once for the user
+           instance, and request.user is the same instance for a request,
+           so templates and views share it.
         '''
-        for order in self.order_set.all():
-            if order.status == "Cart":
-                return order
+        if not hasattr(self, '_cart'):
+            self._cart = (self.order_set.filter(status="Cart")
+                                        .annotate(item_count=Count('distributions'))
+                                        .order_by('time_created').first())
+        return self._cart
+
+    def get_cart_item_count(self):
+        '''the number of distributions in the user's cart (0 if no cart)
+        '''
+        cart = self.get_cart()
+        return cart.item_count if cart else 0
 
     def get_cart_items(self):
         '''get distribution items in a user's active cart. Useful for views
            to render a button as disabled or active depending on finding/not
            finding the distribution.
         '''
-        distributions = []
-        cart = self.get_cart()
-        if cart:
-            return cart.distributions.all()
-        return distributions
+        if not hasattr(self, '_cart_items'):
+            cart = self.get_cart()
+            self._cart_items = list(cart.distributions.all()) if cart else []
+        return self._cart_items
+
+    def clear_cart(self):
+        '''forget the cart looked up for the user, after it's changed
+        '''
+        self.__dict__.pop('_cart', None)
+        self.__dict__.pop('_cart_items', None)
 
 
     # Ensure that we can add staff / superuser and retain on logout
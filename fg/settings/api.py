@@ -15,7 +15,7 @@ REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.IsAuthenticated',
     ),
-    'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.LimitOffsetPagination',
+    'DEFAULT_PAGINATION_CLASS': 'fg.apps.api.urls.pagination.LimitOffsetPagination',
     'DEFAULT_AUTHENTICATION_CLASSES': (
         'rest_framework.authentication.SessionAuthentication',
         'rest_framework.authentication.TokenAuthentication',
@@ -35,3 +35,12 @@ REST_FRAMEWORK = {
 }
 
 API_VERSION = "v1"
+
+# The maximum number of samples for one request to /api/samples/lineages/
+SAMPLE_LINEAGE_MAX = 1000
+
+# The maximum number of items for one request to a bulk endpoint (e.g., /api/parts/bulk/)
+API_BULK_MAX = 5000
+
+# The number of instances read (and serialized) at once for a dump (e.g., /api/parts/dump/)
+API_DUMP_CHUNK_SIZE = 2000
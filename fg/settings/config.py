@@ -65,6 +65,45 @@ NODE_TWITTER = "biobricks"
 DEFAULT_PLATE_HEIGHT=16
 DEFAULT_PLATE_LENGTH=24
 
+# Caching
+
+# Seconds to cache the lab map (container and plate tree). The map is also
+# cleared when containers or plates change, this is an upper bound.
+LAB_MAP_CACHE_TIMEOUT=300
+
+# Seconds to cache a plate map (the grid of well contents). Maps are cached
+# for each version of a plate, which changes with its contents.
+PLATE_MAP_CACHE_TIMEOUT=86400
+
+# Seconds to cache the table for a catalog page (e.g., collections). Tables
+# are cached for the versions of the models they show, so a change is seen
+# right away, this is an upper bound.
+CATALOG_CACHE_TIMEOUT=86400
+
+# Seconds to cache collection rollups (subcollection and part counts), also
+# cleared when collections or their parts change.
+COLLECTION_ROLLUPS_CACHE_TIMEOUT=3600
+
+# Seconds to cache tag usage counts, also cleared when tags are added or removed
+TAG_STATISTICS_CACHE_TIMEOUT=3600
+
+# Seconds to cache the progress (completed and failed parts) of each factory
+# order, also cleared when samples are created for its parts.
+FACTORYORDER_PROGRESS_CACHE_TIMEOUT=86400
+
+# Seconds to keep the dashboard statistics (counts for each model). Counts
+# are adjusted by signals, and recomputed by a job every interval (seconds).
+STATISTICS_CACHE_TIMEOUT=86400
+STATISTICS_RECOMPUTE_INTERVAL=3600
+
+# Tables with more than this many rows (by the postgres planner estimate)
+# use the estimate instead of an exact count. Set to None to always count.
+STATISTICS_ESTIMATE_ROWS=1000000
+
+# Seconds to cache public API responses (lists and details). Responses are
+# keyed on the versions of the models they show, this is an upper bound.
+API_RESPONSE_CACHE_TIMEOUT=300
+
 # Permissions and Views
 
 ## TODO: make limits here 
@@ -87,6 +126,7 @@ DATABASES = {
 
 VIEW_RATE_LIMIT="50/1d"  # The rate limit for each view, django-ratelimit, "50 per day per ipaddress)
 VIEW_RATE_LIMIT_BLOCK=True # Given that someone goes over, are they blocked for the period?
+RATELIMIT_USE_CACHE='shared' # Counters are kept in the shared (redis) cache, so all workers count together
 
 # Plugins
 # Add the name of a plugin under fg.plugins here to enable it
@@ -90,12 +90,47 @@ SENDFILE_BACKEND = 'sendfile.backends.development'
 PRIVATE_MEDIA_REDIRECT_HEADER = 'X-Accel-Redirect'
 CRISPY_TEMPLATE_PACK = 'bootstrap3'
 
+# The default cache is shared by all workers (redis, a different database
+# than the task queue), with a local (in process) tier for keys that include
+# a version, see fg.apps.base.cache. Change CACHE_VERSION to not use any
+# entries from an earlier deploy.
+
+CACHE_VERSION = int(os.getenv('CACHE_VERSION', 1))
+
 CACHES = {
             'default': {
+                'BACKEND': 'fg.apps.base.cache.TieredCache',
+                'OPTIONS': {
+                    'SHARED': 'shared',
+                    'LOCAL': 'local',
+                    'LOCAL_KEYS': ['api-response:', 'plate-map:', 'node-parts:',
+                                   'template.cache.catalog-'],
+                    'LOCAL_TIMEOUT': 300,
+                }
+            },
+            'shared': {
+                'BACKEND': 'django_redis.cache.RedisCache',
+                'LOCATION': os.getenv('CACHE_REDIS_URL', 'redis://redis/1'),
+                'KEY_PREFIX': 'fg',
+                'VERSION': CACHE_VERSION,
+                'OPTIONS': {
+                    'CLIENT_CLASS': 'django_redis.client.DefaultClient',
+                }
+            },
+            'local': {
                 'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                'KEY_PREFIX': 'fg',
+                'VERSION': CACHE_VERSION,
+                'OPTIONS': {
+                    'MAX_ENTRIES': 1000,
+                }
             }
 }
 
+# If redis is down, the cache misses (and views do the work) instead of failing
+DJANGO_REDIS_IGNORE_EXCEPTIONS = True
+DJANGO_REDIS_LOG_IGNORED_EXCEPTIONS = True
+
 # Static files (CSS, JavaScript, Images)
 # https://docs.djangoproject.com/en/1.9/howto/static-files/
 
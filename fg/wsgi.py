@@ -9,6 +9,8 @@ application = get_wsgi_application()
 import django_rq
 from datetime import datetime
 from fg.apps.main.utils import backup_db
+from fg.apps.main.statistics import recompute_statistics
+from fg.settings import STATISTICS_RECOMPUTE_INTERVAL
 scheduler = django_rq.get_scheduler('default')
 scheduled_jobs = list(scheduler.get_jobs())
 
@@ -23,3 +25,15 @@ if len(found_jobs) == 0:
         repeat=None,                      # Repeat this number of times (None means repeat forever)
         meta={'name': 'backup_db'}        # Arbitrary pickleable data on the job itself
     )
+
+# Do we have the statistics job?
+found_jobs = [x for x in scheduled_jobs if x.meta.get('name') == 'recompute_statistics']
+if len(found_jobs) == 0:
+    print("Scheduling statistics with django-rq...")
+    job = scheduler.schedule(
+        scheduled_time=datetime.utcnow(),
+        func=recompute_statistics,
+        interval=STATISTICS_RECOMPUTE_INTERVAL,
+        repeat=None,
+        meta={'name': 'recompute_statistics'}
+    )
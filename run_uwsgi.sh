@@ -7,6 +7,9 @@ python manage.py makemigrations orders
 python manage.py makemigrations factory
 python manage.py makemigrations
 python manage.py migrate
+python manage.py rebuild_container_paths --missing
+python manage.py rebuild_sample_lineage --missing
+python manage.py refresh_well_contents --missing
 python manage.py collectstatic --noinput
 service cron start
 